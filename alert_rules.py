@@ -0,0 +1,239 @@
+#!/usr/bin/env python
+"""Export the dashboards' legacy Grafana alerts as Prometheus alerting rules.
+
+Legacy alerts are evaluated by Grafana through the dashboard, where
+template variables such as ``$instance`` or ``$connection_threshold`` do
+not resolve. Prometheus evaluates the exported rules once, server-side:
+
+* variables with a fixed value (constants, custom and interval
+  variables, or values given with ``--set``) are replaced by that value;
+* remaining label matchers on variables are dropped, so the rule covers
+  every job, instance and environment and fires per series;
+* a condition whose query ends in a comparison, optionally filtered
+  with ``and``/``unless``, is used as the rule expression; otherwise the condition's reducer and evaluator become
+  ``<reducer>_over_time(query[range:]) <op> <threshold>``;
+* the alert ``frequency`` becomes the group ``interval`` and
+  ``gracePeriod`` becomes ``for``.
+
+Prometheus has no equivalent of ``noDataState``; alerts that should fire
+on missing data need an ``absent()`` rule of their own.
+
+Usage::
+
+    python alert_rules.py -o alerting_rules.yml
+    python alert_rules.py --set environment=production
+"""
+
+import argparse
+import collections
+import re
+import sys
+
+import attr
+
+import promql
+from dashboard_utils import (
+    dashboard_name, find_dashboards, load_module, module_alerts,
+)
+from promql_eval import substitute
+from rate_window import ALERT_WINDOW
+from recording_rules import dump_yaml
+
+
+# Values of Grafana's global variables outside a dashboard.
+GLOBAL_VARIABLES = {
+    '__rate_interval': ALERT_WINDOW,
+    '__interval': '1m',
+    '__range': '1h',
+}
+
+# Legacy reducers that have a range function equivalent. ``last`` reduces
+# to the query itself.
+REDUCERS = {
+    'avg': 'avg_over_time',
+    'min': 'min_over_time',
+    'max': 'max_over_time',
+    'sum': 'sum_over_time',
+    'count': 'count_over_time',
+    'count_non_null': 'count_over_time',
+    'last': None,
+}
+
+OPERATORS = {'and': 'and on()', 'or': 'or on()'}
+
+
+class ExportError(Exception):
+    """An alert that has no Prometheus equivalent."""
+
+
+def fixed_variables(dashboard, overrides=None):
+    """Values of the dashboard variables that do not depend on a selection."""
+    values = dict(GLOBAL_VARIABLES)
+    for template in dashboard.templating.list:
+        if template.type in ('constant', 'custom', 'interval', 'textbox'):
+            default = template.default or (template.query or '').split(',')[0].strip()
+            if default:
+                values[template.name] = default
+    values.update(overrides or {})
+    return values
+
+
+def resolve(expr, variables):
+    """``expr`` with ``variables`` substituted and other variable matchers dropped."""
+    node = promql.parse(substitute(expr, variables))
+
+    def drop(n):
+        if isinstance(n, promql.VectorSelector):
+            return attr.evolve(n, matchers=[m for m in n.matchers if not m.uses_variable()])
+        return n
+
+    node = promql.transform(node, drop)
+    for n in promql.walk(node):
+        if isinstance(n, promql.Variable) or '$' in str(getattr(n, 'range', '') or ''):
+            raise ExportError('unresolved variable in {}'.format(node))
+    return node
+
+
+def _threshold(value):
+    return '{:g}'.format(float(value))
+
+
+def _is_condition(node):
+    """Whether ``node`` already filters series, like ``x > 1`` or ``x > 1 and y``."""
+    top = promql.unwrap(node)
+    if not isinstance(top, promql.BinaryOp):
+        return False
+    if top.op in ('and', 'unless'):
+        return _is_condition(top.lhs)
+    return top.op in promql.COMPARISON_OPERATORS and not top.return_bool
+
+
+def condition_expr(condition, variables):
+    """Prometheus expression for one legacy alert condition."""
+    node = resolve(condition.target.expr, variables)
+    if _is_condition(node):
+        return str(node)
+
+    if condition.reducerType not in REDUCERS:
+        raise ExportError('reducer {!r} has no equivalent'.format(condition.reducerType))
+    func = REDUCERS[condition.reducerType]
+    if func is None:
+        reduced = str(node)
+    else:
+        window = (condition.timeRange.from_time if condition.timeRange else '5m')
+        reduced = '{}(({})[{}:])'.format(func, node, window)
+
+    evaluator = condition.evaluator
+    params = evaluator.params if isinstance(evaluator.params, (list, tuple)) else [evaluator.params]
+    if evaluator.type == 'gt':
+        return '{} > {}'.format(reduced, _threshold(params[0]))
+    if evaluator.type == 'lt':
+        return '{} < {}'.format(reduced, _threshold(params[0]))
+    if evaluator.type == 'within_range':
+        return '{0} > {1} and {0} < {2}'.format(reduced, *map(_threshold, params[:2]))
+    if evaluator.type == 'outside_range':
+        return '{0} < {1} or {0} > {2}'.format(reduced, *map(_threshold, params[:2]))
+    if evaluator.type == 'no_value':
+        return 'absent({})'.format(node)
+    raise ExportError('evaluator {!r} has no equivalent'.format(evaluator.type))
+
+
+def alert_expr(alert, variables):
+    """Combine the conditions of ``alert`` into one expression."""
+    expr = None
+    for condition in alert.alertConditions:
+        if condition.target is None:
+            continue
+        part = condition_expr(condition, variables)
+        if expr is None:
+            expr = part
+        else:
+            expr = '({}) {} ({})'.format(expr, OPERATORS[condition.operator], part)
+    if expr is None:
+        raise ExportError('no query conditions')
+    return expr
+
+
+def alert_name(name):
+    """``"High CPU Usage"`` -> ``"HighCPUUsage"``."""
+    return ''.join(w[:1].upper() + w[1:] for w in re.split(r'[^a-zA-Z0-9]+', name))
+
+
+def alerting_rule(alert, variables):
+    rule = collections.OrderedDict([
+        ('alert', alert_name(alert.name)),
+        ('expr', alert_expr(alert, variables)),
+    ])
+    if alert.gracePeriod:
+        rule['for'] = alert.gracePeriod
+    if alert.alertRuleTags:
+        rule['labels'] = collections.OrderedDict(sorted(alert.alertRuleTags.items()))
+    rule['annotations'] = collections.OrderedDict([
+        ('summary', alert.name),
+        ('description', alert.message),
+    ])
+    return rule
+
+
+def export_module(name, module, overrides=None):
+    """Return ``(groups, errors)`` for the alerts of a dashboard module.
+
+    Rules are grouped by evaluation frequency, one group per frequency.
+    """
+    variables = fixed_variables(module.dashboard, overrides)
+    by_interval = collections.OrderedDict()
+    errors = []
+    for alert in module_alerts(module):
+        try:
+            rule = alerting_rule(alert, variables)
+        except (ExportError, promql.PromQLError) as e:
+            errors.append('{}: {}: {}'.format(name, alert.name, e))
+            continue
+        by_interval.setdefault(alert.frequency, []).append(rule)
+    groups = []
+    for interval, rules in by_interval.items():
+        group = 'alerts:{}'.format(name)
+        if len(by_interval) > 1:
+            group += ':' + interval
+        groups.append(collections.OrderedDict([
+            ('name', group), ('interval', interval), ('rules', rules),
+        ]))
+    return groups, errors
+
+
+def main(args):
+    parser = argparse.ArgumentParser(prog='alert_rules')
+    parser.add_argument(
+        'dashboards', metavar='DASHBOARD', nargs='*',
+        help='Dashboard definitions (default: every *.dashboard.py)',
+    )
+    parser.add_argument(
+        '--output', '-o', help='Where to write the rules (default: stdout)',
+    )
+    parser.add_argument(
+        '--set', metavar='VAR=VALUE', action='append', default=[],
+        help='Value for a dashboard variable, e.g. environment=production',
+    )
+    opts = parser.parse_args(args)
+    overrides = dict(s.split('=', 1) for s in opts.set)
+
+    groups = []
+    errors = []
+    for path in opts.dashboards or find_dashboards():
+        module_groups, module_errors = export_module(
+            dashboard_name(path), load_module(path), overrides)
+        groups.extend(module_groups)
+        errors.extend(module_errors)
+
+    if opts.output:
+        with open(opts.output, 'w') as out:
+            dump_yaml({'groups': groups}, out)
+    else:
+        dump_yaml({'groups': groups}, sys.stdout)
+    for error in errors:
+        sys.stderr.write('skipped {}\n'.format(error))
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+"""Unit tests for the dashboard alerts, evaluated offline.
+
+Like ``promtool test rules``, each test gives input series and the alerts
+expected to be firing at given times. Tests are declared next to the
+alerts, in a ``create_*_alert_tests`` function of the dashboard module::
+
+    def create_redis_alert_tests():
+        return [
+            AlertTest(
+                alert="Redis High Memory Usage",
+                series={
+                    'redis_memory_used_bytes{instance="a"}': '950x15',
+                    'redis_memory_max_bytes{instance="a"}': '1000x15',
+                },
+                firing=[('4m', []), ('5m', [{'instance': 'a'}])],
+            ),
+        ]
+
+Series values use promtool's notation: ``a+bxn`` is ``n + 1`` samples
+starting at ``a`` and growing by ``b``, ``axn`` repeats ``a`` and ``_``
+is a missed scrape. Samples are ``interval`` apart from time 0.
+
+Alerts are exported as with ``alert_rules.py`` and evaluated with the
+local evaluator at the alert's frequency, honouring its ``for`` period.
+The module's ``create_*_recording_rules`` are recorded first, every
+``interval``, so alerts may read recorded series.
+Expected labels are the full label set of the alert, without
+``alertname``.
+
+Usage::
+
+    python alert_tests.py            # run the tests of every dashboard
+"""
+
+import argparse
+import re
+import sys
+
+import attr
+
+import promql
+from alert_rules import alerting_rule, fixed_variables
+from dashboard_utils import (
+    dashboard_name, find_dashboards, load_module, module_alerts,
+)
+from promql_eval import Evaluator, record
+from recording_rules import module_recording_rules
+from tsdb import MemoryTSDB, label_key
+
+
+_VALUES_RE = re.compile(
+    r'^(?P<start>[-+]?[0-9.]+(?:e[-+]?\d+)?)'
+    r'(?:(?P<sign>[-+])(?P<step>[0-9.]+(?:e[-+]?\d+)?))?x(?P<count>\d+)$')
+
+
+@attr.s
+class AlertTest(object):
+    """Input series and expected firing alerts for one alert.
+
+    :param alert: name of the alert under test
+    :param series: series selector -> values in promtool notation
+    :param firing: ``(time, [labels])`` pairs of the alerts expected to be
+        firing at ``time``, relative to the first sample
+    :param interval: time between input samples
+    :param variables: dashboard variable values, as ``alert_rules --set``;
+        constants default to the dashboard's values
+    """
+
+    alert = attr.ib()
+    series = attr.ib()
+    firing = attr.ib()
+    interval = attr.ib(default='1m')
+    variables = attr.ib(default=attr.Factory(dict))
+
+
+def expand_values(text):
+    """``"0+10x3 _ 5"`` -> ``[0, 10, 20, 30, None, 5]``."""
+    values = []
+    for token in text.split():
+        if token == '_':
+            values.append(None)
+            continue
+        if token.startswith('_x'):
+            values.extend([None] * int(token[2:]))
+            continue
+        m = _VALUES_RE.match(token)
+        if not m:
+            values.append(float(token))
+            continue
+        start = float(m.group('start'))
+        step = float(m.group('step') or 0) * (-1 if m.group('sign') == '-' else 1)
+        values.extend(start + step * i for i in range(int(m.group('count')) + 1))
+    return values
+
+
+def load_series(series, interval):
+    """A ``MemoryTSDB`` holding ``series``, sampled every ``interval`` seconds."""
+    db = MemoryTSDB()
+    for selector, text in series.items():
+        node = promql.parse(selector)
+        labels = dict((m.label, m.value) for m in node.matchers)
+        labels['__name__'] = node.metric
+        target = db.series(labels)
+        for i, value in enumerate(expand_values(text)):
+            if value is not None:
+                target.append(i * interval, value)
+    return db
+
+
+def firing_alerts(rule, db, interval, until):
+    """``{time: set(label keys)}`` of firing alerts at each evaluation."""
+    evaluator = Evaluator(db)
+    hold = promql.parse_duration(rule['for']) if 'for' in rule else 0
+    extra = rule.get('labels', {})
+    node = promql.parse(rule['expr'])
+    active = {}
+    states = {}
+    t = 0
+    while t <= until:
+        result = evaluator.eval(node, t)
+        current = {}
+        for labels, _ in (result if isinstance(result, list) else []):
+            labels = dict((k, v) for k, v in labels.items() if k != '__name__')
+            labels.update(extra)
+            key = label_key(labels)
+            current[key] = active.get(key, t)
+        active = current
+        states[t] = set(k for k, since in active.items() if t - since >= hold)
+        t += interval
+    return states
+
+
+def run_test(test, alert, dashboard, recording_rules=None):
+    """Return failure messages for ``test`` of ``alert`` on ``dashboard``.
+
+    ``recording_rules`` maps recorded series the alert may read to their
+    expressions.
+    """
+    rule = alerting_rule(alert, fixed_variables(dashboard, test.variables))
+    interval = promql.parse_duration(test.interval)
+    db = load_series(test.series, interval)
+    every = promql.parse_duration(alert.frequency)
+    checks = [(promql.parse_duration(t), expected) for t, expected in test.firing]
+    until = max(t for t, _ in checks)
+    for name, expr in (recording_rules or {}).items():
+        record(db, name, expr, 0, until, interval)
+    states = firing_alerts(rule, db, every, until)
+    failures = []
+    for t, expected in checks:
+        # Alerts keep the state of the last evaluation before ``t``.
+        evaluated = max(s for s in states if s <= t)
+        got = states[evaluated]
+        want = set(label_key(labels) for labels in expected)
+        if got != want:
+            failures.append('{} at {}: expected {}, got {}'.format(
+                alert.name, promql.format_duration(t),
+                _format(want), _format(got)))
+    return failures
+
+
+def _format(keys):
+    return '[{}]'.format(', '.join(
+        '{' + ', '.join('{}="{}"'.format(k, v) for k, v in key) + '}'
+        for key in sorted(keys)))
+
+
+def module_alert_tests(module):
+    """Return the tests built by the module's ``create_*_alert_tests`` functions."""
+    tests = []
+    for name in sorted(dir(module)):
+        fn = getattr(module, name)
+        if name.startswith('create_') and name.endswith('_alert_tests') and callable(fn):
+            tests.extend(fn())
+    return tests
+
+
+def test_module(name, module):
+    """Run the alert tests of a module; return ``(tests run, failures)``."""
+    alerts = dict((a.name, a) for a in module_alerts(module))
+    tests = module_alert_tests(module)
+    recording_rules = module_recording_rules(module)
+    failures = []
+    for test in tests:
+        alert = alerts.get(test.alert)
+        if alert is None:
+            failures.append('{}: no alert named {!r}'.format(name, test.alert))
+            continue
+        failures.extend('{}: {}'.format(name, f)
+                        for f in run_test(test, alert, module.dashboard, recording_rules))
+    return len(tests), failures
+
+
+def main(args):
+    parser = argparse.ArgumentParser(prog='alert_tests')
+    parser.add_argument(
+        'dashboards', metavar='DASHBOARD', nargs='*',
+        help='Dashboard definitions (default: every *.dashboard.py)',
+    )
+    opts = parser.parse_args(args)
+
+    total = 0
+    failures = []
+    for path in opts.dashboards or find_dashboards():
+        count, module_failures = test_module(dashboard_name(path), load_module(path))
+        total += count
+        failures.extend(module_failures)
+    for failure in failures:
+        sys.stdout.write('FAIL {}\n'.format(failure))
+    sys.stdout.write('{} alert tests, {} failures\n'.format(total, len(failures)))
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,516 @@
+#!/usr/bin/env python
+"""Offline query-latency benchmark for the dashboards.
+
+A synthetic in-memory TSDB is filled with series shaped like the node,
+mysqld and redis exporter metrics the dashboards query, for ``N``
+instances. Every panel target is then evaluated as a Grafana range query
+over the dashboard's default time range, and the latency, samples touched,
+series returned and peak memory are reported per panel and per dashboard.
+
+Results can be saved and compared against a previous run to catch
+regressions between revisions::
+
+    python bench.py --instances 20 -o bench/HEAD.json
+    python bench.py --instances 20 --baseline bench/HEAD.json
+
+``--range`` replaces the dashboards' default time range. The series
+read in long-range mode (see ``long_range.py``) are then recorded from
+the synthetic ones, as Prometheus would record them::
+
+    python bench.py --range 7d --scrape-interval 1m
+"""
+
+import argparse
+import json
+import math
+import random
+import re
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import attr
+
+import promql
+from dashboard_utils import (
+    dashboard_name, find_dashboards, iter_loaded_panels, iter_module_targets,
+    iter_panels, load_module,
+)
+from lint import metric_type
+from promql_eval import Evaluator, record, substitute
+from recording_rules import DOWNSAMPLE_INTERVAL, module_recording_rules
+from tsdb import MemoryTSDB
+
+
+DEFAULT_INSTANCES = 10
+DEFAULT_SCRAPE_INTERVAL = '15s'
+# Evaluation interval of the recording rules; Prometheus' default.
+RULE_INTERVAL = '1m'
+# Fixed "now" so runs are reproducible.
+NOW = 1700000000.0
+ENVIRONMENTS = ('production', 'staging', 'development')
+
+# Extra label dimensions of the exporter metrics, by metric name pattern.
+LABEL_DIMENSIONS = [
+    (r'^mysql_global_status_buffer_pool_pages$',
+     {'state': ['data', 'free', 'misc']}),
+    (r'^mysql_global_status_commands_total$',
+     {'command': ['select', 'insert', 'update', 'delete', 'begin', 'commit',
+                  'set_option', 'show_status']}),
+    (r'^mysql_global_status_connection_errors_total$',
+     {'error': ['accept', 'internal', 'max_connections', 'peer_address',
+                'select', 'tcpwrap']}),
+    (r'^system_network_', {'interface': ['eth0', 'eth1', 'lo']}),
+    (r'^go_gc_duration_seconds$', {'quantile': ['0', '0.25', '0.5', '0.75', '1']}),
+    (r'^node_filesystem_', {'mountpoint': ['/', '/var', '/data'], 'fstype': ['ext4']}),
+    (r'^node_disk_', {'device': ['sda', 'sdb', 'nvme0n1']}),
+    (r'^redis_commands_(duration_seconds_)?total$',
+     {'cmd': ['get', 'set', 'del', 'hget', 'hset', 'lpush', 'rpop', 'expire']}),
+]
+
+# (job, port) of the exporter that exposes a metric, by name prefix.
+EXPORTERS = [
+    ('mysql_', 'mysql', 9104),
+    ('redis_', 'redis', 9121),
+    ('', 'node', 9100),
+]
+
+_LABEL_VALUES_RE = re.compile(r'^\s*label_values\((?:(.*),\s*)?(\w+)\)\s*$')
+_QUERY_RESULT_RE = re.compile(r'^\s*query_result\((.*)\)\s*$')
+
+
+def _exporter(metric):
+    for prefix, job, port in EXPORTERS:
+        if metric.startswith(prefix):
+            return job, port
+
+
+def _dimensions(metric):
+    combos = [{}]
+    for pattern, dims in LABEL_DIMENSIONS:
+        if re.search(pattern, metric):
+            for label, values in dims.items():
+                combos = [dict(c, **{label: v}) for c in combos for v in values]
+    return combos
+
+
+def generate(db, metrics, instances, start, end, scrape, seed=0):
+    """Fill ``db`` with synthetic series for ``metrics``.
+
+    Counters grow at a random per-series rate; gauges oscillate around a
+    random base value. ``*_up`` metrics are always 1.
+    """
+    rng = random.Random(seed)
+    steps = int((end - start) // scrape) + 1
+    for metric in sorted(metrics):
+        job, port = _exporter(metric)
+        counter = metric_type(metric) == 'counter'
+        for i in range(instances):
+            base_labels = {
+                '__name__': metric,
+                'job': job,
+                'instance': 'host-{:03d}:{}'.format(i, port),
+                'environment': ENVIRONMENTS[i % len(ENVIRONMENTS)],
+            }
+            for extra in _dimensions(metric):
+                series = db.series(dict(base_labels, **extra))
+                base = rng.uniform(1, 1000)
+                phase = rng.uniform(0, 2 * math.pi)
+                value = rng.uniform(0, 1e6) if counter else base
+                for n in range(steps):
+                    t = start + n * scrape
+                    if metric.endswith('_up'):
+                        value = 1.0
+                    elif counter:
+                        value += base * scrape * rng.uniform(0.5, 1.5)
+                    else:
+                        value = base * (1 + 0.2 * math.sin(t / 900.0 + phase))
+                    series.append(t, value)
+    return db
+
+
+def record_rules(db, module, start, end):
+    """Add the series of the module's ``create_*_recording_rules`` to ``db``.
+
+    Rules are evaluated every ``RULE_INTERVAL`` from ``start`` to ``end``.
+    """
+    step = promql.parse_duration(RULE_INTERVAL)
+    for name, expr in module_recording_rules(module).items():
+        record(db, name, expr, start, end, step)
+    return db
+
+
+def record_downsampled(db, dashboard, start, end):
+    """Add the series ``dashboard`` reads in long-range mode to ``db``.
+
+    Each recorded expression and its downsampled series are evaluated
+    every ``DOWNSAMPLE_INTERVAL`` from ``start`` to ``end``.
+    """
+    step = promql.parse_duration(DOWNSAMPLE_INTERVAL)
+    for name, (expr, template) in (getattr(dashboard, 'downsampled', None) or {}).items():
+        recorded = name + '_recorded'
+        record(db, recorded, expr, start, end, step)
+        record(db, name, template.format(recorded), start, end, step)
+    return db
+
+
+def relative_time(text, now=NOW):
+    """``"now-3h"`` -> a timestamp relative to ``now``."""
+    if text == 'now':
+        return now
+    m = re.match(r'^now-(\w+)$', text)
+    if not m:
+        raise ValueError('unsupported time {!r}'.format(text))
+    return now - promql.parse_duration(m.group(1))
+
+
+def dashboard_metrics(module):
+    """Metric names used by the module's targets, template variables and rules."""
+    metrics = set()
+    exprs = [t.expr for _, _, t in iter_module_targets(module) if t.expr]
+    exprs.extend(module_recording_rules(module).values())
+    for template in module.dashboard.templating.list:
+        m = _LABEL_VALUES_RE.match(template.query or '')
+        if m and m.group(1):
+            exprs.append(m.group(1))
+    for expr in exprs:
+        try:
+            node = promql.parse(expr)
+        except promql.PromQLError:
+            continue
+        # Names with a colon are recording rules, which are not synthesized.
+        metrics.update(n for n in promql.metric_names(node) if ':' not in n)
+    return metrics
+
+
+def label_values(db, query, variables):
+    """Resolve a ``label_values(...)`` variable query.
+
+    Returns ``(values, series_touched)``.
+    """
+    m = _LABEL_VALUES_RE.match(substitute(query, variables))
+    if not m:
+        return [], 0
+    selector, label = m.groups()
+    if selector:
+        node = promql.parse(selector)
+        series = db.select(node.metric, node.matchers)
+    else:
+        series = [s for metric in db.metrics() for s in db.select(metric, [])]
+    return sorted(set(s.labels[label] for s in series if label in s.labels)), len(series)
+
+
+def query_result(db, query, variables):
+    """Resolve a ``query_result(...)`` variable query at ``NOW``.
+
+    Values are formatted as Grafana lists them, ``name{labels} value
+    timestamp``. Returns ``(values, samples_read)``.
+    """
+    m = _QUERY_RESULT_RE.match(substitute(query, variables))
+    if not m:
+        return [], 0
+    evaluator = Evaluator(db)
+    result = evaluator.query(m.group(1), NOW)
+    if not isinstance(result, list):
+        result = [({}, result)]
+    values = []
+    for labels, value in result:
+        pairs = ', '.join('{}="{}"'.format(k, v) for k, v in sorted(labels.items())
+                          if k != '__name__')
+        values.append('{}{{{}}} {:g} {}'.format(
+            labels.get('__name__', ''), pairs, value, int(NOW * 1000)))
+    return values, evaluator.samples
+
+
+def variable_regex(template):
+    """Compiled ``regex`` option of ``template``, or ``None``."""
+    regex = template.regex
+    if not regex:
+        return None
+    m = re.match(r'^/(.*)/([a-z]*)$', regex)
+    if m:
+        regex, flags = m.groups()
+        return re.compile(regex, re.IGNORECASE if 'i' in flags else 0)
+    return re.compile(regex)
+
+
+def range_variables(start, end):
+    """Grafana's ``$__range`` variables for the time range ``start``-``end``."""
+    return {
+        '__range': promql.format_duration(end - start),
+        '__range_s': '{:d}'.format(int(end - start)),
+        '__range_ms': '{:d}'.format(int((end - start) * 1000)),
+    }
+
+
+def resolve_variables(dashboard, db, select_all=True, builtins=None):
+    """Pick values for the dashboard's template variables.
+
+    Query variables are resolved against ``db`` and filtered by their
+    regex. "All" and multi-value variables select every value, as the
+    default Grafana selection would, unless ``select_all`` is false, in
+    which case every variable selects its first value. ``builtins`` gives
+    Grafana's global variables, such as ``range_variables``.
+    Returns ``(variables, series_touched)``.
+    """
+    variables = dict(builtins or {})
+    touched = {}
+    for template in dashboard.templating.list:
+        if template.type == 'datasource':
+            continue
+        if template.type == 'query':
+            if _QUERY_RESULT_RE.match(template.query or ''):
+                values, touched[template.name] = query_result(db, template.query, variables)
+            else:
+                values, touched[template.name] = label_values(db, template.query, variables)
+            regex = variable_regex(template)
+            if regex is not None:
+                # Like Grafana, a capture group selects the part kept.
+                matches = [(v, regex.search(v)) for v in values]
+                values = [m.group(1) if regex.groups else v for v, m in matches if m]
+            if select_all and (template.includeAll or template.multi):
+                value = '(' + '|'.join(re.escape(v) for v in values) + ')'
+            else:
+                value = values[0] if values else ''
+        elif template.type == 'constant':
+            value = template.default or template.query
+        else:
+            options = [o.strip() for o in (template.query or '').split(',') if o.strip()]
+            value = template.default or (options[0] if options else '')
+        variables[template.name] = value
+    return variables, touched
+
+
+def min_interval(panel, scrape, variables=None):
+    """The panel's min interval: its ``interval``, or else ``scrape``."""
+    interval = substitute(getattr(panel, 'interval', None) or '', variables or {})
+    if interval and '$' not in interval:
+        return promql.parse_duration(interval)
+    return scrape
+
+
+def panel_step(panel, seconds, scrape, variables=None):
+    """The query step Grafana would use for ``panel``."""
+    points = getattr(panel, 'maxDataPoints', None) or 100
+    return max(seconds / points, min_interval(panel, scrape, variables))
+
+
+@attr.s
+class PanelResult(object):
+    dashboard = attr.ib()
+    panel = attr.ib()
+    queries = attr.ib(default=0)
+    seconds = attr.ib(default=0.0)
+    samples = attr.ib(default=0)
+    series = attr.ib(default=0)
+    points = attr.ib(default=0)
+    peak_bytes = attr.ib(default=0)
+    errors = attr.ib(default=attr.Factory(list))
+
+
+def _run_target(evaluator, expr, start, end, step, instant):
+    if instant:
+        value = evaluator.query(expr, end)
+        if isinstance(value, list):
+            return {i: [(end, v)] for i, (_, v) in enumerate(value)}
+        return {(): [(end, value)]}
+    return evaluator.query_range(expr, start, end, step)
+
+
+def bench_dashboard(name, dashboard, db, scrape, measure_memory=True, now=NOW,
+                    expand_rows=False, time_range=None):
+    """Evaluate the panels of ``dashboard``; return ``PanelResult``s.
+
+    Panels in collapsed rows are skipped, as on dashboard load, unless
+    ``expand_rows`` is set. ``time_range``, such as ``'7d'``, replaces the
+    dashboard's default time range.
+    """
+    start = relative_time(dashboard.time.start, now)
+    end = relative_time(dashboard.time.end, now)
+    if time_range:
+        start, end = now - promql.parse_duration(time_range), now
+    variables, _ = resolve_variables(dashboard, db, builtins=range_variables(start, end))
+    results = []
+    panels = iter_panels(dashboard) if expand_rows else iter_loaded_panels(dashboard)
+    for panel in panels:
+        targets = [t for t in getattr(panel, 'targets', []) if t.expr and not t.hide]
+        if not targets:
+            continue
+        step = panel_step(panel, end - start, scrape, variables)
+        minimum = min_interval(panel, scrape, variables)
+        panel_vars = dict(variables)
+        panel_vars.update({
+            '__interval': promql.format_duration(step),
+            '__rate_interval': promql.format_duration(max(step + minimum, 4 * minimum)),
+        })
+        result = PanelResult(name, panel.title, queries=len(targets))
+        for target in targets:
+            expr = substitute(target.expr, panel_vars)
+            evaluator = Evaluator(db)
+            if measure_memory:
+                tracemalloc.start()
+            t0 = time.perf_counter()
+            try:
+                out = _run_target(evaluator, expr, start, end, step, target.instant)
+            except Exception as e:
+                result.errors.append('{}: {}'.format(target.refId, e))
+                out = {}
+            result.seconds += time.perf_counter() - t0
+            if measure_memory:
+                result.peak_bytes = max(result.peak_bytes, tracemalloc.get_traced_memory()[1])
+                tracemalloc.stop()
+            result.samples += evaluator.samples
+            result.series += len(out)
+            result.points += sum(len(v) for v in out.values())
+        results.append(result)
+    return results
+
+
+def summarize(results):
+    """Per-dashboard totals."""
+    totals = {}
+    for r in results:
+        total = totals.setdefault(r.dashboard, PanelResult(r.dashboard, None))
+        total.queries += r.queries
+        total.seconds += r.seconds
+        total.samples += r.samples
+        total.series += r.series
+        total.points += r.points
+        total.peak_bytes = max(total.peak_bytes, r.peak_bytes)
+        total.errors.extend(r.errors)
+    return list(totals.values())
+
+
+def write_table(results, stream):
+    row = '{:<16} {:<34} {:>4} {:>10} {:>10} {:>7} {:>10}\n'
+    stream.write(row.format('dashboard', 'panel', 'qry', 'latency', 'samples',
+                            'series', 'peak'))
+    for r in results + summarize(results):
+        stream.write(row.format(
+            r.dashboard, (r.panel or 'TOTAL')[:34], r.queries,
+            '{:.1f}ms'.format(r.seconds * 1000), r.samples, r.series,
+            '{:.1f}KiB'.format(r.peak_bytes / 1024.0)))
+        for error in r.errors if r.panel else ():
+            stream.write('    error: {}\n'.format(error))
+
+
+def revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, threshold, latency_threshold):
+    """Return regression messages against a saved ``baseline`` run."""
+    before = dict(((p['dashboard'], p['panel']), p) for p in baseline['panels'])
+    messages = []
+    for r in results:
+        old = before.get((r.dashboard, r.panel))
+        if old is None:
+            continue
+        checks = [('samples', r.samples, threshold),
+                  ('peak_bytes', r.peak_bytes, threshold),
+                  ('seconds', r.seconds, latency_threshold)]
+        for field, new, limit in checks:
+            if old[field] and new > old[field] * (1 + limit):
+                messages.append('{} / {}: {} {:g} -> {:g} (+{:.0f}%)'.format(
+                    r.dashboard, r.panel, field, old[field], new,
+                    (new / old[field] - 1) * 100))
+    return messages
+
+
+def main(args):
+    parser = argparse.ArgumentParser(prog='bench')
+    parser.add_argument(
+        'dashboards', metavar='DASHBOARD', nargs='*',
+        help='Dashboard definitions (default: every *.dashboard.py)',
+    )
+    parser.add_argument(
+        '--instances', '-n', type=int, default=DEFAULT_INSTANCES,
+        help='Synthetic instances per exporter (default: %(default)s)',
+    )
+    parser.add_argument(
+        '--scrape-interval', default=DEFAULT_SCRAPE_INTERVAL,
+        help='Synthetic scrape interval (default: %(default)s)',
+    )
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument(
+        '--no-memory', action='store_true',
+        help='Skip peak memory tracking, which slows evaluation down',
+    )
+    parser.add_argument(
+        '--expand-rows', action='store_true',
+        help='Also evaluate panels in collapsed rows',
+    )
+    parser.add_argument(
+        '--range',
+        help="Time range to query, e.g. 7d (default: each dashboard's own)",
+    )
+    parser.add_argument('--output', '-o', help='Save results as JSON')
+    parser.add_argument('--baseline', help='Compare against saved results')
+    parser.add_argument(
+        '--threshold', type=float, default=0.1,
+        help='Allowed growth of samples and memory (default: %(default)s)',
+    )
+    parser.add_argument(
+        '--latency-threshold', type=float, default=0.5,
+        help='Allowed growth of latency (default: %(default)s)',
+    )
+    opts = parser.parse_args(args)
+
+    scrape = promql.parse_duration(opts.scrape_interval)
+    modules = [(dashboard_name(p), load_module(p))
+               for p in opts.dashboards or find_dashboards()]
+    metrics = set()
+    earliest = NOW
+    for _, module in modules:
+        metrics |= dashboard_metrics(module)
+        earliest = min(earliest, relative_time(module.dashboard.time.start))
+    if opts.range:
+        earliest = NOW - promql.parse_duration(opts.range)
+    # Extra hour for lookback and range windows at the start of the range.
+    db = generate(MemoryTSDB(), metrics, opts.instances, earliest - 3600, NOW,
+                  scrape, opts.seed)
+    for _, module in modules:
+        record_rules(db, module, earliest - 3600, NOW)
+        if opts.range:
+            record_downsampled(db, module.dashboard, earliest - 3600, NOW)
+    sys.stderr.write('generated {} series, {} samples\n'.format(len(db), db.samples()))
+
+    results = []
+    for name, module in modules:
+        results.extend(bench_dashboard(name, module.dashboard, db, scrape,
+                                       not opts.no_memory, expand_rows=opts.expand_rows,
+                                       time_range=opts.range))
+    write_table(results, sys.stdout)
+
+    if opts.output:
+        with open(opts.output, 'w') as out:
+            json.dump({
+                'revision': revision(),
+                'instances': opts.instances,
+                'scrape_interval': opts.scrape_interval,
+                'range': opts.range,
+                'seed': opts.seed,
+                'panels': [attr.asdict(r) for r in results],
+                'dashboards': [attr.asdict(r) for r in summarize(results)],
+            }, out, indent=2, sort_keys=True)
+            out.write('\n')
+
+    if opts.baseline:
+        with open(opts.baseline) as f:
+            regressions = compare(results, json.load(f), opts.threshold,
+                                  opts.latency_threshold)
+        for message in regressions:
+            sys.stdout.write('REGRESSION {}\n'.format(message))
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+"""Build every ``*.dashboard.py`` module into Grafana JSON in one run.
+
+Modules are built in a process pool, so grafanalib is imported once per
+worker instead of once per dashboard. Outputs whose inputs have not
+changed since the last build are skipped (see ``build_cache``).
+
+Usage::
+
+    python build.py                 # every dashboard below the current dir
+    python build.py -o out/ -j 8 redis.dashboard.py mysql.dashboard.py
+    python build.py -o out/ --stale # list outputs that need rebuilding
+    python build.py --compact       # minified JSON without Grafana defaults
+    python build.py --tag database  # only dashboards registered with the tag
+"""
+
+import argparse
+import concurrent.futures
+import os
+import sys
+import time
+import traceback
+
+import attr
+from grafanalib._gen import write_dashboard
+
+from build_cache import DEFAULT_CACHE_FILE, BuildCache, build_key
+from compact import write_compact_dashboard
+from dashboard_utils import dashboard_name, find_dashboards, load_dashboard
+from registry import load_specs
+
+
+@attr.s
+class BuildResult(object):
+    """Outcome of building one dashboard module."""
+
+    source = attr.ib()
+    output = attr.ib()
+    seconds = attr.ib(default=0.0)
+    error = attr.ib(default=None)
+    skipped = attr.ib(default=False)
+    reason = attr.ib(default=None)
+    # Sizes of the default and the written JSON, for compact builds.
+    full_size = attr.ib(default=None)
+    size = attr.ib(default=None)
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+def output_path(source, output_dir=None):
+    """Where the JSON for ``source`` is written.
+
+    Without ``output_dir`` the JSON is written next to the module, like
+    grafanalib's ``generate-dashboards``.
+    """
+    name = dashboard_name(source) + '.json'
+    if output_dir is None:
+        return os.path.join(os.path.dirname(source), name)
+    return os.path.join(output_dir, name)
+
+
+def build_one(source, output, compact=False):
+    """Build ``source`` and write its JSON to ``output``."""
+    start = time.perf_counter()
+    sizes = (None, None)
+    try:
+        dashboard = load_dashboard(source)
+        with open(output, 'w') as out:
+            if compact:
+                sizes = write_compact_dashboard(dashboard, out)
+            else:
+                write_dashboard(dashboard, out)
+    except Exception:
+        return BuildResult(source, output, time.perf_counter() - start,
+                           traceback.format_exc())
+    return BuildResult(source, output, time.perf_counter() - start,
+                       full_size=sizes[0], size=sizes[1])
+
+
+def build_params(opts):
+    """Options that change the generated JSON; part of the cache key."""
+    params = {}
+    if opts.compact:
+        params['compact'] = True
+    return params
+
+
+def plan(sources, output_dir=None, cache=None, params=None):
+    """Return a ``BuildResult`` per source, marking fresh outputs as skipped.
+
+    Results that are not skipped say why they are stale in ``reason``.
+    """
+    results = []
+    for source in sources:
+        output = output_path(source, output_dir)
+        reason = 'no cache'
+        if cache is not None:
+            reason = cache.stale_reason(source, output, build_key(source, params))
+        results.append(BuildResult(source, output, skipped=reason is None,
+                                   reason=reason))
+    return results
+
+
+def build_all(sources, output_dir=None, jobs=None, cache=None, params=None):
+    """Build the stale ``sources`` in a process pool.
+
+    Returns results in input order; fresh outputs are reported as skipped.
+    When ``cache`` is given it is updated and saved.
+    """
+    if output_dir is not None:
+        os.makedirs(output_dir, exist_ok=True)
+    planned = plan(sources, output_dir, cache, params)
+    stale = [r for r in planned if not r.skipped]
+    compact = bool((params or {}).get('compact'))
+    if jobs == 1 or len(stale) <= 1:
+        built = [build_one(r.source, r.output, compact) for r in stale]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+            built = list(pool.map(build_one, [r.source for r in stale],
+                                  [r.output for r in stale],
+                                  [compact] * len(stale)))
+    for result, before in zip(built, stale):
+        result.reason = before.reason
+        if cache is not None:
+            if result.ok:
+                cache.record(result.source, result.output,
+                             build_key(result.source, params))
+            else:
+                cache.forget(result.output)
+    if cache is not None:
+        cache.save()
+    by_output = dict((r.output, r) for r in built)
+    return [by_output.get(r.output, r) for r in planned]
+
+
+def report(results, stream):
+    for result in results:
+        if result.skipped:
+            stream.write('{:>9}  {:<6}  {} -> {}\n'.format(
+                '-', 'fresh', result.source, result.output))
+            continue
+        status = 'ok' if result.ok else 'FAILED'
+        stream.write('{:>8.3f}s  {:<6}  {} -> {}\n'.format(
+            result.seconds, status, result.source, result.output))
+        if not result.ok:
+            stream.write(result.error)
+        elif result.size is not None:
+            stream.write('{:>9}  {:<6}  {} -> {} bytes ({:.0%} smaller)\n'.format(
+                '', '', result.full_size, result.size,
+                1 - float(result.size) / result.full_size))
+    failed = sum(1 for r in results if not r.ok)
+    skipped = sum(1 for r in results if r.skipped)
+    stream.write('{} built, {} skipped, {} failed, {:.3f}s total build time\n'.format(
+        len(results) - failed - skipped, skipped, failed,
+        sum(r.seconds for r in results)))
+
+
+def main(args):
+    parser = argparse.ArgumentParser(prog='build')
+    parser.add_argument(
+        'dashboards', metavar='DASHBOARD', nargs='*',
+        help='Dashboard definitions (default: every *.dashboard.py)',
+    )
+    parser.add_argument(
+        '--output-dir', '-o',
+        help='Directory for the JSON files (default: next to each module)',
+    )
+    parser.add_argument(
+        '--jobs', '-j', type=int, default=None,
+        help='Number of worker processes (default: CPU count)',
+    )
+    parser.add_argument(
+        '--cache',
+        help='Build cache file (default: {} in the output dir)'.format(
+            DEFAULT_CACHE_FILE),
+    )
+    parser.add_argument(
+        '--no-cache', action='store_true',
+        help='Rebuild every dashboard and leave the cache untouched',
+    )
+    parser.add_argument(
+        '--compact', action='store_true',
+        help='Write minified JSON without fields at Grafana defaults',
+    )
+    parser.add_argument(
+        '--stale', action='store_true',
+        help='Only list the outputs that need rebuilding, and why',
+    )
+    parser.add_argument(
+        '--tag', action='append', default=[],
+        help='Only build dashboards registered with this tag (repeatable)',
+    )
+    opts = parser.parse_args(args)
+
+    sources = opts.dashboards or find_dashboards()
+    if opts.tag:
+        # Importing the modules only registers their factories.
+        sources = [s.path for s in load_specs(sources, opts.tag)]
+    if not sources:
+        sys.stderr.write('ERROR: no *.dashboard.py modules found\n')
+        return 1
+    cache = None
+    if not opts.no_cache:
+        cache = BuildCache.load(opts.cache or os.path.join(
+            opts.output_dir or '.', DEFAULT_CACHE_FILE))
+    params = build_params(opts)
+
+    if opts.stale:
+        for result in plan(sources, opts.output_dir, cache, params):
+            if not result.skipped:
+                sys.stdout.write('{}\t{}\n'.format(result.output, result.reason))
+        return 0
+
+    results = build_all(sources, opts.output_dir, opts.jobs, cache, params)
+    report(results, sys.stderr)
+    return 0 if all(r.ok for r in results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
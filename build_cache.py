@@ -0,0 +1,138 @@
+"""Content-hash cache for incremental dashboard builds.
+
+A dashboard output is fresh when the hash of its module source (and of
+the local modules it imports), the installed grafanalib version and the
+build parameters all match the entry recorded when it was last written,
+and the output file itself is unchanged since then.
+"""
+
+import ast
+import hashlib
+import json
+import os
+
+import attr
+
+try:
+    from importlib.metadata import version as _package_version
+except ImportError:  # Python < 3.8
+    from pkg_resources import get_distribution
+
+    def _package_version(name):
+        return get_distribution(name).version
+
+
+CACHE_VERSION = 1
+DEFAULT_CACHE_FILE = '.build-cache.json'
+
+
+def grafanalib_version():
+    try:
+        return _package_version('grafanalib')
+    except Exception:
+        return 'unknown'
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def local_imports(source):
+    """Return the paths of modules next to ``source`` that it imports.
+
+    Imports are followed transitively, so a change to a shared helper
+    invalidates every dashboard that uses it.
+    """
+    seen = []
+    pending = [source]
+    while pending:
+        path = pending.pop()
+        directory = os.path.dirname(os.path.abspath(path))
+        with open(path) as f:
+            tree = ast.parse(f.read(), path)
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                names = [a.name for a in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+                names = [node.module]
+            else:
+                continue
+            for name in names:
+                candidate = os.path.join(directory, name.split('.')[0] + '.py')
+                if os.path.isfile(candidate) and candidate not in seen:
+                    seen.append(candidate)
+                    pending.append(candidate)
+    return sorted(seen)
+
+
+def build_key(source, params=None):
+    """Hash everything that influences the JSON generated from ``source``."""
+    payload = {
+        'cache': CACHE_VERSION,
+        'source': file_hash(source),
+        'imports': dict((os.path.basename(p), file_hash(p))
+                        for p in local_imports(source)),
+        'grafanalib': grafanalib_version(),
+        'params': params or {},
+    }
+    data = json.dumps(payload, sort_keys=True).encode('utf-8')
+    return hashlib.sha256(data).hexdigest()
+
+
+@attr.s
+class BuildCache(object):
+    """Build keys and output hashes from previous runs, keyed by output path."""
+
+    path = attr.ib()
+    entries = attr.ib(default=attr.Factory(dict))
+
+    @classmethod
+    def load(cls, path):
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (IOError, ValueError):
+            return cls(path)
+        if data.get('version') != CACHE_VERSION:
+            return cls(path)
+        return cls(path, data.get('entries', {}))
+
+    def save(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'version': CACHE_VERSION, 'entries': self.entries},
+                      f, indent=2, sort_keys=True)
+            f.write('\n')
+        os.replace(tmp, self.path)
+
+    def stale_reason(self, source, output, key):
+        """Return why ``output`` must be rebuilt, or ``None`` if it is fresh."""
+        entry = self.entries.get(output)
+        if entry is None:
+            return 'not in cache'
+        if not os.path.exists(output):
+            return 'output missing'
+        if entry.get('source') != source:
+            return 'source moved'
+        if entry.get('key') != key:
+            return 'inputs changed'
+        if entry.get('output_hash') != file_hash(output):
+            return 'output modified'
+        return None
+
+    def record(self, source, output, key):
+        self.entries[output] = {
+            'source': source,
+            'key': key,
+            'output_hash': file_hash(output),
+        }
+
+    def forget(self, output):
+        self.entries.pop(output, None)
@@ -0,0 +1,66 @@
+"""Capacity forecasts: when a resource runs out if it keeps growing.
+
+The growth rate is the slope of a linear regression (``deriv``) over
+``FORECAST_WINDOW``. The time to exhaustion is when the regression line
+(``predict_linear``) reaches the capacity. Regressions over hours of
+samples are too slow to run on every refresh, so the dashboard modules
+declare them as recording rules in ``create_*_recording_rules``, which
+``recording_rules.py`` writes, and their panels and alerts read the
+recorded series.
+"""
+
+from grafanalib.core import (
+    Table, TableSortByField, Target, BYTES_PER_SEC_FORMAT, SECONDS_FORMAT,
+)
+
+
+# Samples the regressions fit; long enough to ignore short bursts.
+FORECAST_WINDOW = '6h'
+
+
+def growth_rate(series, window=FORECAST_WINDOW):
+    """Per-second growth of ``series`` over ``window``."""
+    return 'deriv({}[{}])'.format(series, window)
+
+
+def seconds_until_full(used, capacity, window=FORECAST_WINDOW):
+    """Seconds until ``used`` reaches ``capacity``; negative when shrinking."""
+    return '({c} - predict_linear({u}[{w}], 0)) / deriv({u}[{w}])'.format(
+        c=capacity, u=used, w=window)
+
+
+def seconds_until_empty(free, window=FORECAST_WINDOW):
+    """Seconds until ``free`` reaches zero; negative when growing."""
+    return 'predict_linear({f}[{w}], 0) / -deriv({f}[{w}])'.format(f=free, w=window)
+
+
+def forecast_table(title, growth, eta, gridPos, description=None):
+    """Table of the growth rate and time to exhaustion per series.
+
+    Rows are joined on the series labels. Only series that run out get a
+    time to exhaustion; the soonest come first.
+    """
+    return Table(
+        title=title,
+        description=description,
+        dataSource='${datasource}',
+        targets=[
+            Target(expr=growth, format='table', instant=True, refId='A'),
+            Target(expr='{} > 0'.format(eta), format='table', instant=True, refId='B'),
+        ],
+        transformations=[
+            {'id': 'merge', 'options': {}},
+            {'id': 'organize', 'options': {
+                'excludeByName': {'Time': True, 'job': True},
+                'renameByName': {'Value #A': 'Growth', 'Value #B': 'Time to exhaustion'},
+            }},
+        ],
+        overrides=[
+            {'matcher': {'id': 'byName', 'options': 'Growth'},
+             'properties': [{'id': 'unit', 'value': BYTES_PER_SEC_FORMAT}]},
+            {'matcher': {'id': 'byName', 'options': 'Time to exhaustion'},
+             'properties': [{'id': 'unit', 'value': SECONDS_FORMAT}]},
+        ],
+        sortBy=[TableSortByField('Time to exhaustion')],
+        gridPos=gridPos,
+    )
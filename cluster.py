@@ -0,0 +1,71 @@
+"""Per-cluster parameters for the dashboard factories.
+
+Every ``create_*_dashboard`` factory takes an optional ``params`` dict
+describing one cluster of the fleet (see ``fleet.py``) and passes the
+dashboard it builds through ``apply_params``:
+
+``cluster``
+    cluster name, appended to the title and added as a tag
+``uid``
+    dashboard uid (default: derived from the title and cluster)
+``datasource``
+    Prometheus datasource the ``$datasource`` variable is pinned to
+
+Any other key naming a template variable (``job``,
+``connection_threshold``, ...) becomes that variable's default. Keys the
+factory handles itself, such as alert thresholds, are ignored here.
+"""
+
+import hashlib
+import re
+
+import attr
+from grafanalib.core import Templating
+
+from dashboard_utils import copy_extras
+
+
+# Grafana's limit on uid length.
+MAX_UID_LENGTH = 40
+RESERVED = frozenset(['cluster', 'uid', 'datasource', 'dashboard', 'title'])
+
+
+def dashboard_uid(title, cluster):
+    """A stable uid for ``title`` on ``cluster``."""
+    uid = re.sub(r'[^a-z0-9]+', '-', '{}-{}'.format(title, cluster).lower()).strip('-')
+    if len(uid) > MAX_UID_LENGTH:
+        digest = hashlib.sha1(uid.encode('utf-8')).hexdigest()[:8]
+        uid = uid[:MAX_UID_LENGTH - len(digest) - 1].rstrip('-') + '-' + digest
+    return uid
+
+
+def _set_default(template, value):
+    value = str(value)
+    if template.type == 'datasource':
+        return attr.evolve(template, default=value,
+                           regex='/^{}$/'.format(re.escape(value)))
+    if template.type == 'custom':
+        # Options are rebuilt from the query to select the new default.
+        return attr.evolve(template, default=value, options=[])
+    return attr.evolve(template, default=value)
+
+
+def apply_params(dashboard, params=None):
+    """Return ``dashboard`` configured for the cluster described by ``params``."""
+    if not params:
+        return dashboard
+    values = dict((k, v) for k, v in params.items()
+                  if k not in RESERVED and v not in (None, ''))
+    if params.get('datasource'):
+        values['datasource'] = params['datasource']
+    templates = [_set_default(t, values[t.name]) if t.name in values else t
+                 for t in dashboard.templating.list]
+    changes = {'templating': Templating(list=templates)}
+    cluster = params.get('cluster')
+    if cluster:
+        changes['title'] = '{} ({})'.format(dashboard.title, cluster)
+        changes['tags'] = list(dashboard.tags) + ['cluster:{}'.format(cluster)]
+        changes['uid'] = params.get('uid') or dashboard_uid(dashboard.title, cluster)
+    elif params.get('uid'):
+        changes['uid'] = params['uid']
+    return copy_extras(dashboard, attr.evolve(dashboard, **changes))
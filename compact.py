@@ -0,0 +1,153 @@
+"""Compact dashboard JSON.
+
+grafanalib writes every field of every object, most of them at values
+Grafana assumes anyway when a field is missing. ``strip_defaults`` drops:
+
+* fields set to ``null``, which Grafana treats like missing fields;
+* fields equal to the default Grafana fills in for the object kind
+  (dashboard, panel, target, template variable or legacy alert), listed
+  in ``DEFAULTS``.
+
+Subtrees where ``null`` carries meaning or where the schema migrations
+test for it (threshold steps, the legacy graph ``grid`` and ``rows``) are
+kept as they are. ``dumps`` writes the result minified with sorted keys.
+"""
+
+import json
+
+from grafanalib._gen import DashboardEncoder
+
+
+# Fields Grafana defaults to these values when they are missing.
+DEFAULTS = {
+    'dashboard': {
+        '__inputs': [],
+        'annotations': {'list': []},
+        'editable': True,
+        'graphTooltip': 0,
+        'hideControls': False,
+        'links': [],
+        'sharedCrosshair': False,
+        'style': 'dark',
+        'tags': [],
+        'version': 0,
+    },
+    'panel': {
+        'editable': True,
+        'error': False,
+        'hideTimeOverride': False,
+        'isNew': True,
+        'links': [],
+        'transformations': [],
+        'transparent': False,
+    },
+    'target': {
+        'format': 'time_series',
+        'hide': False,
+        'instant': False,
+        'interval': '',
+        'legendFormat': '',
+        'metric': '',
+        'target': '',
+    },
+    'template': {
+        'auto': False,
+        'auto_count': 30,
+        'auto_min': '10s',
+        'hide': 0,
+        'includeAll': False,
+        'multi': False,
+        'options': [],
+        'useTags': False,
+    },
+    'alert': {
+        'alertRuleTags': {},
+        'notifications': [],
+    },
+}
+
+# Subtrees copied verbatim.
+KEEP = frozenset(['grid', 'rows', 'steps'])
+
+
+def _strip(value):
+    if isinstance(value, dict):
+        return dict((k, _strip(v)) for k, v in value.items() if v is not None)
+    if isinstance(value, list):
+        return [_strip(v) for v in value]
+    return value
+
+
+def _strip_object(data, kind, children):
+    """Strip ``data`` of ``kind``; ``children`` maps keys to a child handler."""
+    defaults = DEFAULTS.get(kind, {})
+    out = {}
+    for key, value in data.items():
+        if value is None or (key in defaults and value == defaults[key]):
+            continue
+        if key in KEEP:
+            out[key] = value
+        elif key in children:
+            out[key] = children[key](value)
+        else:
+            out[key] = _strip(value)
+    return out
+
+
+def _target(data):
+    return _strip_object(data, 'target', {})
+
+
+def _alert(data):
+    def condition(c):
+        c = dict(c)
+        query = dict(c.get('query') or {})
+        if 'model' in query:
+            query['model'] = _target(query['model'])
+            c['query'] = query
+        return _strip(c)
+    return _strip_object(data, 'alert', {
+        'conditions': lambda cs: [condition(c) for c in cs],
+    })
+
+
+def _panels(panels):
+    return [_strip_object(p, 'panel', {
+        'targets': lambda ts: [_target(t) for t in ts],
+        'alert': _alert,
+        'panels': _panels,
+    }) for p in panels]
+
+
+def _templating(data):
+    return dict(data, list=[_strip_object(t, 'template', {'current': lambda c: c})
+                            for t in data.get('list', [])])
+
+
+def strip_defaults(data):
+    """Return dashboard JSON data without fields Grafana would default."""
+    return _strip_object(data, 'dashboard', {
+        'panels': _panels,
+        'templating': _templating,
+    })
+
+
+def dashboard_data(dashboard):
+    """Plain JSON data for a grafanalib ``Dashboard``."""
+    return json.loads(json.dumps(dashboard.to_json_data(), cls=DashboardEncoder))
+
+
+def dumps(data):
+    return json.dumps(data, sort_keys=True, separators=(',', ':'))
+
+
+def write_compact_dashboard(dashboard, stream):
+    """Write ``dashboard`` as compact JSON; return ``(full, compact)`` sizes.
+
+    ``full`` is the size grafanalib's ``write_dashboard`` would write.
+    """
+    data = dashboard_data(dashboard)
+    full = json.dumps(data, sort_keys=True, indent=2)
+    text = dumps(strip_defaults(data))
+    stream.write(text)
+    return len(full), len(text)
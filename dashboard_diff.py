@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+"""Structural diff of two versions of a dashboard's JSON.
+
+Both versions are normalized before comparing, so only changes that
+matter to Grafana show up:
+
+* fields Grafana assigns or defaults are dropped (``id``, ``version``,
+  and everything ``compact.strip_defaults`` removes), so compact and
+  default builds compare equal;
+* panels are keyed by title instead of by the ids ``auto_panel_ids()``
+  assigns, and references to other panels (``-- Dashboard --`` targets)
+  follow the key, so inserting a panel does not change every other one;
+* targets are keyed by ``refId``.
+
+Usage::
+
+    python dashboard_diff.py published/mysql.json out/mysql.json
+"""
+
+import argparse
+import json
+import sys
+
+import attr
+
+from compact import strip_defaults
+
+
+# Set by Grafana on save.
+VOLATILE = ('id', 'version', 'iteration', 'created', 'updated')
+
+
+def _panel_keys(panels):
+    """Keys for ``panels`` and the panels nested in rows.
+
+    Returns ``(by_object, by_id)``, mapping ``id()`` of each panel dict
+    and each panel's Grafana id to its key.
+    """
+    by_object = {}
+    by_id = {}
+    counts = {}
+
+    def visit(panel):
+        title = panel.get('title') or '{} panel'.format(panel.get('type', 'untitled'))
+        base = ('row ' if panel.get('type') == 'row' else '') + '"{}"'.format(title)
+        counts[base] = counts.get(base, 0) + 1
+        key = base if counts[base] == 1 else '{} #{}'.format(base, counts[base])
+        by_object[id(panel)] = key
+        if 'id' in panel:
+            by_id[panel['id']] = key
+        for nested in panel.get('panels', []):
+            visit(nested)
+
+    for panel in panels:
+        visit(panel)
+    return by_object, by_id
+
+
+def _normalize_panel(panel, by_object, by_id):
+    panel = dict((k, v) for k, v in panel.items() if k != 'id')
+    if 'panels' in panel:
+        panel['panels'] = sorted(by_object[id(p)] for p in panel['panels'])
+    targets = {}
+    for target in panel.pop('targets', []):
+        target = dict(target)
+        if 'panelId' in target:
+            target['panelId'] = by_id.get(target['panelId'], target['panelId'])
+        targets[target.get('refId', '')] = target
+    if targets:
+        panel['targets'] = targets
+    return panel
+
+
+def normalize(data):
+    """Comparable form of dashboard JSON ``data``."""
+    data = strip_defaults(data)
+    for field in VOLATILE:
+        data.pop(field, None)
+    panels = data.pop('panels', [])
+    by_object, by_id = _panel_keys(panels)
+    normalized = {}
+
+    def visit(panel):
+        normalized[by_object[id(panel)]] = _normalize_panel(panel, by_object, by_id)
+        for nested in panel.get('panels', []):
+            visit(nested)
+
+    for panel in panels:
+        visit(panel)
+    data['panels'] = normalized
+    return data
+
+
+@attr.s
+class Change(object):
+    """One changed value; ``old`` or ``new`` is ``None`` when added or removed."""
+
+    path = attr.ib()
+    old = attr.ib(default=None)
+    new = attr.ib(default=None)
+
+    @property
+    def kind(self):
+        if self.old is None:
+            return 'added'
+        if self.new is None:
+            return 'removed'
+        return 'changed'
+
+
+def _diff(old, new, path, changes):
+    if isinstance(old, dict) and isinstance(new, dict):
+        for key in sorted(set(old) | set(new), key=str):
+            _diff(old.get(key), new.get(key), path + [key], changes)
+    elif old != new:
+        changes.append(Change(path, old, new))
+
+
+def diff(old, new):
+    """Changes between two versions of dashboard JSON, as ``Change`` objects."""
+    changes = []
+    _diff(normalize(old), normalize(new), [], changes)
+    return changes
+
+
+def format_path(path):
+    """``['panels', '"CPU"', 'targets', 'A', 'expr']`` -> ``panel "CPU" / target A / expr``."""
+    parts = []
+    rest = list(path)
+    while rest:
+        head = rest.pop(0)
+        if head in ('panels', 'targets') and rest:
+            parts.append('{} {}'.format(head[:-1], rest.pop(0)))
+        else:
+            parts.append(str(head))
+    return ' / '.join(parts) or '(dashboard)'
+
+
+def _short(value):
+    text = json.dumps(value, sort_keys=True)
+    return text if len(text) <= 120 else text[:117] + '...'
+
+
+def write_changes(changes, stream):
+    for change in changes:
+        stream.write('  {:<8} {}\n'.format(change.kind, format_path(change.path)))
+        if change.old is not None:
+            stream.write('           - {}\n'.format(_short(change.old)))
+        if change.new is not None:
+            stream.write('           + {}\n'.format(_short(change.new)))
+
+
+def main(args):
+    parser = argparse.ArgumentParser(prog='dashboard_diff')
+    parser.add_argument('old', help='Published dashboard JSON')
+    parser.add_argument('new', help='Newly generated dashboard JSON')
+    opts = parser.parse_args(args)
+    with open(opts.old) as f:
+        old = json.load(f)
+    with open(opts.new) as f:
+        new = json.load(f)
+    old = old.get('dashboard', old)  # as returned by the Grafana API
+    changes = diff(old, new)
+    write_changes(changes, sys.stdout)
+    return 1 if changes else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
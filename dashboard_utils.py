@@ -0,0 +1,276 @@
+"""Helpers shared by the dashboard build tooling."""
+
+import glob
+import importlib.util
+import os
+import sys
+
+import attr
+
+
+DASHBOARD_SUFFIX = '.dashboard.py'
+
+
+def find_dashboards(root='.'):
+    """Return every ``*.dashboard.py`` module below ``root``, sorted."""
+    pattern = os.path.join(root, '**', '*' + DASHBOARD_SUFFIX)
+    return sorted(glob.glob(pattern, recursive=True))
+
+
+def dashboard_name(path):
+    """``system_metrics.dashboard.py`` -> ``system_metrics``."""
+    return os.path.basename(path)[:-len(DASHBOARD_SUFFIX)]
+
+
+def load_module(path):
+    """Import a ``*.dashboard.py`` file as a module.
+
+    The module's directory is put on ``sys.path`` so it can import the
+    helper modules next to it.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    if directory not in sys.path:
+        sys.path.insert(0, directory)
+    spec = importlib.util.spec_from_file_location(
+        dashboard_name(path).replace('-', '_') + '_dashboard', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def load_dashboard(path):
+    """Return the ``dashboard`` object defined by a dashboard module."""
+    module = load_module(path)
+    dashboard = getattr(module, 'dashboard', None)
+    if dashboard is None:
+        raise ValueError("{} does not define a 'dashboard' variable".format(path))
+    return dashboard
+
+
+def iter_panels(dashboard):
+    """Yield every panel, including panels nested in rows."""
+    for row in dashboard.rows:
+        for panel in row.panels:
+            yield panel
+    for panel in dashboard.panels:
+        yield panel
+        for nested in getattr(panel, 'panels', []):
+            yield nested
+
+
+def iter_loaded_panels(dashboard):
+    """Yield the panels that query when the dashboard loads.
+
+    Panels inside collapsed rows are skipped; they only query once their
+    row is expanded.
+    """
+    for row in dashboard.rows:
+        for panel in row.panels:
+            yield panel
+    for panel in dashboard.panels:
+        yield panel
+        if not getattr(panel, 'collapsed', False):
+            for nested in getattr(panel, 'panels', []):
+                yield nested
+
+
+def collapsed_rows(dashboard):
+    """Map the id of each panel inside a collapsed row to the row's id."""
+    rows = {}
+    for panel in dashboard.panels:
+        if getattr(panel, 'collapsed', False):
+            for nested in panel.panels:
+                rows[nested.id] = panel.id
+    return rows
+
+
+def iter_alerts(dashboard):
+    """Yield ``(panel, alert)`` for the alerts attached to panels.
+
+    Alerts without a panel are only returned by the module's
+    ``create_*_alerts`` functions, see ``module_alerts``.
+    """
+    for panel in iter_panels(dashboard):
+        alert = getattr(panel, 'alert', None)
+        if alert is not None:
+            yield panel, alert
+
+
+def iter_targets(dashboard):
+    """Yield ``(panel, alert, target)`` for every query in ``dashboard``.
+
+    ``alert`` is ``None`` for panel targets; for alert targets ``panel`` is
+    the panel the alert is attached to, if any.
+    """
+    for panel in iter_panels(dashboard):
+        for target in getattr(panel, 'targets', []):
+            yield panel, None, target
+    for panel, alert in iter_alerts(dashboard):
+        for condition in alert.alertConditions:
+            if condition.target is not None:
+                yield panel, alert, condition.target
+
+
+def module_alerts(module):
+    """Return the alerts built by the module's ``create_*_alerts`` functions.
+
+    These include alerts that are defined but not attached to any panel.
+    """
+    alerts = []
+    for name in sorted(dir(module)):
+        fn = getattr(module, name)
+        if not (name.startswith('create_') and name.endswith('_alerts') and callable(fn)):
+            continue
+        result = fn()
+        alerts.extend(result.values() if isinstance(result, dict) else result)
+    return alerts
+
+
+def module_factory(module):
+    """Return the module's ``create_*_dashboard(params=None)`` function."""
+    for name in sorted(dir(module)):
+        fn = getattr(module, name)
+        if name.startswith('create_') and name.endswith('_dashboard') and callable(fn):
+            return fn
+    raise AttributeError('{} has no create_*_dashboard function'.format(module.__name__))
+
+
+def iter_module_targets(module):
+    """Like ``iter_targets`` for ``module.dashboard``, plus unattached alerts.
+
+    Unattached alerts are scoped like the dashboard's queries.
+    """
+    from promql_passes import scope_alerts
+
+    seen = set()
+    for panel, alert, target in iter_targets(module.dashboard):
+        if alert is not None:
+            seen.add(alert.name)
+        yield panel, alert, target
+    for alert in scope_alerts(module_alerts(module), module.dashboard):
+        if alert.name in seen:
+            continue
+        seen.add(alert.name)
+        for condition in alert.alertConditions:
+            if condition.target is not None:
+                yield None, alert, condition.target
+
+
+def map_alert_targets(alert, fn):
+    """Return a copy of ``alert`` with ``fn`` applied to each condition target."""
+    return attr.evolve(alert, alertConditions=[
+        attr.evolve(c, target=fn(c.target)) if c.target is not None else c
+        for c in alert.alertConditions
+    ])
+
+
+def free_ref_id(used):
+    """The first refId not in ``used``."""
+    return next(c for c in 'ABCDEFGHIJKLMNOPQRSTUVWXYZ' if c not in used)
+
+
+def rewrite_panel_queries(panel, fn, select=None, alert_fn=None):
+    """Return a copy of ``panel`` with ``fn`` applied to its visible queries.
+
+    ``select`` further limits the targets rewritten, e.g. to range queries.
+    A legacy alert evaluates panel targets by ``refId``; it keeps seeing
+    the original query, or ``alert_fn`` of it if given. When that differs
+    from the visible query, the alert gets a hidden copy under a new refId
+    and is pointed at it. Returns ``panel`` itself when nothing changes.
+    """
+    alert_fn = alert_fn or (lambda expr: expr)
+    alert = getattr(panel, 'alert', None)
+    alerted = set(c.target.refId for c in alert.alertConditions
+                  if c.target is not None) if alert else set()
+    used = set(t.refId for t in panel.targets)
+    targets, hidden, moved = [], [], {}
+    for target in panel.targets:
+        if not target.expr or (select is not None and not select(target)):
+            targets.append(target)
+            continue
+        if target.hide:
+            # Hidden targets are only read by alerts.
+            expr = alert_fn(target.expr) if target.refId in alerted else target.expr
+            targets.append(attr.evolve(target, expr=expr) if expr != target.expr else target)
+            continue
+        expr = fn(target.expr)
+        targets.append(attr.evolve(target, expr=expr) if expr != target.expr else target)
+        if target.refId not in alerted:
+            continue
+        alerted_expr = alert_fn(target.expr)
+        if alerted_expr != expr:
+            moved[target.refId] = free_ref_id(used)
+            used.add(moved[target.refId])
+            hidden.append(attr.evolve(target, expr=alerted_expr,
+                                      refId=moved[target.refId], hide=True))
+    if targets == panel.targets and not hidden:
+        return panel
+    changes = {'targets': targets + hidden}
+    if moved:
+        changes['alert'] = attr.evolve(alert, alertConditions=[
+            attr.evolve(c, target=attr.evolve(c.target, refId=moved[c.target.refId]))
+            if c.target is not None and c.target.refId in moved else c
+            for c in alert.alertConditions
+        ])
+    return attr.evolve(panel, **changes)
+
+
+def map_targets(dashboard, fn):
+    """Return a copy of ``dashboard`` with ``fn`` applied to every target.
+
+    Alert targets are included. Attributes set on the dashboard outside of
+    its ``attrs`` fields (such as ``downsampled``, see ``long_range.py``)
+    are carried over to the copy.
+    """
+    def map_panel(panel):
+        changes = {}
+        if getattr(panel, 'targets', None):
+            changes['targets'] = [fn(t) for t in panel.targets]
+        if getattr(panel, 'alert', None) is not None:
+            changes['alert'] = map_alert_targets(panel.alert, fn)
+        return attr.evolve(panel, **changes) if changes else panel
+
+    return copy_extras(dashboard, dashboard._map_panels(map_panel))
+
+
+def copy_extras(source, dashboard):
+    """Copy non-``attrs`` attributes from ``source`` onto ``dashboard``."""
+    fields = set(f.name for f in attr.fields(type(source)))
+    for name, value in vars(source).items():
+        if name not in fields:
+            setattr(dashboard, name, value)
+    return dashboard
+
+
+def apply_passes(dashboard, params=None, rate_windows=None, fleet_metric=None, bottom=(),
+                 recorded=None):
+    """Run the build passes over ``dashboard``, always in the same order.
+
+    The passes rewrite each other's queries, so the order matters:
+
+    1. ``apply_params``: cluster defaults, title and uid;
+    2. ``scope_queries``: job, instance and environment matchers;
+    3. ``apply_rate_windows`` with ``rate_windows``, a ``RateWindowPolicy``;
+    4. ``apply_resolution``: max data points and instant queries;
+    5. ``fleet_mode`` on ``fleet_metric``, ``bottom`` naming the panels
+       ranked by their lowest series;
+    6. ``long_range_mode``, reusing the names of the ``recorded`` rules;
+    7. ``dedupe_queries``, comparing the queries in their final form;
+    8. ``plan_refresh``, which counts the queries left.
+    """
+    # The passes use the helpers above.
+    from cluster import apply_params
+    from dedup import dedupe_queries
+    from fleet_view import fleet_mode
+    from long_range import long_range_mode
+    from promql_passes import scope_queries
+    from rate_window import apply_rate_windows
+    from refresh import plan_refresh
+    from resolution import apply_resolution
+
+    dashboard = scope_queries(apply_params(dashboard, params))
+    dashboard = apply_resolution(apply_rate_windows(dashboard, rate_windows))
+    if fleet_metric is not None:
+        dashboard = fleet_mode(dashboard, fleet_metric, bottom=bottom)
+    dashboard = long_range_mode(dashboard, recorded=recorded)
+    return plan_refresh(dedupe_queries(dashboard))
@@ -0,0 +1,293 @@
+#!/usr/bin/env python
+"""Share identical panel queries through Grafana's ``-- Dashboard --`` datasource.
+
+A panel whose queries are all run by an earlier panel on the same
+dashboard is switched to the ``-- Dashboard --`` datasource and reuses
+that panel's results, so each query runs once per refresh. A panel
+sharing only some of its queries with another panel is switched to the
+``-- Mixed --`` datasource: the shared queries are replaced by one
+``-- Dashboard --`` query and the others keep running against their own
+datasource. Frames of the other panel that are not needed are dropped
+with a ``filterByRefId`` transformation.
+
+Besides identical queries, a stat panel query that only smooths a series
+the stat reduces anyway is treated as subsumed by the raw series: a stat
+showing the mean of ``avg_over_time(x[5m])`` can reuse the query ``x``
+from a graph panel.
+
+Panels with alerts keep their own queries, since legacy alerts evaluate
+the panel's targets. A panel inside a collapsed row only serves panels in
+the same row, as it does not query until the row is expanded.
+
+Usage::
+
+    python dedup.py             # report shared queries for every dashboard
+"""
+
+import argparse
+import sys
+
+import attr
+
+import promql
+from dashboard_utils import (
+    collapsed_rows, copy_extras, find_dashboards, free_ref_id, iter_loaded_panels,
+    iter_panels, load_dashboard,
+)
+
+
+DASHBOARD_DATASOURCE = '-- Dashboard --'
+MIXED_DATASOURCE = '-- Mixed --'
+
+# Smoothing functions that are redundant under a stat panel reduction.
+SMOOTHING_FOR_CALC = {
+    'mean': 'avg_over_time',
+    'max': 'max_over_time',
+    'min': 'min_over_time',
+}
+
+
+@attr.s
+class DashboardTarget(object):
+    """Reuse the query results of another panel on the same dashboard."""
+
+    panelId = attr.ib()
+    refId = attr.ib(default='A')
+
+    # Has no query of its own; lets tools that read ``expr`` skip it.
+    expr = ''
+    hide = False
+    instant = False
+
+    def to_json_data(self):
+        return {
+            'datasource': DASHBOARD_DATASOURCE,
+            'panelId': self.panelId,
+            'refId': self.refId,
+        }
+
+
+def _normalize(expr):
+    try:
+        return str(promql.parse(expr))
+    except promql.PromQLError:
+        return expr
+
+
+def query_key(panel, target, expr=None):
+    """Everything that makes two targets return the same data."""
+    return (
+        target.datasource or panel.dataSource,
+        _normalize(expr if expr is not None else target.expr),
+        target.instant,
+        target.interval,
+        target.format,
+        getattr(panel, 'interval', None),
+        getattr(panel, 'maxDataPoints', None),
+    )
+
+
+def unsmoothed(expr, calc):
+    """``expr`` without the smoothing made redundant by ``calc``, or ``None``."""
+    func = SMOOTHING_FOR_CALC.get(calc)
+    if func is None:
+        return None
+    try:
+        node = promql.parse(expr)
+    except promql.PromQLError:
+        return None
+    found = []
+
+    def strip(n):
+        if (isinstance(n, promql.Call) and n.func == func and len(n.args) == 1
+                and isinstance(n.args[0], promql.VectorSelector) and n.args[0].range):
+            found.append(n)
+            return attr.evolve(n.args[0], range=None)
+        return n
+
+    node = promql.transform(node, strip)
+    return str(node) if len(found) == 1 else None
+
+
+def _shareable(panel):
+    return (getattr(panel, 'targets', None)
+            and getattr(panel, 'alert', None) is None
+            and not panel.repeat.variable
+            and not getattr(panel, 'panels', None)
+            and panel.dataSource != DASHBOARD_DATASOURCE)
+
+
+def _candidate_keys(panel, target):
+    keys = [query_key(panel, target)]
+    if hasattr(panel, 'reduceCalc') and not target.instant:
+        expr = unsmoothed(target.expr, panel.reduceCalc)
+        if expr is not None:
+            # The raw series may come from a graph with a different
+            # resolution; only the query itself has to match.
+            keys.append(query_key(panel, target, expr)[:5])
+    return keys
+
+
+def _filter(ref_ids):
+    include = ref_ids[0] if len(ref_ids) == 1 else '/^(?:{})$/'.format('|'.join(ref_ids))
+    return {'id': 'filterByRefId', 'options': {'include': include}}
+
+
+def _pick_source(panel, targets, matches, visible):
+    """``(source id, {refId: source refId})`` sharing the most targets, or ``None``.
+
+    A source returns all its frames, so the frames the panel does not
+    need are filtered out by refId; a source is skipped when one of those
+    refIds is also a query the panel keeps.
+    """
+    best = None
+    for source_id in sorted(set(p for m in matches for p, _ in m)):
+        shared = dict((t.refId, r) for t, m in zip(targets, matches)
+                      for p, r in m if p == source_id)
+        kept = set(t.refId for t in targets if t.refId not in shared)
+        if kept & (visible[source_id] - set(shared.values())):
+            continue
+        if best is None or len(shared) > len(best[1]):
+            best = (source_id, shared)
+    return best
+
+
+def dedupe_queries(dashboard):
+    """Return a copy of ``dashboard`` where repeated queries run once.
+
+    Panels without ids get them first, since reuse refers to panel ids.
+    Meant to run after the passes that rewrite queries, so they are
+    compared in their final form (see ``dashboard_utils.apply_passes``).
+    """
+    dashboard = copy_extras(dashboard, dashboard.auto_panel_ids())
+    row_of = collapsed_rows(dashboard)
+    panels = [p for p in iter_panels(dashboard) if getattr(p, 'targets', None)]
+    # Panels that must keep their queries are considered first, then those
+    # running the most queries, so they become the sources and panels
+    # running a subset of their queries reuse them. Stats come last as they
+    # can also reuse raw series.
+    panels.sort(key=lambda p: (
+        bool(_shareable(p)),
+        -len([t for t in p.targets if not t.hide]),
+        hasattr(p, 'reduceCalc'),
+        p.id,
+    ))
+    # query key -> [(panel id, refId)] of the queries run by kept targets
+    sources = {}
+    # panel id -> refIds of the panel's visible queries
+    visible = {}
+    replacements = {}
+    for panel in panels:
+        targets = [t for t in panel.targets if not t.hide]
+        visible[panel.id] = set(t.refId for t in targets)
+        shared = {}
+        if _shareable(panel) and targets:
+            matches = [[s for k in _candidate_keys(panel, t) for s in sources.get(k, [])
+                        if row_of.get(s[0]) in (None, row_of.get(panel.id))]
+                       for t in targets]
+            source = _pick_source(panel, targets, matches, visible)
+            if source is not None:
+                replacements[panel.id] = source
+                shared = source[1]
+        for target in targets:
+            if not target.expr or target.refId in shared:
+                continue
+            key = query_key(panel, target)
+            sources.setdefault(key, []).append((panel.id, target.refId))
+            sources.setdefault(key[:5], []).append((panel.id, target.refId))
+
+    def reuse(panel):
+        if panel.id not in replacements:
+            return panel
+        source_id, shared = replacements[panel.id]
+        needed = sorted(set(shared.values()))
+        kept = [t for t in panel.targets if t.refId not in shared]
+        transformations = list(panel.transformations)
+        if not kept:
+            if len(needed) < len(visible[source_id]):
+                transformations.insert(0, _filter(needed))
+            return attr.evolve(
+                panel,
+                dataSource=DASHBOARD_DATASOURCE,
+                targets=[DashboardTarget(panelId=source_id)],
+                transformations=transformations,
+            )
+        # Some queries stay: the panel mixes its own queries with the
+        # source's results. The dashboard query's refId must not be one of
+        # the source frames filtered out.
+        unneeded = visible[source_id] - set(needed)
+        ref_id = next((r for r in sorted(shared) if r not in unneeded), None) or free_ref_id(
+            set(t.refId for t in panel.targets) | unneeded)
+        if unneeded:
+            transformations.insert(0, _filter(sorted(set(needed) | set(
+                t.refId for t in kept if not t.hide) | {ref_id})))
+        targets = []
+        for target in panel.targets:
+            if target.refId == min(shared):
+                targets.append(DashboardTarget(panelId=source_id, refId=ref_id))
+            elif target.refId not in shared:
+                targets.append(attr.evolve(target, datasource=target.datasource or panel.dataSource))
+        return attr.evolve(
+            panel,
+            dataSource=MIXED_DATASOURCE,
+            targets=targets,
+            transformations=transformations,
+        )
+
+    return copy_extras(dashboard, dashboard._map_panels(reuse))
+
+
+def query_count(dashboard):
+    """Number of datasource queries the dashboard runs per refresh.
+
+    Panels in collapsed rows are not counted.
+    """
+    return sum(1 for panel in iter_loaded_panels(dashboard)
+               for t in getattr(panel, 'targets', []) if t.expr and not t.hide)
+
+
+def shared_panels(dashboard):
+    """``(panel title, source panel title)`` for panels reusing results."""
+    titles = dict((p.id, p.title) for p in iter_panels(dashboard))
+    # Checked by attribute: when run as a script this module is
+    # ``__main__``, not the ``dedup`` the dashboards imported.
+    return [(p.title, titles.get(t.panelId))
+            for p in iter_panels(dashboard)
+            for t in getattr(p, 'targets', []) if getattr(t, 'panelId', None)]
+
+
+def partial_overlaps(dashboard):
+    """Queries run by more than one panel that could not be shared.
+
+    Returns ``(expr, [panel titles])`` pairs, e.g. for panels with alerts
+    or queries of a panel reusing another source.
+    """
+    panels = {}
+    for panel in iter_panels(dashboard):
+        for target in getattr(panel, 'targets', []):
+            if target.expr and not target.hide:
+                key = query_key(panel, target)
+                panels.setdefault(key, []).append(panel.title)
+    return [(key[1], titles) for key, titles in panels.items() if len(titles) > 1]
+
+
+def main(args):
+    parser = argparse.ArgumentParser(prog='dedup')
+    parser.add_argument(
+        'dashboards', metavar='DASHBOARD', nargs='*',
+        help='Dashboard definitions (default: every *.dashboard.py)',
+    )
+    opts = parser.parse_args(args)
+    for path in opts.dashboards or find_dashboards():
+        dashboard = load_dashboard(path)
+        sys.stdout.write('{}: {} queries per refresh\n'.format(path, query_count(dashboard)))
+        for title, source in shared_panels(dashboard):
+            sys.stdout.write('    "{}" reuses "{}"\n'.format(title, source))
+        for expr, titles in partial_overlaps(dashboard):
+            sys.stdout.write('    not shared: {} in {}\n'.format(
+                expr, ', '.join('"{}"'.format(t) for t in titles)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+"""Generate one dashboard per cluster from a fleet manifest.
+
+The manifest lists clusters, one per row (CSV) or per list item (YAML).
+``dashboard`` names the dashboard module (``mysql`` for
+``mysql.dashboard.py``), ``cluster`` the cluster; every other column is
+passed to the module's ``create_*_dashboard`` factory as a parameter
+(see ``cluster.py``)::
+
+    dashboard,cluster,datasource,job,connection_threshold
+    mysql,eu-1,prom-eu-1,mysql-eu-1,85
+    redis,eu-1,prom-eu-1,redis-eu-1,
+
+A YAML manifest may give ``defaults`` merged into every entry::
+
+    defaults:
+      buffer_pool_threshold: 5
+    clusters:
+      - {dashboard: mysql, cluster: eu-1, datasource: prom-eu-1}
+
+An entry with ``shard_by`` is split into shard dashboards plus an index
+dashboard linking to them (see ``shard.py``)::
+
+    clusters:
+      - {dashboard: mysql, cluster: eu-1, shard_by: environment,
+         shards: [prod, staging]}
+      - {dashboard: redis, cluster: eu-1, shard_by: hash, buckets: 4,
+         instances: [redis-1:9121, redis-2:9121, redis-3:9121]}
+
+writes ``mysql-eu-1-prod.json``, ``mysql-eu-1-staging.json`` and
+``mysql-eu-1-index.json``, and so on.
+
+Dashboards are built and written one at a time and not kept afterwards,
+so memory use does not grow with the number of clusters.
+
+Usage::
+
+    python fleet.py fleet.csv -o out/fleet/ --compact
+"""
+
+import argparse
+import csv
+import os
+import resource
+import sys
+import time
+import traceback
+
+import yaml
+from grafanalib._gen import write_dashboard
+
+import alert_rules
+
+from build import BuildResult
+from compact import write_compact_dashboard
+from dashboard_utils import (
+    dashboard_name, find_dashboards, load_module, module_factory,
+)
+from shard import build_index, build_shard, plan_shards, shard_params
+
+
+def read_manifest(path):
+    """Yield one parameter dict per manifest entry."""
+    if path.endswith('.csv'):
+        with open(path, newline='') as f:
+            for row in csv.DictReader(f):
+                yield dict((k, v) for k, v in row.items() if v not in (None, ''))
+        return
+    with open(path) as f:
+        data = yaml.safe_load(f) or []
+    defaults = {}
+    if isinstance(data, dict):
+        defaults = data.get('defaults') or {}
+        data = data.get('clusters') or []
+    for entry in data:
+        yield dict(defaults, **entry)
+
+
+def output_name(params):
+    return '{}-{}.json'.format(params.get('dashboard'), params.get('cluster'))
+
+
+class Factories(object):
+    """Dashboard factories by module name, each module imported once."""
+
+    def __init__(self, root='.'):
+        self.paths = dict((dashboard_name(p), p) for p in find_dashboards(root))
+        self.modules = {}
+        self.factories = {}
+
+    def module(self, name):
+        if name not in self.modules:
+            if name not in self.paths:
+                raise KeyError('no dashboard module {!r}'.format(name))
+            self.modules[name] = load_module(self.paths[name])
+        return self.modules[name]
+
+    def get(self, name):
+        if name not in self.factories:
+            self.factories[name] = module_factory(self.module(name))
+        return self.factories[name]
+
+
+def _write(dashboard, output, compact):
+    with open(output, 'w') as out:
+        if compact:
+            write_compact_dashboard(dashboard, out)
+        else:
+            write_dashboard(dashboard, out)
+
+
+def generate_shards(params, output_dir, factories, compact=False):
+    """Build and write the shards of ``params`` and their index.
+
+    Yield the path of each file once it is written; the index comes last.
+    """
+    module = factories.module(params['dashboard'])
+    shards, variables, title = [], None, None
+    for shard in plan_shards(params):
+        cluster = shard_params(params, shard)['cluster']
+        output = os.path.join(output_dir, '{}-{}.json'.format(params['dashboard'], cluster))
+        dashboard = build_shard(factories.get(params['dashboard']), params, shard)
+        _write(dashboard, output, compact)
+        shards.append((shard, dashboard.uid))
+        if variables is None:
+            variables = alert_rules.fixed_variables(dashboard)
+            title = dashboard.title[:-len(' ({})'.format(cluster))]
+        yield output
+    index = build_index(title, params, shards,
+                        module.INSTANCE_METRIC, getattr(module, 'FLEET_SUMMARY', ()),
+                        variables)
+    output = os.path.join(output_dir, '{}-{}-index.json'.format(
+        params['dashboard'], params['cluster']))
+    _write(index, output, compact)
+    yield output
+
+
+def generate(entries, output_dir, compact=False, root='.'):
+    """Build and write a dashboard per entry; yield a ``BuildResult`` each."""
+    os.makedirs(output_dir, exist_ok=True)
+    factories = Factories(root)
+    seen = set()
+    for params in entries:
+        output = os.path.join(output_dir, output_name(params))
+        start = time.perf_counter()
+        try:
+            if output in seen:
+                raise ValueError('duplicate manifest entry for {}'.format(output))
+            seen.add(output)
+            if params.get('shard_by'):
+                for output in generate_shards(params, output_dir, factories, compact):
+                    yield BuildResult(params['dashboard'], output, time.perf_counter() - start)
+                    start = time.perf_counter()
+                continue
+            dashboard = factories.get(params['dashboard'])(params)
+            _write(dashboard, output, compact)
+            del dashboard
+        except Exception:
+            yield BuildResult(params.get('dashboard'), output,
+                              time.perf_counter() - start, traceback.format_exc())
+            continue
+        yield BuildResult(params['dashboard'], output, time.perf_counter() - start)
+
+
+def peak_memory():
+    """Peak resident memory of this process, in KiB."""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in bytes on macOS and in KiB elsewhere.
+    return rss // 1024 if sys.platform == 'darwin' else rss
+
+
+def main(args):
+    parser = argparse.ArgumentParser(prog='fleet')
+    parser.add_argument('manifest', help='Fleet manifest (.csv, .yml or .yaml)')
+    parser.add_argument(
+        '--output-dir', '-o', default='fleet',
+        help='Directory for the JSON files (default: %(default)s)',
+    )
+    parser.add_argument(
+        '--compact', action='store_true',
+        help='Write minified JSON without fields at Grafana defaults',
+    )
+    parser.add_argument(
+        '--verbose', '-v', action='store_true',
+        help='Report every dashboard, not only failures',
+    )
+    opts = parser.parse_args(args)
+
+    built = failed = 0
+    seconds = 0.0
+    for result in generate(read_manifest(opts.manifest), opts.output_dir, opts.compact):
+        seconds += result.seconds
+        if result.ok:
+            built += 1
+            if opts.verbose:
+                sys.stderr.write('{:>8.3f}s  ok      {}\n'.format(result.seconds, result.output))
+        else:
+            failed += 1
+            sys.stderr.write('FAILED  {}\n{}'.format(result.output, result.error))
+    sys.stderr.write('{} built, {} failed, {:.3f}s total, peak memory {:.1f} MiB\n'.format(
+        built, failed, seconds, peak_memory() / 1024.0))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,174 @@
+"""Fleet mode: keep panels readable when ``$instance`` selects many instances.
+
+Selecting "All" on a large fleet makes every per-instance panel draw a
+series per instance. ``fleet_mode`` adds a hidden ``series_limit``
+variable, computed by Prometheus from the size of the selection, and keeps
+only the ``$series_limit`` series of every per-instance panel query that
+rank highest on average over the dashboard range::
+
+    expr and topk($series_limit, avg_over_time((expr)[$__range:$__interval] @ end()))
+
+The ranking is evaluated once, at the end of the range, so a graph draws
+the same series at every step:
+
+* up to ``FLEET_THRESHOLD`` selected instances the limit is ``UNLIMITED``
+  and the panels show every series, as before;
+* above it the limit is ``TOP_K``, so panels draw the same number of
+  series whatever the size of the fleet.
+
+Panels where a low value is the problem (``bottom``) use ``bottomk``.
+Already aggregated queries and tables are left alone. Queries a legacy
+alert evaluates are kept unlimited as a hidden target the alert is
+pointed at (see ``dashboard_utils.rewrite_panel_queries``). Per-instance panels get a data
+link opening the dashboard for the instance under the cursor.
+
+``fleet_panels`` builds the fleet-wide view: p50, p95 and max across
+instances, meant for a collapsed row so it only queries when expanded.
+"""
+
+import attr
+from grafanalib.core import DataLink, Graph, GridPos, Table, Target, single_y_axis
+
+import promql
+from dashboard_utils import copy_extras, rewrite_panel_queries
+from promql_passes import scope_variables
+from variables import DATASOURCE, result_variable, scoped_selector
+
+
+# Instances a selection may have before panels switch to the top series.
+FLEET_THRESHOLD = 20
+# Series per panel in fleet mode.
+TOP_K = 10
+# Limit used below the threshold; larger than any panel's series count.
+UNLIMITED = 10000
+
+LIMIT_VARIABLE = 'series_limit'
+# Series are ranked over the dashboard range, at the panel's resolution.
+RANK_RANGE = '$__range'
+RANK_STEP = '$__interval'
+
+DRILL_DOWN_URL = ('/d/${__dashboard.uid}?${__url_time_range}'
+                  '&var-job=${__field.labels.job}&var-instance=${__field.labels.instance}')
+
+# Quantiles across instances shown by ``fleet_panels``.
+FLEET_QUANTILES = ((0.5, 'p50'), (0.95, 'p95'))
+
+
+def limit_variable(metric, scope=('job', 'instance'), threshold=FLEET_THRESHOLD, k=TOP_K):
+    """Hidden variable holding the number of series per panel.
+
+    ``metric`` should have one series per instance, such as ``mysql_up``.
+    """
+    selector = scoped_selector(metric, scope)
+    return result_variable(
+        LIMIT_VARIABLE,
+        '{u} - {d} * (count(count by (instance) ({s})) > bool {t})'.format(
+            u=UNLIMITED, d=UNLIMITED - k, s=selector, t=threshold),
+    )
+
+
+def keeps_instance(node):
+    """Whether the series ``node`` returns still carry the ``instance`` label."""
+    node = promql.unwrap(node)
+    if isinstance(node, promql.VectorSelector):
+        return True
+    if isinstance(node, promql.Subquery):
+        return keeps_instance(node.expr)
+    if isinstance(node, promql.UnaryOp):
+        return keeps_instance(node.expr)
+    if isinstance(node, promql.Call):
+        vectors = [a for a in node.args if not promql.is_scalar(a)
+                   and not isinstance(a, promql.StringLiteral)]
+        return node.func != 'absent' and bool(vectors) and keeps_instance(vectors[0])
+    if isinstance(node, promql.Aggregation):
+        if node.op in ('topk', 'bottomk'):
+            return False
+        grouped = 'instance' in (node.grouping or ())
+        return grouped != node.without and keeps_instance(node.expr)
+    if isinstance(node, promql.BinaryOp):
+        if promql.is_scalar(node.lhs):
+            return keeps_instance(node.rhs)
+        if node.matching == 'on' and 'instance' not in node.matching_labels:
+            return False
+        return keeps_instance(node.lhs)
+    return False
+
+
+def limit_expr(expr, bottom=False):
+    """``expr`` limited to ``$series_limit`` series; unchanged if it has no instances.
+
+    The series are ranked once, by their average over the dashboard range,
+    so every step of a range query returns the same series.
+    """
+    try:
+        node = promql.parse(expr)
+    except promql.PromQLError:
+        return expr
+    if not keeps_instance(node):
+        return expr
+    rank = promql.Subquery(promql.Paren(node), RANK_RANGE, RANK_STEP, at='end()')
+    lhs = node
+    if isinstance(node, promql.BinaryOp) and node.op in ('and', 'or', 'unless'):
+        lhs = promql.Paren(node)
+    return '{} and {}(${}, avg_over_time({}))'.format(
+        lhs, 'bottomk' if bottom else 'topk', LIMIT_VARIABLE, rank)
+
+
+def _drill_down(panel):
+    link = DataLink('Open ${__field.labels.instance}', DRILL_DOWN_URL)
+    if hasattr(panel, 'dataLinks'):
+        return {'dataLinks': list(panel.dataLinks) + [link]}
+    extra = dict(panel.extraJson or {})
+    defaults = extra.setdefault('fieldConfig', {}).setdefault('defaults', {})
+    defaults['links'] = list(defaults.get('links', [])) + [link.to_json_data()]
+    return {'extraJson': extra}
+
+
+def fleet_mode(dashboard, metric, bottom=(), threshold=FLEET_THRESHOLD, k=TOP_K):
+    """Return a copy of ``dashboard`` whose panels stay readable on large selections.
+
+    :param metric: metric with one series per instance, used to size the
+        selection
+    :param bottom: titles of panels where the lowest values matter
+    """
+    def map_panel(panel):
+        if not getattr(panel, 'targets', None) or isinstance(panel, Table):
+            return panel
+        limited = rewrite_panel_queries(
+            panel, lambda expr: limit_expr(expr, panel.title in bottom))
+        if limited is panel:
+            return panel
+        return attr.evolve(limited, **_drill_down(panel))
+
+    new = copy_extras(dashboard, dashboard._map_panels(map_panel))
+    new.templating = attr.evolve(dashboard.templating, list=list(dashboard.templating.list) + [
+        limit_variable(metric, scope_variables(dashboard), threshold, k)])
+    return new
+
+
+def fleet_panels(panels, y=0, width=12, height=8):
+    """Fleet-wide graphs: p50, p95 and max across instances.
+
+    :param panels: ``(title, expr, format)`` tuples; ``expr`` returns a
+        series per instance
+    :param y: grid row of the first panel
+    """
+    per_line = 24 // width
+    out = []
+    for i, (title, expr, fmt) in enumerate(panels):
+        targets = [
+            Target(expr='quantile without (instance) ({:g}, {})'.format(q, expr),
+                   legendFormat=name + ' {{job}}', refId=chr(ord('A') + n))
+            for n, (q, name) in enumerate(FLEET_QUANTILES)
+        ]
+        targets.append(Target(expr='max without (instance) ({})'.format(expr),
+                              legendFormat='max {{job}}', refId=chr(ord('A') + len(targets))))
+        out.append(Graph(
+            title='{} across instances'.format(title),
+            dataSource=DATASOURCE,
+            targets=targets,
+            yAxes=single_y_axis(format=fmt),
+            gridPos=GridPos(h=height, w=width, x=(i % per_line) * width,
+                            y=y + (i // per_line) * height),
+        ))
+    return out
@@ -0,0 +1,70 @@
+"""Lay out dashboard sections as collapsible rows.
+
+Panels inside a collapsed row are not rendered, and so not queried, until
+the row is expanded. ``layout`` places each section's panels left to right
+below its row header, keeping each panel's width and height and
+recomputing ``gridPos`` x/y, so sections can be reordered or collapsed
+without hand-editing coordinates.
+"""
+
+import attr
+from grafanalib.core import GridPos, RowPanel
+
+
+GRID_WIDTH = 24
+ROW_HEIGHT = 1
+
+
+@attr.s
+class Section(object):
+    """A group of panels under one row header.
+
+    :param title: row title; ``None`` places the panels without a row
+    :param panels: panels in display order
+    :param collapsed: collapse the row by default, deferring its queries
+    """
+
+    title = attr.ib()
+    panels = attr.ib(default=attr.Factory(list))
+    collapsed = attr.ib(default=False)
+
+
+def _place(panels, y):
+    """Flow ``panels`` left to right from row ``y``; return them and the next y."""
+    placed = []
+    x = 0
+    line_height = 0
+    for panel in panels:
+        w = panel.gridPos.w if panel.gridPos else GRID_WIDTH // 2
+        h = panel.gridPos.h if panel.gridPos else 8
+        if x + w > GRID_WIDTH:
+            y += line_height
+            x, line_height = 0, 0
+        placed.append(attr.evolve(panel, gridPos=GridPos(h=h, w=w, x=x, y=y)))
+        x += w
+        line_height = max(line_height, h)
+    return placed, y + line_height
+
+
+def layout(sections):
+    """Return the top-level ``panels`` list for ``sections``."""
+    out = []
+    y = 0
+    for section in sections:
+        if section.title is None:
+            placed, y = _place(section.panels, y)
+            out.extend(placed)
+            continue
+        row_pos = GridPos(h=ROW_HEIGHT, w=GRID_WIDTH, x=0, y=y)
+        placed, end = _place(section.panels, y + ROW_HEIGHT)
+        if section.collapsed:
+            # Collapsed rows carry their panels; the next section starts
+            # directly below the header.
+            out.append(RowPanel(title=section.title, gridPos=row_pos,
+                                collapsed=True, panels=placed))
+            y += ROW_HEIGHT
+        else:
+            out.append(RowPanel(title=section.title, gridPos=row_pos))
+            out.extend(placed)
+            y = end
+    return out
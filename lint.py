@@ -0,0 +1,238 @@
+#!/usr/bin/env python
+"""Lint dashboard and alert queries for avoidable Prometheus cost.
+
+Every ``Target.expr`` in the dashboard modules is parsed and checked for:
+
+``unscoped-selector``
+    a selector without the dashboard's scope matchers (``$job``,
+    ``$instance``, ``$environment``), which reads the whole fleet.
+``unscoped-join``
+    a binary operation between two vectors where one side is not scoped,
+    so the join is computed for every series before being filtered.
+``rate-of-gauge``
+    ``rate()``/``irate()``/``increase()`` applied to a gauge.
+
+Each query also gets a relative cost estimate: the number of samples it
+reads per evaluation step, assuming a scoped selector matches one series
+and an unscoped one matches ``--fleet-size`` series.
+
+Usage::
+
+    python lint.py                        # every *.dashboard.py
+    python lint.py --fleet-size 200 mysql.dashboard.py
+"""
+
+import argparse
+import re
+import sys
+
+import attr
+
+import promql
+from dashboard_utils import find_dashboards, iter_module_targets, load_module
+from promql_passes import scope_variables
+
+
+DEFAULT_FLEET_SIZE = 100
+DEFAULT_SCRAPE_INTERVAL = '15s'
+# Value assumed for ranges given as a template variable.
+DEFAULT_VARIABLE_RANGE = '5m'
+
+# Exporter metrics that are gauges despite not looking like one, and
+# counters exported without the ``_total`` suffix.
+KNOWN_GAUGES = {
+    'go_goroutines', 'go_threads', 'node_load1', 'node_load5', 'node_load15',
+    'mysql_up', 'redis_up', 'redis_connected_clients', 'redis_blocked_clients',
+    'redis_mem_fragmentation_ratio',
+}
+KNOWN_COUNTERS = {
+    'mysql_global_status_innodb_data_reads',
+    'mysql_global_status_innodb_data_writes',
+    'mysql_global_status_slow_queries',
+    'mysql_global_status_aborted_connects',
+    'mysql_global_status_aborted_clients',
+    'mysql_global_status_buffer_pool_read_requests',
+    'mysql_global_status_buffer_pool_reads',
+    'mysql_global_status_innodb_buffer_pool_read_ahead',
+    'mysql_global_status_innodb_buffer_pool_read_ahead_evicted',
+    'mysql_global_status_innodb_log_waits',
+    'redis_total_error_replies',
+    # Cumulative byte counts, despite the missing _total suffix.
+    'system_io_read_bytes',
+    'system_io_write_bytes',
+}
+_COUNTER_RE = re.compile(r'_(total|count|sum|bucket)$')
+_GAUGE_RE = re.compile(
+    r'(_bytes|_per_second|_ratio|_percent|_threads_(connected|running|cached)'
+    r'|_max_connections|_buffer_pool_pages)$'
+)
+
+
+def metric_type(name):
+    """Best-effort ``'counter'``, ``'gauge'`` or ``None`` from a metric name."""
+    if name in KNOWN_GAUGES:
+        return 'gauge'
+    if name in KNOWN_COUNTERS or _COUNTER_RE.search(name):
+        return 'counter'
+    if _GAUGE_RE.search(name) or name.startswith('mysql_global_variables_'):
+        return 'gauge'
+    return None
+
+
+@attr.s
+class Finding(object):
+    rule = attr.ib()
+    message = attr.ib()
+
+
+@attr.s
+class QueryReport(object):
+    """Lint results for one target."""
+
+    source = attr.ib()
+    panel = attr.ib()
+    alert = attr.ib()
+    ref_id = attr.ib()
+    expr = attr.ib()
+    cost = attr.ib(default=0.0)
+    findings = attr.ib(default=attr.Factory(list))
+
+    @property
+    def location(self):
+        where = 'alert "{}"'.format(self.alert) if self.alert else 'panel "{}"'.format(self.panel)
+        return '{}: {} [{}]'.format(self.source, where, self.ref_id)
+
+
+def missing_scope(selector, scope):
+    """Scope labels ``selector`` does not restrict with a variable."""
+    missing = []
+    for label in scope:
+        m = selector.matcher(label)
+        if m is None or not m.uses_variable():
+            missing.append(label)
+    return missing
+
+
+def _range_seconds(window):
+    if window is None:
+        return None
+    if '$' in window:
+        window = DEFAULT_VARIABLE_RANGE
+    return promql.parse_duration(window)
+
+
+def estimate_cost(node, scope, fleet_size=DEFAULT_FLEET_SIZE,
+                  scrape_interval=DEFAULT_SCRAPE_INTERVAL):
+    """Relative number of samples read per evaluation step."""
+    scrape = promql.parse_duration(scrape_interval)
+    cost = 0.0
+    for n in promql.walk(node):
+        if isinstance(n, promql.VectorSelector):
+            series = fleet_size if missing_scope(n, scope) else 1
+            window = _range_seconds(n.range)
+            cost += series * (max(window / scrape, 1) if window else 1)
+        elif isinstance(n, promql.Subquery):
+            # Each subquery step re-evaluates the inner expression.
+            step = _range_seconds(n.step) if n.step else scrape
+            cost += estimate_cost(n.expr, scope, fleet_size, scrape_interval) * (
+                _range_seconds(n.range) / step - 1)
+    return cost
+
+
+def check(node, scope):
+    """Return the findings for one parsed expression."""
+    findings = []
+    for n in promql.walk(node):
+        if isinstance(n, promql.VectorSelector) and scope:
+            missing = missing_scope(n, scope)
+            if missing:
+                findings.append(Finding('unscoped-selector', '{} has no {} matcher'.format(
+                    n.metric or str(n), ', '.join('$' + m for m in missing))))
+        elif isinstance(n, promql.Call) and n.func in promql.COUNTER_FUNCTIONS:
+            for s in promql.selectors(n):
+                if s.metric and metric_type(s.metric) == 'gauge':
+                    findings.append(Finding('rate-of-gauge', '{}() applied to gauge {}'.format(
+                        n.func, s.metric)))
+        elif isinstance(n, promql.BinaryOp) and scope and not (
+                promql.is_scalar(n.lhs) or promql.is_scalar(n.rhs)):
+            sides = [('left', n.lhs), ('right', n.rhs)]
+            for side, expr in sides:
+                if any(missing_scope(s, scope) for s in promql.selectors(expr)):
+                    findings.append(Finding('unscoped-join', '{} side of "{}" is not scoped'.format(
+                        side, n.op)))
+    return findings
+
+
+def lint_module(source, module, fleet_size=DEFAULT_FLEET_SIZE,
+                scrape_interval=DEFAULT_SCRAPE_INTERVAL):
+    """Return a ``QueryReport`` for every target in a dashboard module.
+
+    Alerts built by ``create_*_alerts`` are checked even when they are not
+    attached to a panel.
+    """
+    scope = scope_variables(module.dashboard)
+    reports = []
+    for panel, alert, target in iter_module_targets(module):
+        if not target.expr:
+            continue
+        report = QueryReport(
+            source=source,
+            panel=getattr(panel, 'title', None),
+            alert=alert.name if alert is not None else None,
+            ref_id=target.refId,
+            expr=target.expr,
+        )
+        try:
+            node = promql.parse(target.expr)
+        except promql.PromQLError as e:
+            report.findings.append(Finding('parse-error', str(e)))
+        else:
+            report.cost = estimate_cost(node, scope, fleet_size, scrape_interval)
+            report.findings = check(node, scope)
+        reports.append(report)
+    return reports
+
+
+def write_report(reports, stream, verbose=False):
+    for report in sorted(reports, key=lambda r: -r.cost):
+        if not report.findings and not verbose:
+            continue
+        stream.write('{}  cost={:g}\n'.format(report.location, report.cost))
+        for finding in report.findings:
+            stream.write('    {}: {}\n'.format(finding.rule, finding.message))
+    total = sum(r.cost for r in reports)
+    flagged = sum(1 for r in reports if r.findings)
+    stream.write('{} queries, {} with findings, total cost={:g}\n'.format(
+        len(reports), flagged, total))
+
+
+def main(args):
+    parser = argparse.ArgumentParser(prog='lint')
+    parser.add_argument(
+        'dashboards', metavar='DASHBOARD', nargs='*',
+        help='Dashboard definitions (default: every *.dashboard.py)',
+    )
+    parser.add_argument(
+        '--fleet-size', type=int, default=DEFAULT_FLEET_SIZE,
+        help='Series assumed for an unscoped selector (default: %(default)s)',
+    )
+    parser.add_argument(
+        '--scrape-interval', default=DEFAULT_SCRAPE_INTERVAL,
+        help='Prometheus scrape interval (default: %(default)s)',
+    )
+    parser.add_argument(
+        '--verbose', '-v', action='store_true',
+        help='Also list queries without findings',
+    )
+    opts = parser.parse_args(args)
+
+    reports = []
+    for path in opts.dashboards or find_dashboards():
+        reports.extend(lint_module(
+            path, load_module(path), opts.fleet_size, opts.scrape_interval))
+    write_report(reports, sys.stdout, opts.verbose)
+    return 1 if any(r.findings for r in reports) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,134 @@
+"""Long-range mode: read hourly downsampled series on wide time ranges.
+
+Over 7 or 30 days a ``rate(...[5m])`` panel reads the raw samples of the
+whole range. ``long_range_mode`` gives every costly query of a range
+panel (the rates, ratios and joins ``recording_rules.py`` records) a
+downsampled alternative, an hourly ``avg_over_time`` of the recorded
+expression, and picks one of the two from the time range::
+
+    rate(system_io_read_bytes{job=~"$job"}[5m])
+
+becomes::
+
+    (rate(system_io_read_bytes{job=~"$job", __tier__=~"x{$long_range}"}[5m])
+     or instance:system_io_read_bytes:rate5m_avg_over_time1h{job=~"$job", __tier__!~"x{$long_range}"})
+
+The hidden ``long_range`` variable is 1 when the selected range is at
+least ``LONG_RANGE`` and 0 otherwise, and is recomputed when the range
+changes. ``__tier__`` is never stored (Prometheus drops labels starting
+with ``__``), so ``__tier__=~"x{0}"`` matches every series and
+``__tier__=~"x{1}"`` none: the side not in use selects no series and
+reads no samples. Queries under a ``max`` aggregation read the hourly
+``max_over_time`` instead, so peaks survive downsampling.
+
+The rules the downsampled series need are kept in ``dashboard.downsampled``
+and written by ``recording_rules.py``. Expressions the module names itself
+in ``create_*_recording_rules`` keep that name, e.g.
+``instance:node_filesystem_avail_bytes:seconds_until_empty6h_avg_over_time1h``. Instant queries and queries
+evaluated by alerts keep reading raw samples.
+"""
+
+import collections
+import hashlib
+
+import attr
+from grafanalib.core import REFRESH_ON_TIME_RANGE_CHANGE
+
+import promql
+from dashboard_utils import copy_extras, rewrite_panel_queries
+from recording_rules import generalize, is_costly, rule_name
+from variables import result_variable
+
+
+# Ranges from which panels read the downsampled series.
+LONG_RANGE = '3d'
+# Resolution of the downsampled series.
+TIER_RESOLUTION = '1h'
+
+TIER_VARIABLE = 'long_range'
+TIER_LABEL = '__tier__'
+_TIER_REGEX = 'x{$' + TIER_VARIABLE + '}'
+
+# Aggregations whose queries downsample to the hourly maximum.
+PEAK_AGGREGATIONS = {'max'}
+
+
+def tier_variable(threshold=LONG_RANGE):
+    """Hidden variable: 1 on ranges of at least ``threshold``, else 0."""
+    return result_variable(
+        TIER_VARIABLE,
+        'vector($__range_s) >= bool {:g}'.format(promql.parse_duration(threshold)),
+        refresh=REFRESH_ON_TIME_RANGE_CHANGE,
+    )
+
+
+def _guard(node, op):
+    def visit(n):
+        if isinstance(n, promql.VectorSelector):
+            return attr.evolve(n, matchers=list(n.matchers) + [
+                promql.Matcher(TIER_LABEL, op, _TIER_REGEX)])
+        return n
+    return promql.transform(node, visit)
+
+
+def tiered_expr(expr, downsampled, resolution=TIER_RESOLUTION, names=None):
+    """``expr`` reading downsampled series in long-range mode.
+
+    The series read are added to ``downsampled`` as ``name: (expr,
+    template)``. ``names`` maps recorded expressions to the rule names
+    the module gives them. Queries that do not parse are returned
+    unchanged.
+    """
+    names = names or {}
+    try:
+        node = promql.parse(expr)
+    except promql.PromQLError:
+        return expr
+
+    def downsample(node, func):
+        general, scope = generalize(promql.unwrap(node))
+        if general is None:
+            return None
+        rule = (str(general), '{}({{}}[{}])'.format(func, resolution))
+        name = '{}_{}{}'.format(names.get(rule[0]) or rule_name(general), func, resolution)
+        if downsampled.get(name, rule) != rule:
+            name += '_' + hashlib.sha1(rule[0].encode('utf-8')).hexdigest()[:8]
+        downsampled[name] = rule
+        return promql.Paren(promql.BinaryOp(
+            op='or', lhs=_guard(node, '=~'),
+            rhs=promql.VectorSelector(metric=name, matchers=list(scope) + [
+                promql.Matcher(TIER_LABEL, '!~', _TIER_REGEX)])))
+
+    def tier(func):
+        def visit(n):
+            if (isinstance(n, promql.Aggregation) and n.op in PEAK_AGGREGATIONS
+                    and func != 'max_over_time'):
+                return attr.evolve(n, expr=promql.rewrite(n.expr, tier('max_over_time')))
+            return downsample(n, func) if is_costly(n) else None
+        return visit
+
+    return str(promql.rewrite(node, tier('avg_over_time')))
+
+
+def long_range_mode(dashboard, threshold=LONG_RANGE, recorded=None):
+    """Return a copy of ``dashboard`` reading downsampled series on long ranges.
+
+    ``recorded`` holds the ``{name: expr}`` rules of the module's
+    ``create_*_recording_rules``.
+    """
+    names = dict((str(promql.parse(expr)), name) for name, expr in (recorded or {}).items())
+    downsampled = collections.OrderedDict(getattr(dashboard, 'downsampled', None) or {})
+
+    def map_panel(panel):
+        if not getattr(panel, 'targets', None):
+            return panel
+        return rewrite_panel_queries(panel, lambda expr: tiered_expr(expr, downsampled, names=names),
+                                     select=lambda target: not target.instant)
+
+    new = copy_extras(dashboard, dashboard._map_panels(map_panel))
+    if not downsampled:
+        return new
+    new.downsampled = downsampled
+    new.templating = attr.evolve(dashboard.templating, list=list(dashboard.templating.list) + [
+        tier_variable(threshold)])
+    return new
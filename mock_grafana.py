@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+"""A local stand-in for the Grafana HTTP API, for trying out ``upload.py``.
+
+Implements just enough of the API for the uploader: listing and creating
+folders, and saving and fetching dashboards by uid with version numbers.
+Connections are kept alive like Grafana's. ``--latency`` delays every
+response and ``--fail-rate`` answers a share of requests with ``503`` to
+exercise the uploader's retries, with a ``Retry-After`` header if
+``--retry-after`` is given.
+
+Usage::
+
+    python mock_grafana.py --port 3001 --latency 0.02 --fail-rate 0.05
+"""
+
+import argparse
+import json
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class GrafanaState(object):
+    """Folders and dashboards stored by the mock server."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.folders = {}      # uid -> title
+        self.dashboards = {}   # uid -> (dashboard, folder uid, version)
+        self.requests = 0
+        self.connections = 0
+
+    def save(self, dashboard, folder_uid):
+        with self.lock:
+            uid = dashboard.get('uid') or uuid.uuid4().hex[:9]
+            _, _, version = self.dashboards.get(uid, (None, None, 0))
+            version += 1
+            dashboard = dict(dashboard, uid=uid, version=version,
+                             id=abs(hash(uid)) % 100000)
+            self.dashboards[uid] = (dashboard, folder_uid, version)
+            return {'status': 'success', 'uid': uid, 'version': version,
+                    'id': dashboard['id'], 'url': '/d/{}'.format(uid)}
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written separately; without this, Nagle's
+    # algorithm holds the body back until the client's delayed ACK.
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        with self.server.state.lock:
+            self.server.state.connections += 1
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+    def _send(self, status, payload, headers=None):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length).decode('utf-8')) if length else {}
+
+    def _begin(self):
+        state = self.server.state
+        with state.lock:
+            state.requests += 1
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        if random.random() < self.server.fail_rate:
+            self._body()
+            headers = {}
+            if self.server.retry_after is not None:
+                headers['Retry-After'] = str(self.server.retry_after)
+            self._send(503, {'message': 'service unavailable'}, headers)
+            return False
+        return True
+
+    def do_GET(self):
+        if not self._begin():
+            return
+        state = self.server.state
+        path = self.path.split('?', 1)[0]
+        if path == '/api/folders':
+            with state.lock:
+                folders = [{'uid': u, 'title': t} for u, t in sorted(state.folders.items())]
+            return self._send(200, folders)
+        m = re.match(r'^/api/dashboards/uid/([^/]+)$', path)
+        if m:
+            with state.lock:
+                stored = state.dashboards.get(m.group(1))
+            if stored is None:
+                return self._send(404, {'message': 'Dashboard not found'})
+            dashboard, folder_uid, version = stored
+            return self._send(200, {
+                'dashboard': dashboard,
+                'meta': {'folderUid': folder_uid or '', 'version': version},
+            })
+        self._send(404, {'message': 'Not found'})
+
+    def do_POST(self):
+        if not self._begin():
+            return
+        state = self.server.state
+        payload = self._body()
+        if self.path == '/api/folders':
+            uid = payload.get('uid') or uuid.uuid4().hex[:9]
+            with state.lock:
+                if payload['title'] in state.folders.values():
+                    return self._send(409, {'message': 'a folder with that name already exists'})
+                state.folders[uid] = payload['title']
+            return self._send(200, {'uid': uid, 'title': payload['title']})
+        if self.path == '/api/dashboards/db':
+            folder_uid = payload.get('folderUid')
+            if folder_uid and folder_uid not in state.folders:
+                return self._send(400, {'message': 'folder not found'})
+            return self._send(200, state.save(payload['dashboard'], folder_uid))
+        self._send(404, {'message': 'Not found'})
+
+
+def serve(port=0, latency=0.0, fail_rate=0.0, verbose=False, retry_after=None):
+    """Start the server in a background thread; return it.
+
+    ``server.server_address`` has the port when ``port`` is 0, and
+    ``server.state`` the stored folders and dashboards.
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+    server.daemon_threads = True
+    server.state = GrafanaState()
+    server.latency = latency
+    server.fail_rate = fail_rate
+    server.retry_after = retry_after
+    server.verbose = verbose
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def main(args):
+    parser = argparse.ArgumentParser(prog='mock_grafana')
+    parser.add_argument('--port', type=int, default=3001)
+    parser.add_argument(
+        '--latency', type=float, default=0.0,
+        help='Seconds to wait before each response (default: %(default)s)',
+    )
+    parser.add_argument(
+        '--fail-rate', type=float, default=0.0,
+        help='Share of requests answered with 503 (default: %(default)s)',
+    )
+    parser.add_argument(
+        '--retry-after', type=int,
+        help='Retry-After seconds sent with the 503 answers',
+    )
+    parser.add_argument('--verbose', '-v', action='store_true', help='Log requests')
+    opts = parser.parse_args(args)
+    server = serve(opts.port, opts.latency, opts.fail_rate, opts.verbose,
+                   opts.retry_after)
+    sys.stderr.write('mock Grafana listening on http://127.0.0.1:{}\n'.format(
+        server.server_address[1]))
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -1,12 +1,78 @@
 from grafanalib.core import (
     Dashboard, TimeSeries, Target, GridPos,
-    SHORT_FORMAT, BYTES_FORMAT,
+    SHORT_FORMAT, BYTES_FORMAT, PERCENT_FORMAT,
     OPS_FORMAT, Stat, AlertCondition, Alert,
     Evaluator, TimeRange, OP_AND,
     EVAL_GT, STATE_ALERTING, Template, Templating, STATE_NO_DATA,
+    REFRESH_ON_TIME_RANGE_CHANGE,
     Graph
 )
 
+from alert_tests import AlertTest
+from dashboard_utils import apply_passes
+from fleet_view import fleet_panels
+from layout import Section, layout
+from rate_window import RateWindowPolicy, min_interval_variable
+from registry import lazy_dashboard, register
+from variables import query_variable
+
+# Metrics the dashboard queries, see registry.py.
+METRICS = [
+    'mysql_global_status_aborted_clients',
+    'mysql_global_status_aborted_connects',
+    'mysql_global_status_buffer_pool_dirty_pages',
+    'mysql_global_status_buffer_pool_page_changes_total',
+    'mysql_global_status_buffer_pool_pages',
+    'mysql_global_status_buffer_pool_read_requests',
+    'mysql_global_status_buffer_pool_reads',
+    'mysql_global_status_commands_total',
+    'mysql_global_status_connection_errors_total',
+    'mysql_global_status_innodb_buffer_pool_read_ahead',
+    'mysql_global_status_innodb_buffer_pool_read_ahead_evicted',
+    'mysql_global_status_innodb_data_reads',
+    'mysql_global_status_innodb_data_writes',
+    'mysql_global_status_innodb_log_waits',
+    'mysql_global_status_slow_queries',
+    'mysql_global_status_threads_cached',
+    'mysql_global_status_threads_connected',
+    'mysql_global_status_threads_running',
+    'mysql_global_variables_innodb_page_size',
+    'mysql_global_variables_max_connections',
+    'mysql_up',
+]
+
+
+def buffer_pool_hit_ratio(window='$__rate_interval'):
+    """Share of buffer pool page reads served from memory, in percent."""
+    return ('(1 - rate(mysql_global_status_buffer_pool_reads[{w}])'
+            ' / rate(mysql_global_status_buffer_pool_read_requests[{w}])) * 100').format(w=window)
+
+
+# Pages in the buffer pool; mysqld_exporter does not export the total.
+BUFFER_POOL_PAGES = 'sum without (state) (mysql_global_status_buffer_pool_pages{state=~"data|free|misc"})'
+
+# Instances whose hit ratio is below the threshold. Idle servers are
+# skipped: a few misses make the ratio meaningless.
+LOW_HIT_RATIO = ('{} < $hit_ratio_threshold'
+                 ' and rate(mysql_global_status_buffer_pool_read_requests[15m]) > 10').format(
+    buffer_pool_hit_ratio('15m'))
+
+# Rate windows and min interval of the panels; see rate_window.py.
+RATE_WINDOWS = RateWindowPolicy()
+
+# Series per instance, used to size the selection; see fleet_view.py.
+INSTANCE_METRIC = 'mysql_up'
+
+# Key metrics compared across instances in the Fleet row and shard index.
+FLEET_SUMMARY = [
+    ("Threads Connected", 'mysql_global_status_threads_connected', SHORT_FORMAT),
+    ("Threads Running", 'mysql_global_status_threads_running', SHORT_FORMAT),
+    ("Queries", 'sum without (command) (rate(mysql_global_status_commands_total'
+                '{command=~"select|insert|update|delete"}[$__rate_interval]))', OPS_FORMAT),
+    ("Buffer Pool Hit Ratio", buffer_pool_hit_ratio(), PERCENT_FORMAT),
+]
+
+
 def create_mysql_alerts():
     """Create all alert definitions used in the dashboard"""
     return {
@@ -18,7 +84,7 @@ def create_mysql_alerts():
             alertConditions=[
                 AlertCondition(
                     Target(
-                        expr='mysql_up{job=~"$job", instance=~"$instance", environment=~"$environment"} == 0',
+                        expr='mysql_up == 0',
                         refId='A',
                     ),
                     timeRange=TimeRange("5m", "now"),
@@ -36,7 +102,7 @@ def create_mysql_alerts():
             alertConditions=[
                 AlertCondition(
                     Target(
-                        expr='mysql_global_status_threads_connected{job=~"$job", instance=~"$instance", environment=~"$environment"} / mysql_global_variables_max_connections * 100 > $connection_threshold',
+                        expr='mysql_global_status_threads_connected / mysql_global_variables_max_connections * 100 > $connection_threshold',
                         refId='A',
                     ),
                     timeRange=TimeRange("5m", "now"),
@@ -54,7 +120,7 @@ def create_mysql_alerts():
             alertConditions=[
                 AlertCondition(
                     Target(
-                        expr='rate(mysql_global_status_connection_errors_total{job=~"$job", instance=~"$instance", environment=~"$environment"}[5m]) > 1',
+                        expr='rate(mysql_global_status_connection_errors_total[5m]) > 1',
                         refId='A',
                     ),
                     timeRange=TimeRange("5m", "now"),
@@ -72,7 +138,8 @@ def create_mysql_alerts():
             alertConditions=[
                 AlertCondition(
                     Target(
-                        expr='mysql_global_status_buffer_pool_pages{job=~"$job", instance=~"$instance", environment=~"$environment", state="free"} / mysql_global_status_buffer_pool_pages{state="total"} * 100 < $buffer_pool_threshold',
+                        expr='mysql_global_status_buffer_pool_pages{{state="free"}} / ignoring(state) {} * 100 < $buffer_pool_threshold'.format(
+                            BUFFER_POOL_PAGES),
                         refId='A',
                     ),
                     timeRange=TimeRange("15m", "now"),
@@ -82,10 +149,85 @@ def create_mysql_alerts():
             ],
             frequency="5m",
         ),
+        'buffer_pool_hit_ratio': Alert(
+            name="InnoDB Buffer Pool Hit Ratio Low",
+            message="MySQL instance {{ $labels.instance }} reads too many pages from disk; "
+                    "innodb_buffer_pool_size may be too small",
+            executionErrorState=STATE_ALERTING,
+            noDataState=STATE_NO_DATA,
+            alertConditions=[
+                AlertCondition(
+                    Target(
+                        expr=LOW_HIT_RATIO,
+                        refId='C',
+                    ),
+                    timeRange=TimeRange("15m", "now"),
+                    evaluator=Evaluator(EVAL_GT, 0),
+                    operator=OP_AND,
+                )
+            ],
+            frequency="5m",
+        ),
     }
 
-def create_mysql_dashboard():
-    """Create the MySQL dashboard with all panels and alerts"""
+
+def create_mysql_alert_tests():
+    """Offline tests for the MySQL alerts, see alert_tests.py"""
+    return [
+        AlertTest(
+            alert="InnoDB Buffer Pool Low Free Pages",
+            series={
+                # db-1: 5% of the 1000 pages free; db-2: 50%.
+                'mysql_global_status_buffer_pool_pages{instance="db-1:9104", state="data"}': '900x20',
+                'mysql_global_status_buffer_pool_pages{instance="db-1:9104", state="free"}': '50x20',
+                'mysql_global_status_buffer_pool_pages{instance="db-1:9104", state="misc"}': '50x20',
+                'mysql_global_status_buffer_pool_pages{instance="db-2:9104", state="data"}': '450x20',
+                'mysql_global_status_buffer_pool_pages{instance="db-2:9104", state="free"}': '500x20',
+                'mysql_global_status_buffer_pool_pages{instance="db-2:9104", state="misc"}': '50x20',
+            },
+            firing=[
+                ('4m', []),
+                ('5m', [{'instance': 'db-1:9104'}]),
+            ],
+        ),
+        AlertTest(
+            alert="InnoDB Buffer Pool Hit Ratio Low",
+            series={
+                # db-1: 100 requests/s, 10% from disk; db-2: 0.1% from disk;
+                # db-3: idle, every read from disk.
+                'mysql_global_status_buffer_pool_read_requests{instance="db-1:9104"}': '0+6000x40',
+                'mysql_global_status_buffer_pool_reads{instance="db-1:9104"}': '0+600x40',
+                'mysql_global_status_buffer_pool_read_requests{instance="db-2:9104"}': '0+6000x40',
+                'mysql_global_status_buffer_pool_reads{instance="db-2:9104"}': '0+6x40',
+                'mysql_global_status_buffer_pool_read_requests{instance="db-3:9104"}': '0+60x40',
+                'mysql_global_status_buffer_pool_reads{instance="db-3:9104"}': '0+60x40',
+            },
+            firing=[
+                ('30m', [{'instance': 'db-1:9104'}]),
+            ],
+        ),
+        AlertTest(
+            alert="InnoDB Buffer Pool Hit Ratio Low",
+            series={
+                # Busy and healthy: 99.9% of page reads from memory.
+                'mysql_global_status_buffer_pool_read_requests{instance="db-1:9104"}': '0+60000x40',
+                'mysql_global_status_buffer_pool_reads{instance="db-1:9104"}': '0+60x40',
+            },
+            firing=[
+                ('15m', []),
+                ('30m', []),
+            ],
+        ),
+    ]
+
+
+@register('mysql', title='MySQL Overview', tags=['mysql', 'database'], metrics=METRICS)
+def create_mysql_dashboard(params=None):
+    """Create the MySQL dashboard with all panels and alerts
+
+    ``params`` describes a cluster, see cluster.py; the alert thresholds
+    are the ``*_threshold`` variables.
+    """
 
     alerts = create_mysql_alerts()
 
@@ -106,35 +248,18 @@ def create_mysql_dashboard():
                     type="datasource",
                     regex="/.*/"
                 ),
-                Template(
-                    name="job",
-                    label="Job",
-                    dataSource="${datasource}",
-                    query='label_values(mysql_up, job)',
-                    type="query",
-                    refresh=1,
-                    includeAll=True,
-                    multi=True
+                query_variable(
+                    "job", "mysql_up", title="Job", includeAll=True, multi=True,
                 ),
-                Template(
-                    name="instance",
-                    label="Instance",
-                    dataSource="${datasource}",
-                    query='label_values(mysql_up{job=~"$job"}, instance)',
-                    type="query",
-                    refresh=2,
+                query_variable(
+                    "environment", "mysql_up", scope=["job"], title="Environment",
                     includeAll=True,
-                    multi=True
                 ),
-                Template(
-                    name="environment",
-                    label="Environment",
-                    dataSource="${datasource}",
-                    query='label_values(mysql_up, environment)',
-                    type="query",
-                    refresh=1,
-                    includeAll=True
+                query_variable(
+                    "instance", "mysql_up", scope=["job", "environment"], title="Instance",
+                    refresh=REFRESH_ON_TIME_RANGE_CHANGE, includeAll=True, multi=True,
                 ),
+                min_interval_variable(RATE_WINDOWS),
                 Template(
                     name="connection_threshold",
                     label="Connection Alert Threshold %",
@@ -158,23 +283,32 @@ def create_mysql_dashboard():
                     query="",
                     type="constant",
                     default="10"
+                ),
+                Template(
+                    name="hit_ratio_threshold",
+                    label="Buffer Pool Hit Ratio % Threshold",
+                    dataSource=None,
+                    query="",
+                    type="constant",
+                    default="99"
                 )
             ]
         ),
-        panels=[
+        panels=layout([Section(None, [
             # MySQL Up Status
             Graph(
                 title="MySQL Status",
                 dataSource="${datasource}",
                 targets=[
                     Target(
-                        expr='mysql_up{job=~"$job", instance=~"$instance", environment=~"$environment"}',
+                        expr='mysql_up',
                         refId='A',
                     )
                 ],
                 gridPos=GridPos(h=3, w=4, x=0, y=0),
                 alert=alerts['mysql_down'],
             ),
+        ]), Section(None, [
 
             # Connections
             Graph(
@@ -182,12 +316,12 @@ def create_mysql_dashboard():
                 dataSource="${datasource}",
                 targets=[
                     Target(
-                        expr='mysql_global_status_threads_connected{job=~"$job", instance=~"$instance", environment=~"$environment"}',
+                        expr='mysql_global_status_threads_connected',
                         refId='A',
                         legendFormat='Connected Threads',
                     ),
                     Target(
-                        expr='mysql_global_variables_max_connections{job=~"$job", instance=~"$instance", environment=~"$environment"}',
+                        expr='mysql_global_variables_max_connections',
                         refId='B',
                         legendFormat='Max Used',
                     )
@@ -202,7 +336,7 @@ def create_mysql_dashboard():
                 dataSource="${datasource}",
                 targets=[
                     Target(
-                        expr='rate(mysql_global_status_connection_errors_total{job=~"$job", instance=~"$instance", environment=~"$environment"}[5m])',
+                        expr='rate(mysql_global_status_connection_errors_total[$__rate_interval])',
                         refId='A',
                         legendFormat='{{error}}',
                     )
@@ -218,12 +352,12 @@ def create_mysql_dashboard():
                 dataSource="${datasource}",
                 targets=[
                     Target(
-                        expr='mysql_global_status_buffer_pool_pages{job=~"$job", instance=~"$instance", environment=~"$environment",state="data"} * on(instance) mysql_global_variables_innodb_page_size{job=~"$job", instance=~"$instance", environment=~"$environment"}',
+                        expr='mysql_global_status_buffer_pool_pages{state="data"} * on(instance) mysql_global_variables_innodb_page_size',
                         refId='A',
                         legendFormat='Data',
                     ),
                     Target(
-                        expr='mysql_global_status_buffer_pool_pages{job=~"$job", instance=~"$instance", environment=~"$environment",state="free"} * on(instance) mysql_global_variables_innodb_page_size{job=~"$job", instance=~"$instance", environment=~"$environment"}',
+                        expr='mysql_global_status_buffer_pool_pages{state="free"} * on(instance) mysql_global_variables_innodb_page_size',
                         refId='B',
                         legendFormat='Free',
                     ),
@@ -239,12 +373,12 @@ def create_mysql_dashboard():
                 dataSource="${datasource}",
                 targets=[
                     Target(
-                        expr='rate(mysql_global_status_innodb_data_reads{job=~"$job", instance=~"$instance", environment=~"$environment"}[5m])',
+                        expr='rate(mysql_global_status_innodb_data_reads[$__rate_interval])',
                         refId='A',
                         legendFormat='Reads',
                     ),
                     Target(
-                        expr='rate(mysql_global_status_innodb_data_writes{job=~"$job", instance=~"$instance", environment=~"$environment"}[5m])',
+                        expr='rate(mysql_global_status_innodb_data_writes[$__rate_interval])',
                         refId='B',
                         legendFormat='Writes',
                     ),
@@ -261,7 +395,7 @@ def create_mysql_dashboard():
                 dataSource="${datasource}",
                 targets=[
                     Target(
-                        expr='rate(mysql_global_status_slow_queries{job=~"$job", instance=~"$instance", environment=~"$environment"}[5m])',
+                        expr='rate(mysql_global_status_slow_queries[$__rate_interval])',
                         refId='A',
                         legendFormat='Slow Queries',
                     )
@@ -276,7 +410,7 @@ def create_mysql_dashboard():
                 dataSource="${datasource}",
                 targets=[
                     Target(
-                        expr='rate(mysql_global_status_commands_total{command=~"select|insert|update|delete",job=~"$job", instance=~"$instance", environment=~"$environment"}[5m])',
+                        expr='rate(mysql_global_status_commands_total{command=~"select|insert|update|delete"}[$__rate_interval])',
                         refId='A',
                         legendFormat='{{command}}',
                     )
@@ -293,17 +427,17 @@ def create_mysql_dashboard():
                 dataSource="${datasource}",
                 targets=[
                     Target(
-                        expr='mysql_global_status_threads_running{job=~"$job", instance=~"$instance", environment=~"$environment"}',
+                        expr='mysql_global_status_threads_running',
                         refId='A',
                         legendFormat='Running',
                     ),
                     Target(
-                        expr='mysql_global_status_threads_connected{job=~"$job", instance=~"$instance", environment=~"$environment"}',
+                        expr='mysql_global_status_threads_connected',
                         refId='B',
                         legendFormat='Connected',
                     ),
                     Target(
-                        expr='mysql_global_status_threads_cached{job=~"$job", instance=~"$instance", environment=~"$environment"}',
+                        expr='mysql_global_status_threads_cached',
                         refId='C',
                         legendFormat='Cached',
                     ),
@@ -313,23 +447,33 @@ def create_mysql_dashboard():
             ),
 
             # Buffer Pool Hit Ratio
-            TimeSeries(
+            Graph(
                 title="Buffer Pool Hit Ratio",
+                description="Page reads served from the buffer pool, and those that went "
+                            "to disk. A falling hit ratio means innodb_buffer_pool_size "
+                            "no longer holds the working set.",
                 dataSource="${datasource}",
                 targets=[
                     Target(
-                        expr='rate(mysql_global_status_buffer_pool_read_requests{job=~"$job", instance=~"$instance", environment=~"$environment"}[5m])',
+                        expr=buffer_pool_hit_ratio(),
                         refId='A',
-                        legendFormat='Read Requests',
+                        legendFormat='Hit Ratio {{instance}}',
                     ),
                     Target(
-                        expr='rate(mysql_global_status_buffer_pool_reads{job=~"$job", instance=~"$instance", environment=~"$environment"}[5m])',
+                        expr='rate(mysql_global_status_buffer_pool_reads[$__rate_interval]) / rate(mysql_global_status_buffer_pool_read_requests[$__rate_interval]) * 100',
                         refId='B',
-                        legendFormat='Reads',
-                    )
+                        legendFormat='Disk Reads {{instance}}',
+                    ),
+                    # Evaluated by the alert only.
+                    Target(
+                        expr=LOW_HIT_RATIO,
+                        refId='C',
+                        hide=True,
+                    ),
                 ],
                 gridPos=GridPos(h=8, w=12, x=12, y=27),
-                unit=OPS_FORMAT,
+                unit=PERCENT_FORMAT,
+                alert=alerts['buffer_pool_hit_ratio'],
             ),
 
             # Connection Aborts
@@ -338,12 +482,12 @@ def create_mysql_dashboard():
                 dataSource="${datasource}",
                 targets=[
                     Target(
-                        expr='rate(mysql_global_status_aborted_connects{job=~"$job", instance=~"$instance", environment=~"$environment"}[5m])',
+                        expr='rate(mysql_global_status_aborted_connects[$__rate_interval])',
                         refId='A',
                         legendFormat='Connect Aborts',
                     ),
                     Target(
-                        expr='rate(mysql_global_status_aborted_clients{job=~"$job", instance=~"$instance", environment=~"$environment"}[5m])',
+                        expr='rate(mysql_global_status_aborted_clients[$__rate_interval])',
                         refId='B',
                         legendFormat='Client Aborts',
                     )
@@ -351,9 +495,75 @@ def create_mysql_dashboard():
                 gridPos=GridPos(h=8, w=12, x=0, y=35),
                 unit=OPS_FORMAT,
             ),
-        ],
+
+            # Dirty Pages
+            TimeSeries(
+                title="Buffer Pool Dirty Pages",
+                description="Modified pages not yet flushed to disk",
+                dataSource="${datasource}",
+                targets=[
+                    Target(
+                        expr='mysql_global_status_buffer_pool_dirty_pages / {} * 100'.format(BUFFER_POOL_PAGES),
+                        refId='A',
+                        legendFormat='Dirty {{instance}}',
+                    ),
+                ],
+                gridPos=GridPos(h=8, w=12, x=12, y=35),
+                unit=PERCENT_FORMAT,
+            ),
+
+            # Pages Flushed
+            TimeSeries(
+                title="Buffer Pool Pages Flushed",
+                dataSource="${datasource}",
+                targets=[
+                    Target(
+                        expr='rate(mysql_global_status_buffer_pool_page_changes_total{operation="flushed"}[$__rate_interval])',
+                        refId='A',
+                        legendFormat='Flushed {{instance}}',
+                    ),
+                ],
+                gridPos=GridPos(h=8, w=12, x=0, y=43),
+                unit=OPS_FORMAT,
+            ),
+
+            # Read-Ahead Efficiency
+            TimeSeries(
+                title="Read-Ahead Efficiency",
+                description="Pages read ahead that were used before being evicted",
+                dataSource="${datasource}",
+                targets=[
+                    Target(
+                        expr='(1 - rate(mysql_global_status_innodb_buffer_pool_read_ahead_evicted[$__rate_interval]) / rate(mysql_global_status_innodb_buffer_pool_read_ahead[$__rate_interval])) * 100',
+                        refId='A',
+                        legendFormat='Used {{instance}}',
+                    ),
+                ],
+                gridPos=GridPos(h=8, w=12, x=12, y=43),
+                unit=PERCENT_FORMAT,
+            ),
+
+            # Log Waits
+            TimeSeries(
+                title="InnoDB Log Waits",
+                description="Waits for the log buffer to be flushed; sustained waits mean "
+                            "innodb_log_buffer_size is too small",
+                dataSource="${datasource}",
+                targets=[
+                    Target(
+                        expr='rate(mysql_global_status_innodb_log_waits[$__rate_interval])',
+                        refId='A',
+                        legendFormat='Waits {{instance}}',
+                    ),
+                ],
+                gridPos=GridPos(h=8, w=12, x=0, y=51),
+                unit=OPS_FORMAT,
+            ),
+        ]), Section("Fleet", fleet_panels(FLEET_SUMMARY), collapsed=True)]),
     )
-    return dashboard
+    return apply_passes(dashboard, params, RATE_WINDOWS, INSTANCE_METRIC,
+                        bottom=["MySQL Status"])
+
 
-# Create dashboard instance
-dashboard = create_mysql_dashboard()
+# Built on first access of ``dashboard``
+__getattr__ = lazy_dashboard(create_mysql_dashboard)
@@ -0,0 +1,594 @@
+"""Minimal PromQL parser used by the dashboard tooling.
+
+Only the subset of PromQL that appears in the dashboard targets is
+supported, plus the common constructs around it: selectors, range
+vectors, subqueries, function calls, aggregations and binary operators
+with vector matching. Grafana template variables (``$job``,
+``$rate_interval``, ``${datasource}``) are accepted wherever a value or
+duration may appear.
+"""
+
+import re
+
+import attr
+
+
+AGGREGATIONS = {
+    'sum', 'min', 'max', 'avg', 'group', 'stddev', 'stdvar', 'count',
+    'count_values', 'bottomk', 'topk', 'quantile',
+}
+SET_OPERATORS = {'and', 'or', 'unless'}
+COMPARISON_OPERATORS = {'==', '!=', '>', '<', '>=', '<='}
+ARITHMETIC_OPERATORS = {'+', '-', '*', '/', '%', '^', 'atan2'}
+
+# Binding power of binary operators, lowest first.
+_PRECEDENCE = {
+    'or': 1,
+    'and': 2, 'unless': 2,
+    '==': 3, '!=': 3, '>': 3, '<': 3, '>=': 3, '<=': 3,
+    '+': 4, '-': 4,
+    '*': 5, '/': 5, '%': 5, 'atan2': 5,
+    '^': 6,
+}
+
+# Functions whose first argument is a range vector of counter samples.
+COUNTER_FUNCTIONS = {'rate', 'irate', 'increase', 'resets'}
+
+
+class PromQLError(Exception):
+    """Raised when an expression cannot be parsed."""
+
+
+@attr.s
+class Matcher(object):
+    """A single label matcher inside ``{...}``."""
+
+    label = attr.ib()
+    op = attr.ib(default='=')
+    value = attr.ib(default='')
+
+    def uses_variable(self):
+        return '$' in self.value
+
+    def __str__(self):
+        return '{}{}{}'.format(self.label, self.op, quote(self.value))
+
+
+@attr.s
+class VectorSelector(object):
+    """``metric{matchers}[range] offset x @ t``."""
+
+    metric = attr.ib(default=None)
+    matchers = attr.ib(default=attr.Factory(list))
+    range = attr.ib(default=None)
+    offset = attr.ib(default=None)
+    at = attr.ib(default=None)
+
+    def matcher(self, label):
+        for m in self.matchers:
+            if m.label == label:
+                return m
+        return None
+
+    def __str__(self):
+        out = self.metric or ''
+        if self.matchers or not self.metric:
+            out += '{' + ', '.join(str(m) for m in self.matchers) + '}'
+        if self.range is not None:
+            out += '[{}]'.format(self.range)
+        if self.offset is not None:
+            out += ' offset {}'.format(self.offset)
+        if self.at is not None:
+            out += ' @ {}'.format(self.at)
+        return out
+
+
+@attr.s
+class NumberLiteral(object):
+    """A number, kept as written so rendering is lossless."""
+
+    value = attr.ib()
+
+    def __float__(self):
+        return float(self.value)
+
+    def __str__(self):
+        return self.value
+
+
+@attr.s
+class StringLiteral(object):
+    value = attr.ib()
+
+    def __str__(self):
+        return quote(self.value)
+
+
+@attr.s
+class Variable(object):
+    """A Grafana template variable used as a scalar, e.g. ``$threshold``."""
+
+    name = attr.ib()
+
+    def __str__(self):
+        return '$' + self.name
+
+
+@attr.s
+class Paren(object):
+    expr = attr.ib()
+
+    def __str__(self):
+        return '({})'.format(self.expr)
+
+
+@attr.s
+class UnaryOp(object):
+    op = attr.ib()
+    expr = attr.ib()
+
+    def __str__(self):
+        return '{}{}'.format(self.op, self.expr)
+
+
+@attr.s
+class Call(object):
+    """A function call such as ``rate(x[5m])``."""
+
+    func = attr.ib()
+    args = attr.ib(default=attr.Factory(list))
+
+    def __str__(self):
+        return '{}({})'.format(self.func, ', '.join(str(a) for a in self.args))
+
+
+@attr.s
+class Aggregation(object):
+    """``op by (labels) (param, expr)``."""
+
+    op = attr.ib()
+    expr = attr.ib()
+    param = attr.ib(default=None)
+    grouping = attr.ib(default=None)
+    without = attr.ib(default=False)
+
+    def __str__(self):
+        out = self.op
+        if self.grouping is not None:
+            out += ' {} ({})'.format(
+                'without' if self.without else 'by', ', '.join(self.grouping))
+        args = [self.expr] if self.param is None else [self.param, self.expr]
+        return out + ' ({})'.format(', '.join(str(a) for a in args))
+
+
+@attr.s
+class Subquery(object):
+    """``expr[range:step] @ t``."""
+
+    expr = attr.ib()
+    range = attr.ib()
+    step = attr.ib(default=None)
+    at = attr.ib(default=None)
+
+    def __str__(self):
+        out = '{}[{}:{}]'.format(self.expr, self.range, self.step or '')
+        if self.at is not None:
+            out += ' @ {}'.format(self.at)
+        return out
+
+
+@attr.s
+class BinaryOp(object):
+    """A binary operation with optional vector matching modifiers."""
+
+    op = attr.ib()
+    lhs = attr.ib()
+    rhs = attr.ib()
+    return_bool = attr.ib(default=False)
+    matching = attr.ib(default=None)
+    matching_labels = attr.ib(default=attr.Factory(list))
+    group = attr.ib(default=None)
+    group_labels = attr.ib(default=attr.Factory(list))
+
+    def __str__(self):
+        out = '{} {}'.format(self.lhs, self.op)
+        if self.return_bool:
+            out += ' bool'
+        if self.matching:
+            out += ' {}({})'.format(self.matching, ', '.join(self.matching_labels))
+        if self.group:
+            out += ' {}'.format(self.group)
+            if self.group_labels:
+                out += '({})'.format(', '.join(self.group_labels))
+        return '{} {}'.format(out, self.rhs)
+
+
+# Child attributes for each node type, used by ``walk`` and ``transform``.
+_CHILDREN = {
+    Paren: ('expr',),
+    UnaryOp: ('expr',),
+    Call: ('args',),
+    Aggregation: ('param', 'expr'),
+    Subquery: ('expr',),
+    BinaryOp: ('lhs', 'rhs'),
+}
+
+
+_DURATION_UNITS = [
+    ('y', 365 * 86400), ('w', 7 * 86400), ('d', 86400), ('h', 3600),
+    ('m', 60), ('s', 1), ('ms', 0.001),
+]
+_DURATION_RE = re.compile(r'(\d+)(ms|s|m|h|d|w|y)')
+
+
+def parse_duration(text):
+    """``"1h30m"`` -> ``5400.0`` seconds."""
+    units = dict(_DURATION_UNITS)
+    parts = _DURATION_RE.findall(text)
+    if not parts or ''.join(n + u for n, u in parts) != text:
+        raise PromQLError('invalid duration {!r}'.format(text))
+    return float(sum(int(n) * units[u] for n, u in parts))
+
+
+def format_duration(seconds):
+    """``5400`` -> ``"1h30m"``."""
+    remaining = int(round(seconds * 1000))
+    out = ''
+    for unit, size in _DURATION_UNITS:
+        size = int(size * 1000)
+        count, remaining = divmod(remaining, size)
+        if count:
+            out += '{}{}'.format(count, unit)
+    return out or '0s'
+
+
+def quote(value):
+    return '"{}"'.format(value.replace('\\', '\\\\').replace('"', '\\"'))
+
+
+def children(node):
+    """Return the direct sub-expressions of ``node``."""
+    out = []
+    for name in _CHILDREN.get(type(node), ()):
+        value = getattr(node, name)
+        if isinstance(value, list):
+            out.extend(value)
+        elif value is not None:
+            out.append(value)
+    return out
+
+
+def walk(node):
+    """Yield ``node`` and all its sub-expressions, parents first."""
+    yield node
+    for child in children(node):
+        for n in walk(child):
+            yield n
+
+
+def transform(node, fn):
+    """Rebuild ``node`` bottom-up, replacing each node with ``fn(node)``."""
+    changes = {}
+    for name in _CHILDREN.get(type(node), ()):
+        value = getattr(node, name)
+        if isinstance(value, list):
+            changes[name] = [transform(v, fn) for v in value]
+        elif value is not None:
+            changes[name] = transform(value, fn)
+    if changes:
+        node = attr.evolve(node, **changes)
+    return fn(node)
+
+
+def rewrite(node, fn):
+    """Rebuild ``node`` top-down.
+
+    ``fn`` is called on each node before its children; when it returns
+    something other than ``None`` that value replaces the whole subtree.
+    """
+    replacement = fn(node)
+    if replacement is not None:
+        return replacement
+    changes = {}
+    for name in _CHILDREN.get(type(node), ()):
+        value = getattr(node, name)
+        if isinstance(value, list):
+            changes[name] = [rewrite(v, fn) for v in value]
+        elif value is not None:
+            changes[name] = rewrite(value, fn)
+    return attr.evolve(node, **changes) if changes else node
+
+
+def selectors(node):
+    """Return every vector selector in ``node``."""
+    return [n for n in walk(node) if isinstance(n, VectorSelector)]
+
+
+def metric_names(node):
+    return [s.metric for s in selectors(node) if s.metric]
+
+
+def is_scalar(node):
+    """Whether ``node`` is known to evaluate to a scalar."""
+    while isinstance(node, (Paren, UnaryOp)):
+        node = node.expr
+    if isinstance(node, (NumberLiteral, Variable)):
+        return True
+    if isinstance(node, Call) and node.func in ('scalar', 'time', 'pi'):
+        return True
+    if isinstance(node, BinaryOp):
+        return is_scalar(node.lhs) and is_scalar(node.rhs)
+    return False
+
+
+def unwrap(node):
+    while isinstance(node, Paren):
+        node = node.expr
+    return node
+
+
+# Tokenizer
+
+_TOKEN_RE = re.compile(r'''
+    (?P<ws>\s+)
+  | (?P<duration>(?:\d+(?:ms|s|m|h|d|w|y))+(?![\w.]))
+  | (?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?|0[xX][0-9a-fA-F]+|[iI]nf|NaN)
+  | (?P<variable>\$\{[^}]+\}|\$\w+|\[\[\w+\]\])
+  | (?P<string>"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*'|`[^`]*`)
+  | (?P<ident>[a-zA-Z_][\w:]*|:(?!\d)[\w:]*)
+  | (?P<op>=~|!~|==|!=|>=|<=|[-+*/%^<>=,(){}\[\]:@])
+''', re.VERBOSE)
+
+
+@attr.s
+class _Token(object):
+    kind = attr.ib()
+    text = attr.ib()
+    pos = attr.ib()
+
+
+def tokenize(expr):
+    tokens = []
+    pos = 0
+    while pos < len(expr):
+        m = _TOKEN_RE.match(expr, pos)
+        if not m:
+            raise PromQLError('unexpected character {!r} at {} in {!r}'.format(
+                expr[pos], pos, expr))
+        kind = m.lastgroup
+        if kind != 'ws':
+            tokens.append(_Token(kind, m.group(), pos))
+        pos = m.end()
+    tokens.append(_Token('eof', '', pos))
+    return tokens
+
+
+def _unquote(text):
+    if text[0] == '`':
+        return text[1:-1]
+    return re.sub(r'\\(.)', r'\1', text[1:-1])
+
+
+def _variable_name(text):
+    if text.startswith('${'):
+        return text[2:-1].split(':')[0]
+    if text.startswith('[['):
+        return text[2:-2]
+    return text[1:]
+
+
+class _Parser(object):
+
+    def __init__(self, expr):
+        self.expr = expr
+        self.tokens = tokenize(expr)
+        self.i = 0
+
+    def peek(self, offset=0):
+        return self.tokens[min(self.i + offset, len(self.tokens) - 1)]
+
+    def next(self):
+        tok = self.tokens[self.i]
+        self.i += 1
+        return tok
+
+    def accept(self, text):
+        if self.peek().text == text and self.peek().kind in ('op', 'ident'):
+            return self.next()
+        return None
+
+    def expect(self, text):
+        tok = self.next()
+        if tok.text != text:
+            self.fail('expected {!r}'.format(text), tok)
+        return tok
+
+    def fail(self, message, tok=None):
+        tok = tok or self.peek()
+        raise PromQLError('{} at {} in {!r}'.format(message, tok.pos, self.expr))
+
+    def parse(self):
+        node = self.expression(0)
+        if self.peek().kind != 'eof':
+            self.fail('unexpected {!r}'.format(self.peek().text))
+        return node
+
+    def binary_operator(self):
+        tok = self.peek()
+        if tok.kind == 'op' and tok.text in _PRECEDENCE:
+            return tok.text
+        if tok.kind == 'ident' and tok.text in _PRECEDENCE:
+            return tok.text
+        return None
+
+    def expression(self, min_precedence):
+        lhs = self.unary()
+        while True:
+            op = self.binary_operator()
+            if op is None or _PRECEDENCE[op] < min_precedence:
+                return lhs
+            self.next()
+            node = BinaryOp(op=op, lhs=lhs, rhs=None)
+            if self.accept('bool'):
+                node.return_bool = True
+            for keyword in ('on', 'ignoring'):
+                if self.accept(keyword):
+                    node.matching = keyword
+                    node.matching_labels = self.label_list()
+            for keyword in ('group_left', 'group_right'):
+                if self.accept(keyword):
+                    node.group = keyword
+                    if self.peek().text == '(':
+                        node.group_labels = self.label_list()
+            # ``^`` is right associative, everything else left.
+            next_min = _PRECEDENCE[op] + (0 if op == '^' else 1)
+            node.rhs = self.expression(next_min)
+            lhs = node
+
+    def unary(self):
+        tok = self.peek()
+        if tok.kind == 'op' and tok.text in ('-', '+'):
+            self.next()
+            return UnaryOp(tok.text, self.unary())
+        return self.postfix(self.primary())
+
+    def postfix(self, node):
+        while True:
+            if self.peek().text == '[':
+                self.next()
+                window = self.duration()
+                if self.accept(':'):
+                    step = None if self.peek().text == ']' else self.duration()
+                    self.expect(']')
+                    node = Subquery(node, window, step)
+                elif isinstance(node, VectorSelector) and node.range is None:
+                    self.expect(']')
+                    node.range = window
+                else:
+                    self.fail('range not allowed here')
+            elif self.peek().text == 'offset':
+                self.next()
+                offset = self.duration()
+                target = node.expr if isinstance(node, Subquery) else node
+                if not isinstance(target, VectorSelector):
+                    self.fail('offset not allowed here')
+                target.offset = offset
+            elif self.peek().text == '@':
+                self.next()
+                if not isinstance(node, (VectorSelector, Subquery)):
+                    self.fail('@ not allowed here')
+                node.at = self.timestamp()
+            else:
+                return node
+
+    def timestamp(self):
+        tok = self.next()
+        if tok.kind == 'number':
+            return tok.text
+        if tok.kind == 'ident' and tok.text in ('start', 'end'):
+            self.expect('(')
+            self.expect(')')
+            return tok.text + '()'
+        self.fail('expected timestamp, start() or end()', tok)
+
+    def duration(self):
+        tok = self.next()
+        if tok.kind in ('duration', 'variable'):
+            return tok.text
+        if tok.kind == 'op' and tok.text == '-':
+            return '-' + self.duration()
+        self.fail('expected duration', tok)
+
+    def label_list(self):
+        self.expect('(')
+        labels = []
+        while self.peek().text != ')':
+            tok = self.next()
+            if tok.kind != 'ident':
+                self.fail('expected label name', tok)
+            labels.append(tok.text)
+            if not self.accept(','):
+                break
+        self.expect(')')
+        return labels
+
+    def primary(self):
+        tok = self.next()
+        if tok.kind == 'number':
+            return NumberLiteral(tok.text)
+        if tok.kind == 'duration':
+            # A bare duration like ``5m`` is never valid outside ranges.
+            self.fail('unexpected duration {!r}'.format(tok.text), tok)
+        if tok.kind == 'string':
+            return StringLiteral(_unquote(tok.text))
+        if tok.kind == 'variable':
+            return Variable(_variable_name(tok.text))
+        if tok.text == '(':
+            node = self.expression(0)
+            self.expect(')')
+            return Paren(node)
+        if tok.text == '{':
+            self.i -= 1
+            return VectorSelector(metric=None, matchers=self.matchers())
+        if tok.kind == 'ident':
+            if tok.text in AGGREGATIONS and self.peek().text in ('(', 'by', 'without'):
+                return self.aggregation(tok.text)
+            if self.peek().text == '(':
+                return self.call(tok.text)
+            matchers = self.matchers() if self.peek().text == '{' else []
+            return VectorSelector(metric=tok.text, matchers=matchers)
+        self.fail('unexpected {!r}'.format(tok.text), tok)
+
+    def matchers(self):
+        self.expect('{')
+        out = []
+        while self.peek().text != '}':
+            label = self.next()
+            if label.kind != 'ident':
+                self.fail('expected label name', label)
+            op = self.next()
+            if op.text not in ('=', '!=', '=~', '!~'):
+                self.fail('expected label matcher', op)
+            value = self.next()
+            if value.kind != 'string':
+                self.fail('expected string', value)
+            out.append(Matcher(label.text, op.text, _unquote(value.text)))
+            if not self.accept(','):
+                break
+        self.expect('}')
+        return out
+
+    def call(self, func):
+        self.expect('(')
+        args = []
+        while self.peek().text != ')':
+            args.append(self.expression(0))
+            if not self.accept(','):
+                break
+        self.expect(')')
+        return Call(func, args)
+
+    def aggregation(self, op):
+        node = Aggregation(op=op, expr=None)
+        self.grouping(node)
+        self.expect('(')
+        first = self.expression(0)
+        if self.accept(','):
+            node.param, node.expr = first, self.expression(0)
+        else:
+            node.expr = first
+        self.expect(')')
+        if node.grouping is None:
+            self.grouping(node)
+        return node
+
+    def grouping(self, node):
+        for keyword in ('by', 'without'):
+            if self.accept(keyword):
+                node.without = keyword == 'without'
+                node.grouping = self.label_list()
+
+
+def parse(expr):
+    """Parse ``expr`` into an expression tree."""
+    return _Parser(expr).parse()
@@ -0,0 +1,564 @@
+"""Evaluate PromQL expressions against a ``tsdb.MemoryTSDB``.
+
+The evaluator follows Prometheus semantics for the parts of the language
+the dashboards use: instant and range selectors with the 5m lookback,
+``rate``/``increase`` extrapolation, ``*_over_time`` functions,
+aggregations and binary operators with ``on``/``ignoring`` and
+``group_left``/``group_right`` matching. Every sample read is counted in
+``Evaluator.samples`` so the cost of a query can be measured.
+
+Timestamps are in seconds.
+"""
+
+import math
+import re
+
+import attr
+
+import promql
+from tsdb import label_key
+
+
+DEFAULT_LOOKBACK = 300.0
+
+
+class EvalError(Exception):
+    """Raised when an expression cannot be evaluated."""
+
+
+@attr.s
+class RangeSeries(object):
+    labels = attr.ib()
+    timestamps = attr.ib()
+    values = attr.ib()
+
+
+def substitute(expr, variables):
+    """Replace Grafana variables in ``expr`` with values from ``variables``.
+
+    ``$name``, ``${name}`` and ``[[name]]`` forms are replaced; unknown
+    variables are left in place.
+    """
+    def replace(m):
+        name = m.group(1) or m.group(2) or m.group(3)
+        if name not in variables:
+            return m.group(0)
+        return str(variables[name])
+
+    return re.sub(r'\$\{(\w+)(?::\w+)?\}|\$(\w+)|\[\[(\w+)\]\]', replace, expr)
+
+
+def _drop_name(labels):
+    if '__name__' not in labels:
+        return labels
+    out = dict(labels)
+    del out['__name__']
+    return out
+
+
+def _is_vector(value):
+    return isinstance(value, list)
+
+
+def _extrapolated_rate(series, start, end, is_counter, is_rate):
+    """Port of Prometheus' ``extrapolatedRate``."""
+    ts, vs = series.timestamps, series.values
+    if len(vs) < 2:
+        return None
+    result = vs[-1] - vs[0]
+    if is_counter:
+        for prev, cur in zip(vs, vs[1:]):
+            if cur < prev:
+                result += prev
+    duration_to_start = ts[0] - start
+    duration_to_end = end - ts[-1]
+    sampled = ts[-1] - ts[0]
+    if sampled <= 0:
+        return None
+    average = sampled / (len(ts) - 1)
+    if is_counter and result > 0 and vs[0] >= 0:
+        duration_to_zero = sampled * (vs[0] / result)
+        if duration_to_zero < duration_to_start:
+            duration_to_start = duration_to_zero
+    threshold = average * 1.1
+    interval = sampled
+    interval += duration_to_start if duration_to_start < threshold else average / 2
+    interval += duration_to_end if duration_to_end < threshold else average / 2
+    result *= interval / sampled
+    if is_rate:
+        result /= end - start
+    return result
+
+
+def _linear_regression(ts, vs, intercept_time):
+    n = len(ts)
+    if n < 2:
+        return None, None
+    xs = [t - intercept_time for t in ts]
+    sum_x, sum_y = sum(xs), sum(vs)
+    sum_xy = sum(x * y for x, y in zip(xs, vs))
+    sum_x2 = sum(x * x for x in xs)
+    cov = sum_xy - sum_x * sum_y / n
+    var = sum_x2 - sum_x * sum_x / n
+    if var == 0:
+        return None, None
+    slope = cov / var
+    return slope, sum_y / n - slope * sum_x / n
+
+
+def _quantile(q, values):
+    if not values:
+        return float('nan')
+    if q < 0:
+        return float('-inf')
+    if q > 1:
+        return float('inf')
+    values = sorted(values)
+    rank = q * (len(values) - 1)
+    lower = int(math.floor(rank))
+    upper = min(lower + 1, len(values) - 1)
+    weight = rank - lower
+    return values[lower] * (1 - weight) + values[upper] * weight
+
+
+def _stdvar(values):
+    mean = sum(values) / len(values)
+    return sum((v - mean) ** 2 for v in values) / len(values)
+
+
+_OVER_TIME = {
+    'avg_over_time': lambda vs: sum(vs) / len(vs),
+    'min_over_time': min,
+    'max_over_time': max,
+    'sum_over_time': sum,
+    'count_over_time': len,
+    'last_over_time': lambda vs: vs[-1],
+    'stddev_over_time': lambda vs: math.sqrt(_stdvar(vs)),
+    'stdvar_over_time': _stdvar,
+}
+
+_MATH = {
+    'abs': abs, 'ceil': math.ceil, 'floor': math.floor, 'exp': math.exp,
+    'sqrt': lambda v: math.sqrt(v) if v >= 0 else float('nan'),
+    'ln': lambda v: math.log(v) if v > 0 else float('nan'),
+    'log2': lambda v: math.log2(v) if v > 0 else float('nan'),
+    'log10': lambda v: math.log10(v) if v > 0 else float('nan'),
+}
+
+_ARITHMETIC = {
+    '+': lambda a, b: a + b,
+    '-': lambda a, b: a - b,
+    '*': lambda a, b: a * b,
+    '/': lambda a, b: a / b if b else (math.copysign(float('inf'), a) if a else float('nan')),
+    '%': lambda a, b: math.fmod(a, b) if b else float('nan'),
+    '^': lambda a, b: a ** b,
+    'atan2': math.atan2,
+}
+_COMPARISON = {
+    '==': lambda a, b: a == b,
+    '!=': lambda a, b: a != b,
+    '>': lambda a, b: a > b,
+    '<': lambda a, b: a < b,
+    '>=': lambda a, b: a >= b,
+    '<=': lambda a, b: a <= b,
+}
+
+
+def _number(text):
+    lowered = text.lower()
+    if lowered in ('inf', '+inf'):
+        return float('inf')
+    if lowered == 'nan':
+        return float('nan')
+    if lowered.startswith('0x'):
+        return float(int(text, 16))
+    return float(text)
+
+
+class Evaluator(object):
+    """Evaluate parsed expressions at a point in time.
+
+    Instant vectors are lists of ``(labels, value)`` pairs; scalars are
+    floats.
+    """
+
+    def __init__(self, db, lookback=DEFAULT_LOOKBACK):
+        self.db = db
+        self.lookback = lookback
+        self.samples = 0
+        # Query range, for ``@ start()`` and ``@ end()``.
+        self.start = self.end = None
+        # Results of ``@`` nodes, which are the same at every step.
+        self.pinned = {}
+
+    def query(self, expr, t):
+        node = promql.parse(expr) if isinstance(expr, str) else expr
+        self.start = self.end = t
+        self.pinned = {}
+        return self.eval(node, t)
+
+    def query_range(self, expr, start, end, step):
+        """Evaluate ``expr`` at each step; return ``{label_key: [(t, v)]}``."""
+        node = promql.parse(expr) if isinstance(expr, str) else expr
+        self.start, self.end = start, end
+        self.pinned = {}
+        out = {}
+        t = start
+        while t <= end:
+            value = self.eval(node, t)
+            if _is_vector(value):
+                for labels, v in value:
+                    out.setdefault(label_key(labels), []).append((t, v))
+            elif isinstance(value, float):
+                out.setdefault((), []).append((t, value))
+            t += step
+        return out
+
+    def eval(self, node, t):
+        method = getattr(self, '_eval_' + type(node).__name__)
+        if getattr(node, 'at', None) is None:
+            return method(node, t)
+        # Like Prometheus, evaluate step-invariant nodes once per query.
+        if id(node) not in self.pinned:
+            self.pinned[id(node)] = method(node, t)
+        return self.pinned[id(node)]
+
+    def _eval_NumberLiteral(self, node, t):
+        return _number(node.value)
+
+    def _eval_StringLiteral(self, node, t):
+        return node.value
+
+    def _eval_Variable(self, node, t):
+        raise EvalError('unresolved variable ${}'.format(node.name))
+
+    def _eval_Paren(self, node, t):
+        return self.eval(node.expr, t)
+
+    def _eval_UnaryOp(self, node, t):
+        value = self.eval(node.expr, t)
+        if node.op == '+':
+            return value
+        if _is_vector(value):
+            return [(_drop_name(l), -v) for l, v in value]
+        return -value
+
+    def _at(self, node, t):
+        if node.at is None:
+            return t
+        if node.at == 'start()':
+            return self.start
+        if node.at == 'end()':
+            return self.end
+        return float(node.at)
+
+    def _offset(self, node, t):
+        t = self._at(node, t)
+        return t - promql.parse_duration(node.offset) if node.offset else t
+
+    def _duration(self, text):
+        if '$' in text:
+            raise EvalError('unresolved variable in duration {!r}'.format(text))
+        return promql.parse_duration(text)
+
+    def _eval_VectorSelector(self, node, t):
+        t = self._offset(node, t)
+        selected = self.db.select(node.metric, node.matchers)
+        if node.range is not None:
+            start = t - self._duration(node.range)
+            out = []
+            for series in selected:
+                lo, hi = series.window(start, t)
+                if hi > lo:
+                    self.samples += hi - lo
+                    out.append(RangeSeries(series.labels, series.timestamps[lo:hi],
+                                           series.values[lo:hi]))
+            return out
+        out = []
+        for series in selected:
+            lo, hi = series.window(t - self.lookback, t)
+            if hi > lo:
+                self.samples += 1
+                out.append((series.labels, series.values[hi - 1]))
+        return out
+
+    def _eval_Subquery(self, node, t):
+        t = self._at(node, t)
+        window = self._duration(node.range)
+        step = self._duration(node.step) if node.step else 60.0
+        start = t - window
+        ts = math.floor(start / step) * step
+        if ts <= start:
+            ts += step
+        grouped = {}
+        while ts <= t:
+            for labels, v in self.eval(node.expr, ts):
+                key = label_key(labels)
+                entry = grouped.setdefault(key, RangeSeries(labels, [], []))
+                entry.timestamps.append(ts)
+                entry.values.append(v)
+            ts += step
+        return list(grouped.values())
+
+    def _range_arg(self, node, t, index=0):
+        arg = node.args[index]
+        inner = promql.unwrap(arg)
+        if not (isinstance(inner, promql.Subquery)
+                or (isinstance(inner, promql.VectorSelector) and inner.range)):
+            raise EvalError('{}() expects a range vector'.format(node.func))
+        window = self._duration(inner.range)
+        if isinstance(inner, promql.VectorSelector):
+            offset_t = self._offset(inner, t)
+        else:
+            offset_t = self._at(inner, t)
+        return self.eval(inner, t), offset_t - window, offset_t
+
+    def _eval_Call(self, node, t):
+        func = node.func
+        if func in ('rate', 'increase', 'delta'):
+            series, start, end = self._range_arg(node, t)
+            out = []
+            for s in series:
+                v = _extrapolated_rate(s, start, end, func != 'delta', func == 'rate')
+                if v is not None:
+                    out.append((_drop_name(s.labels), v))
+            return out
+        if func in ('irate', 'idelta'):
+            series, _, _ = self._range_arg(node, t)
+            out = []
+            for s in series:
+                if len(s.values) < 2:
+                    continue
+                prev, last = s.values[-2], s.values[-1]
+                dt = s.timestamps[-1] - s.timestamps[-2]
+                diff = last - prev
+                if func == 'irate':
+                    if last < prev:
+                        diff = last
+                    diff /= dt
+                out.append((_drop_name(s.labels), diff))
+            return out
+        if func in _OVER_TIME:
+            series, _, _ = self._range_arg(node, t)
+            return [(_drop_name(s.labels), float(_OVER_TIME[func](list(s.values))))
+                    for s in series if len(s.values)]
+        if func == 'quantile_over_time':
+            q = self.eval(node.args[0], t)
+            series, _, _ = self._range_arg(node, t, 1)
+            return [(_drop_name(s.labels), _quantile(q, list(s.values)))
+                    for s in series if len(s.values)]
+        if func in ('deriv', 'predict_linear'):
+            series, _, _ = self._range_arg(node, t)
+            ahead = self.eval(node.args[1], t) if func == 'predict_linear' else 0
+            out = []
+            for s in series:
+                slope, intercept = _linear_regression(s.timestamps, s.values, t)
+                if slope is None:
+                    continue
+                v = slope if func == 'deriv' else slope * ahead + intercept
+                out.append((_drop_name(s.labels), v))
+            return out
+        if func in _MATH:
+            return [(_drop_name(l), float(_MATH[func](v)))
+                    for l, v in self.eval(node.args[0], t)]
+        if func in ('clamp_min', 'clamp_max', 'clamp'):
+            vector = self.eval(node.args[0], t)
+            bounds = [self.eval(a, t) for a in node.args[1:]]
+            lo = bounds[0] if func in ('clamp_min', 'clamp') else float('-inf')
+            hi = bounds[-1] if func in ('clamp_max', 'clamp') else float('inf')
+            return [(_drop_name(l), min(max(v, lo), hi)) for l, v in vector]
+        if func == 'scalar':
+            vector = self.eval(node.args[0], t)
+            return vector[0][1] if len(vector) == 1 else float('nan')
+        if func == 'vector':
+            return [({}, self.eval(node.args[0], t))]
+        if func == 'time':
+            return float(t)
+        if func == 'absent':
+            return [] if self.eval(node.args[0], t) else [({}, 1.0)]
+        if func in ('sort', 'sort_desc'):
+            vector = self.eval(node.args[0], t)
+            return sorted(vector, key=lambda s: s[1], reverse=func == 'sort_desc')
+        if func == 'histogram_quantile':
+            return self._histogram_quantile(self.eval(node.args[0], t),
+                                            self.eval(node.args[1], t))
+        raise EvalError('unsupported function {}()'.format(func))
+
+    def _histogram_quantile(self, q, vector):
+        buckets = {}
+        for labels, v in vector:
+            if 'le' not in labels:
+                continue
+            rest = dict((k, x) for k, x in labels.items() if k not in ('le', '__name__'))
+            buckets.setdefault(label_key(rest), (rest, []))[1].append(
+                (_number(labels['le']), v))
+        out = []
+        for rest, points in buckets.values():
+            points.sort()
+            total = points[-1][1]
+            if not total or points[-1][0] != float('inf'):
+                continue
+            rank = q * total
+            prev_bound, prev_count = 0.0, 0.0
+            for bound, count in points:
+                if count >= rank:
+                    if bound == float('inf'):
+                        value = prev_bound
+                    else:
+                        value = prev_bound + (bound - prev_bound) * (
+                            (rank - prev_count) / ((count - prev_count) or 1))
+                    out.append((rest, value))
+                    break
+                prev_bound, prev_count = bound, count
+        return out
+
+    def _eval_Aggregation(self, node, t):
+        vector = self.eval(node.expr, t)
+        param = self.eval(node.param, t) if node.param is not None else None
+        groups = {}
+        for labels, v in vector:
+            if node.grouping is None:
+                key_labels = {}
+            elif node.without:
+                key_labels = dict((k, x) for k, x in labels.items()
+                                  if k not in node.grouping and k != '__name__')
+            else:
+                key_labels = dict((k, labels[k]) for k in node.grouping if k in labels)
+            groups.setdefault(label_key(key_labels), (key_labels, []))[1].append((labels, v))
+
+        op = node.op
+        out = []
+        for key_labels, members in groups.values():
+            values = [v for _, v in members]
+            if op in ('topk', 'bottomk'):
+                ranked = sorted(members, key=lambda s: s[1], reverse=op == 'topk')
+                out.extend(ranked[:int(param)])
+                continue
+            if op == 'sum':
+                value = sum(values)
+            elif op == 'avg':
+                value = sum(values) / len(values)
+            elif op == 'min':
+                value = min(values)
+            elif op == 'max':
+                value = max(values)
+            elif op == 'count':
+                value = float(len(values))
+            elif op == 'group':
+                value = 1.0
+            elif op == 'stdvar':
+                value = _stdvar(values)
+            elif op == 'stddev':
+                value = math.sqrt(_stdvar(values))
+            elif op == 'quantile':
+                value = _quantile(param, values)
+            else:
+                raise EvalError('unsupported aggregation {}'.format(op))
+            out.append((key_labels, value))
+        return out
+
+    def _eval_BinaryOp(self, node, t):
+        lhs = self.eval(node.lhs, t)
+        rhs = self.eval(node.rhs, t)
+        op = node.op
+        if op in promql.SET_OPERATORS:
+            return self._set_operation(node, lhs, rhs)
+        if op in _ARITHMETIC:
+            fn, comparison = _ARITHMETIC[op], False
+        else:
+            fn, comparison = _COMPARISON[op], True
+
+        if not _is_vector(lhs) and not _is_vector(rhs):
+            result = fn(lhs, rhs)
+            return float(result) if comparison else result
+        if not _is_vector(rhs) or not _is_vector(lhs):
+            vector_on_left = _is_vector(lhs)
+            vector, scalar = (lhs, rhs) if vector_on_left else (rhs, lhs)
+            out = []
+            for labels, v in vector:
+                a, b = (v, scalar) if vector_on_left else (scalar, v)
+                result = fn(a, b)
+                if not comparison:
+                    out.append((_drop_name(labels), result))
+                elif node.return_bool:
+                    out.append((_drop_name(labels), float(result)))
+                elif result:
+                    out.append((labels, v))
+            return out
+        return self._vector_binop(node, lhs, rhs, fn, comparison)
+
+    def _signature(self, node, labels):
+        if node.matching == 'on':
+            return label_key(dict((k, labels[k]) for k in node.matching_labels if k in labels))
+        ignored = set(node.matching_labels if node.matching == 'ignoring' else ())
+        ignored.add('__name__')
+        return label_key(dict((k, v) for k, v in labels.items() if k not in ignored))
+
+    def _result_labels(self, node, many, one, comparison):
+        labels = dict(many)
+        if not comparison or node.return_bool:
+            labels.pop('__name__', None)
+        if node.group is None:
+            if node.matching == 'on':
+                labels = dict((k, v) for k, v in labels.items()
+                              if k in node.matching_labels)
+            else:
+                for k in node.matching_labels if node.matching == 'ignoring' else ():
+                    labels.pop(k, None)
+        else:
+            for k in node.group_labels:
+                if k in one:
+                    labels[k] = one[k]
+                else:
+                    labels.pop(k, None)
+        return labels
+
+    def _vector_binop(self, node, lhs, rhs, fn, comparison):
+        swap = node.group == 'group_right'
+        many, one = (rhs, lhs) if swap else (lhs, rhs)
+        ones = {}
+        for labels, v in one:
+            sig = self._signature(node, labels)
+            if sig in ones:
+                raise EvalError('many-to-many matching in {}'.format(node))
+            ones[sig] = (labels, v)
+        out = []
+        seen = set()
+        for labels, v in many:
+            sig = self._signature(node, labels)
+            match = ones.get(sig)
+            if match is None:
+                continue
+            if node.group is None:
+                if sig in seen:
+                    raise EvalError('multiple matches on the left side of {}'.format(node))
+                seen.add(sig)
+            a, b = (match[1], v) if swap else (v, match[1])
+            result = fn(a, b)
+            result_labels = self._result_labels(node, labels, match[0], comparison)
+            if not comparison:
+                out.append((result_labels, result))
+            elif node.return_bool:
+                out.append((result_labels, float(result)))
+            elif result:
+                out.append((result_labels, a))
+        return out
+
+    def _set_operation(self, node, lhs, rhs):
+        rhs_sigs = set(self._signature(node, l) for l, _ in rhs)
+        if node.op == 'and':
+            return [(l, v) for l, v in lhs if self._signature(node, l) in rhs_sigs]
+        if node.op == 'unless':
+            return [(l, v) for l, v in lhs if self._signature(node, l) not in rhs_sigs]
+        lhs_sigs = set(self._signature(node, l) for l, _ in lhs)
+        return lhs + [(l, v) for l, v in rhs if self._signature(node, l) not in lhs_sigs]
+
+
+def record(db, name, expr, start, end, step):
+    """Add ``expr`` evaluated every ``step`` to ``db`` as ``name``, like a recording rule."""
+    result = Evaluator(db).query_range(expr, start, end, step)
+    for key, points in sorted(result.items()):
+        series = db.series(dict(key, __name__=name))
+        for t, value in points:
+            series.append(t, value)
+    return db
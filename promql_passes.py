@@ -0,0 +1,117 @@
+"""Rewrite passes over parsed PromQL queries.
+
+Dashboard modules write their queries without the scope matchers and
+``scope_queries`` adds them to every target when the dashboard is built::
+
+    Target(expr='rate(mysql_global_status_slow_queries[5m])')
+    # -> rate(mysql_global_status_slow_queries{job=~"$job", instance=~"$instance",
+    #                                            environment=~"$environment"}[5m])
+
+The passes are:
+
+``inject_scope``
+    gives every vector selector a ``label=~"$label"`` matcher for each
+    scope variable of the dashboard, on both sides of binary operations
+    and inside subqueries, so no query reads the whole fleet. Selectors
+    that already match a scope label, with a variable or a fixed value,
+    keep their matcher.
+``normalize_ranges``
+    writes range windows in canonical form (``60s`` -> ``1m``) and widens
+    those under ``MIN_RANGE_SCRAPES`` scrape intervals, which may hold too
+    few samples for ``rate()``. Windows given as a variable are kept.
+"""
+
+import attr
+
+import promql
+from dashboard_utils import map_alert_targets, map_targets
+from resolution import DEFAULT_SCRAPE_INTERVAL
+
+
+# Template variables that scope a query to part of the fleet.
+SCOPE_VARIABLES = ('job', 'instance', 'environment')
+
+# Shortest range window, in scrape intervals.
+MIN_RANGE_SCRAPES = 4
+
+
+def scope_variables(dashboard):
+    """The scope variables defined in the dashboard's templating."""
+    names = set(t.name for t in dashboard.templating.list)
+    return [v for v in SCOPE_VARIABLES if v in names]
+
+
+def inject_scope(node, scope):
+    """Return ``node`` with every selector restricted to ``scope``.
+
+    Scope matchers come first, in ``scope`` order, followed by the
+    selector's other matchers.
+    """
+    def visit(n):
+        if not isinstance(n, promql.VectorSelector):
+            return n
+        matchers = [n.matcher(label) or promql.Matcher(label, '=~', '$' + label)
+                    for label in scope]
+        matchers.extend(m for m in n.matchers if m.label not in scope)
+        return attr.evolve(n, matchers=matchers)
+    return promql.transform(node, visit)
+
+
+def _normalize_range(window, min_seconds):
+    if window is None or '$' in window:
+        return window
+    return promql.format_duration(max(promql.parse_duration(window), min_seconds))
+
+
+def normalize_ranges(node, scrape_interval=DEFAULT_SCRAPE_INTERVAL):
+    """Return ``node`` with canonical range windows of at least
+    ``MIN_RANGE_SCRAPES`` scrape intervals."""
+    min_seconds = MIN_RANGE_SCRAPES * promql.parse_duration(scrape_interval)
+
+    def visit(n):
+        if isinstance(n, promql.VectorSelector) and n.range is not None:
+            return attr.evolve(n, range=_normalize_range(n.range, min_seconds))
+        if isinstance(n, promql.Subquery):
+            return attr.evolve(n, range=_normalize_range(n.range, min_seconds))
+        return n
+    return promql.transform(node, visit)
+
+
+def optimize(expr, scope=(), scrape_interval=DEFAULT_SCRAPE_INTERVAL):
+    """Run the passes over ``expr``; return the rewritten query.
+
+    Queries that do not parse are returned unchanged; ``lint.py`` reports
+    them.
+    """
+    try:
+        node = promql.parse(expr)
+    except promql.PromQLError:
+        return expr
+    return str(normalize_ranges(inject_scope(node, scope), scrape_interval))
+
+
+def _optimize_target(scope, scrape_interval):
+    def fn(target):
+        if not getattr(target, 'expr', ''):
+            return target
+        return attr.evolve(target, expr=optimize(target.expr, scope, scrape_interval))
+    return fn
+
+
+def scope_queries(dashboard, scope=None, scrape_interval=DEFAULT_SCRAPE_INTERVAL):
+    """Return a copy of ``dashboard`` with the passes run over every query.
+
+    ``scope`` defaults to the dashboard's scope variables.
+    """
+    if scope is None:
+        scope = scope_variables(dashboard)
+    return map_targets(dashboard, _optimize_target(scope, scrape_interval))
+
+
+def scope_alerts(alerts, dashboard, scrape_interval=DEFAULT_SCRAPE_INTERVAL):
+    """Return copies of ``alerts`` with the passes run over their queries.
+
+    For alerts without a panel, scoped like the queries of ``dashboard``.
+    """
+    fn = _optimize_target(scope_variables(dashboard), scrape_interval)
+    return [map_alert_targets(a, fn) for a in alerts]
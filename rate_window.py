@@ -0,0 +1,126 @@
+"""Rate windows shared by the dashboards.
+
+Panels compute rates over Grafana's ``$__rate_interval``::
+
+    rate(redis_commands_processed_total[$__rate_interval])
+
+Grafana sets it to ``max($__interval + min interval, 4 * min interval)``,
+so windows follow the zoom level and never hold fewer than four scrapes.
+The min interval is the panel's ``interval``, which ``apply_rate_windows``
+sets to the ``min_interval`` variable. The variable defaults to the
+policy's min interval, by default the scrape interval. Picking a larger
+value in the dashboard widens every window, which replaces the old
+``rate_interval`` choice.
+
+Legacy alerts and exported alert rules cannot follow a zoom level.
+Queries that alerts evaluate get fixed windows of ``alert_window``, at
+least four min intervals.
+"""
+
+import attr
+from grafanalib.core import Template
+
+import promql
+from dashboard_utils import copy_extras, map_alert_targets, rewrite_panel_queries
+from resolution import DEFAULT_SCRAPE_INTERVAL
+
+
+MIN_INTERVAL_VARIABLE = 'min_interval'
+# Larger min intervals offered by the variable.
+MIN_INTERVAL_OPTIONS = ('1m', '5m', '10m', '30m', '1h')
+ALERT_WINDOW = '5m'
+
+# Fewest scrape intervals in a window, as in ``$__rate_interval``.
+MIN_WINDOW_SCRAPES = 4
+
+
+@attr.s
+class RateWindowPolicy(object):
+    """Rate windows of a dashboard.
+
+    :param scrape_interval: Prometheus scrape interval of the exporters
+    :param min_interval: smallest query interval (default: the scrape
+        interval)
+    :param alert_window: window of the queries alerts evaluate
+    """
+
+    scrape_interval = attr.ib(default=DEFAULT_SCRAPE_INTERVAL)
+    min_interval = attr.ib(default=None)
+    alert_window = attr.ib(default=ALERT_WINDOW)
+
+    def interval(self):
+        """The min interval; never below the scrape interval."""
+        return promql.format_duration(max(
+            promql.parse_duration(self.min_interval or self.scrape_interval),
+            promql.parse_duration(self.scrape_interval)))
+
+    def alert_range(self):
+        """``alert_window``, widened to hold ``MIN_WINDOW_SCRAPES`` intervals."""
+        return promql.format_duration(max(
+            promql.parse_duration(self.alert_window),
+            MIN_WINDOW_SCRAPES * promql.parse_duration(self.interval())))
+
+
+def min_interval_variable(policy=None):
+    """The ``min_interval`` variable, defaulting to the policy's min interval."""
+    policy = policy or RateWindowPolicy()
+    default = policy.interval()
+    larger = [o for o in MIN_INTERVAL_OPTIONS
+              if promql.parse_duration(o) > promql.parse_duration(default)]
+    return Template(
+        name=MIN_INTERVAL_VARIABLE,
+        label='Min Interval',
+        dataSource=None,
+        query=','.join([default] + larger),
+        type='interval',
+        default=default,
+    )
+
+
+def fixed_windows(expr, window):
+    """``expr`` with every window given by a variable set to ``window``.
+
+    Queries that do not parse are returned unchanged.
+    """
+    try:
+        node = promql.parse(expr)
+    except promql.PromQLError:
+        return expr
+
+    def visit(n):
+        if isinstance(n, (promql.VectorSelector, promql.Subquery)) and '$' in (n.range or ''):
+            return attr.evolve(n, range=window)
+        return n
+    return str(promql.transform(node, visit))
+
+
+def apply_rate_windows(dashboard, policy=None):
+    """Return a copy of ``dashboard`` following ``policy``.
+
+    Panels take their min interval from the ``min_interval`` variable if
+    the dashboard has one, and from ``policy`` otherwise. Queries alerts
+    evaluate get fixed windows; panels keep showing the zoom-following
+    query.
+    """
+    policy = policy or RateWindowPolicy()
+    names = set(t.name for t in dashboard.templating.list)
+    interval = ('$' + MIN_INTERVAL_VARIABLE if MIN_INTERVAL_VARIABLE in names
+                else policy.interval())
+    window = policy.alert_range()
+
+    def fix(expr):
+        return fixed_windows(expr, window)
+
+    def fix_target(target):
+        return attr.evolve(target, expr=fix(target.expr)) if target.expr else target
+
+    def map_panel(panel):
+        if not getattr(panel, 'targets', None):
+            return panel
+        panel = rewrite_panel_queries(panel, lambda expr: expr, alert_fn=fix)
+        changes = {'interval': panel.interval or interval}
+        if getattr(panel, 'alert', None) is not None:
+            changes['alert'] = map_alert_targets(panel.alert, fix_target)
+        return attr.evolve(panel, **changes)
+
+    return copy_extras(dashboard, dashboard._map_panels(map_panel))
@@ -0,0 +1,344 @@
+#!/usr/bin/env python
+"""Generate Prometheus recording rules from costly dashboard expressions.
+
+Joins, ratios and ``rate()``-style calls in panel and alert targets are
+moved into recording rules. The dashboard variables used by those
+expressions are lifted out: the rule is computed for every series and the
+panel reads the recorded series with the same matchers, e.g.::
+
+    rate(system_io_read_bytes{job=~"$job", instance=~"$instance"}[$__rate_interval])
+
+becomes the rule ``instance:system_io_read_bytes:rate5m`` and the panel
+query ``instance:system_io_read_bytes:rate5m{job=~"$job", instance=~"$instance"}``.
+
+Dashboard modules may name rules themselves in ``create_*_recording_rules``
+functions returning ``{name: expr}``; panels computing those expressions
+read them under that name.
+
+Dashboards in long-range mode (see ``long_range.py``) read hourly series
+downsampled from recorded expressions. Their rules go in a separate
+``<group>:downsampled`` group evaluated every ``DOWNSAMPLE_INTERVAL``.
+
+Usage::
+
+    python recording_rules.py -o recording_rules.yml --dashboards-dir out/
+"""
+
+import argparse
+import collections
+import hashlib
+import os
+import re
+import sys
+
+import attr
+import yaml
+from grafanalib._gen import write_dashboard
+
+import promql
+from dashboard_utils import (
+    dashboard_name, find_dashboards, load_module, map_targets,
+)
+
+
+# Recording rules cannot follow dashboard variables, so ranges such as
+# ``[$__rate_interval]`` are recorded at a fixed window.
+DEFAULT_WINDOW = '5m'
+RULE_LEVEL = 'instance'
+RATE_FUNCTIONS = {'rate', 'irate', 'increase'}
+# Linear regressions over long windows, as used by capacity forecasts.
+REGRESSION_FUNCTIONS = {'deriv', 'predict_linear', 'holt_winters'}
+# Evaluation interval of the downsampled series; under the 5m lookback of
+# instant selectors, so queries at any step find a recent sample.
+DOWNSAMPLE_INTERVAL = '5m'
+
+_OP_WORDS = {
+    '/': 'per', '*': 'times', '+': 'plus', '-': 'minus', '%': 'mod',
+    '^': 'pow', 'atan2': 'atan2',
+}
+
+
+def _sanitize(text):
+    return re.sub(r'[^a-zA-Z0-9_]+', '_', text).strip('_')
+
+
+def is_costly(node):
+    """Whether ``node`` is a join, ratio, counter-rate or regression expression."""
+    node = promql.unwrap(node)
+    if isinstance(node, promql.Call):
+        return node.func in RATE_FUNCTIONS or node.func in REGRESSION_FUNCTIONS
+    if isinstance(node, promql.BinaryOp):
+        return (node.op in promql.ARITHMETIC_OPERATORS
+                and not promql.is_scalar(node.lhs)
+                and not promql.is_scalar(node.rhs))
+    return False
+
+
+def _describe(node):
+    """Return ``(metric, operations)`` naming parts for ``node``."""
+    node = promql.unwrap(node)
+    if isinstance(node, promql.VectorSelector):
+        parts = [node.metric or 'series']
+        parts.extend(_sanitize(m.value) for m in node.matchers
+                     if m.label != '__name__' and m.value)
+        return '_'.join(parts), []
+    if isinstance(node, promql.UnaryOp):
+        return _describe(node.expr)
+    if isinstance(node, promql.Call):
+        vectors = [a for a in node.args if not promql.is_scalar(a)
+                   and not isinstance(a, promql.StringLiteral)]
+        metric, ops = _describe(vectors[0]) if vectors else (node.func, [])
+        arg = promql.unwrap(vectors[0]) if vectors else None
+        window = getattr(arg, 'range', None)
+        op = node.func + (_sanitize(window) if window else '')
+        return metric, ops + [op]
+    if isinstance(node, promql.Aggregation):
+        metric, ops = _describe(node.expr)
+        return metric, ops + [node.op]
+    if isinstance(node, promql.Subquery):
+        return _describe(node.expr)
+    if isinstance(node, promql.BinaryOp):
+        if promql.is_scalar(node.rhs):
+            return _describe(node.lhs)
+        if promql.is_scalar(node.lhs):
+            return _describe(node.rhs)
+        lhs, lhs_ops = _describe(node.lhs)
+        rhs, rhs_ops = _describe(node.rhs)
+        metric = '{}_{}_{}'.format(lhs, _OP_WORDS.get(node.op, _sanitize(node.op)), rhs)
+        return metric, lhs_ops + [o for o in rhs_ops if o not in lhs_ops]
+    return _sanitize(str(node)), []
+
+
+def rule_name(node):
+    """Build a ``level:metric:operations`` name for a recorded expression."""
+    metric, ops = _describe(node)
+    top = promql.unwrap(node)
+    if isinstance(top, promql.BinaryOp) and not (
+            promql.is_scalar(top.lhs) or promql.is_scalar(top.rhs)):
+        if top.op == '/':
+            ops = ops + ['ratio']
+        elif top.op == '*' or top.matching or not ops:
+            # Plain series combined by +/- still need an operation.
+            ops = ops + ['join']
+    return '{}:{}:{}'.format(RULE_LEVEL, metric, '_'.join(ops))
+
+
+def generalize(node):
+    """Strip dashboard variables from ``node``.
+
+    Returns ``(expr, scope)`` where ``scope`` holds the variable matchers
+    removed from the selectors, or ``None`` if the variables cannot be
+    lifted out of the expression.
+    """
+    scope = collections.OrderedDict()
+    conflict = []
+
+    def strip(n):
+        if isinstance(n, promql.VectorSelector):
+            kept = []
+            for m in n.matchers:
+                if not m.uses_variable():
+                    kept.append(m)
+                elif scope.setdefault(m.label, m) != m:
+                    conflict.append(m)
+            window = n.range
+            if window is not None and '$' in window:
+                window = DEFAULT_WINDOW
+            return attr.evolve(n, matchers=kept, range=window)
+        if isinstance(n, promql.Subquery) and '$' in n.range:
+            return attr.evolve(n, range=DEFAULT_WINDOW)
+        return n
+
+    def keep_labels(n):
+        # One-to-one matching with on()/ignoring() drops the labels outside
+        # the match from the result. group_left keeps the left-hand labels
+        # so the lifted matchers still apply to the recorded series.
+        if (isinstance(n, promql.BinaryOp) and n.matching and not n.group
+                and n.op not in promql.SET_OPERATORS):
+            matched = set(n.matching_labels)
+            dropped = [l for l in scope if (l in matched) != (n.matching == 'on')]
+            if dropped:
+                return attr.evolve(n, group='group_left')
+        return n
+
+    expr = promql.transform(promql.transform(node, strip), keep_labels)
+    if conflict:
+        return None, None
+    for n in promql.walk(expr):
+        if isinstance(n, promql.Variable):
+            return None, None
+        if isinstance(n, promql.Aggregation):
+            kept = set(n.grouping or ())
+            for label in scope:
+                if (label in kept) == n.without:
+                    return None, None
+    return expr, list(scope.values())
+
+
+@attr.s
+class RuleSet(object):
+    """Recording rules collected from one or more dashboards.
+
+    Rules are grouped per dashboard; a rule shared by several dashboards
+    lives in the group of the first one that uses it. ``group_intervals``
+    overrides ``interval`` for single groups.
+    """
+
+    groups = attr.ib(default=attr.Factory(collections.OrderedDict))
+    interval = attr.ib(default=None)
+    group_intervals = attr.ib(default=attr.Factory(dict))
+
+    def names(self):
+        return dict((expr, name) for rules in self.groups.values()
+                    for name, expr in rules.items())
+
+    def add(self, name, expr, group):
+        """Record ``expr`` as ``name``, unless it is already recorded."""
+        text = str(promql.parse(expr))
+        if text not in self.names():
+            self.groups.setdefault(group, collections.OrderedDict())[name] = text
+
+    def record(self, expr, group):
+        """Return the rule name recording ``expr``, adding it if needed."""
+        text = str(expr)
+        known = self.names()
+        if text in known:
+            return known[text]
+        name = rule_name(expr)
+        taken = set(known.values())
+        if name in taken:
+            name += '_' + hashlib.sha1(text.encode('utf-8')).hexdigest()[:8]
+        self.groups.setdefault(group, collections.OrderedDict())[name] = text
+        return name
+
+    def to_yaml_data(self):
+        groups = []
+        for group, rules in self.groups.items():
+            data = collections.OrderedDict([('name', group)])
+            interval = self.group_intervals.get(group, self.interval)
+            if interval:
+                data['interval'] = interval
+            data['rules'] = [
+                collections.OrderedDict([('record', name), ('expr', expr)])
+                for name, expr in rules.items()
+            ]
+            groups.append(data)
+        return {'groups': groups}
+
+
+def _represent_ordered_dict(dumper, data):
+    return dumper.represent_dict(data.items())
+
+
+class _Dumper(yaml.SafeDumper):
+    pass
+
+
+_Dumper.add_representer(collections.OrderedDict, _represent_ordered_dict)
+
+
+def dump_yaml(data, stream):
+    """Write a Prometheus rules file, keeping the key order of ``data``."""
+    yaml.dump(data, stream, Dumper=_Dumper,
+              default_flow_style=False, sort_keys=False, width=1000)
+
+
+def write_rules(rules, stream):
+    dump_yaml(rules.to_yaml_data(), stream)
+
+
+def module_recording_rules(module):
+    """Return the ``{name: expr}`` rules of the module's ``create_*_recording_rules``."""
+    rules = collections.OrderedDict()
+    for name in sorted(dir(module)):
+        fn = getattr(module, name)
+        if name.startswith('create_') and name.endswith('_recording_rules') and callable(fn):
+            rules.update(fn())
+    return rules
+
+
+def add_downsampled_rules(rules, dashboard, group):
+    """Add the rules behind the downsampled series ``dashboard`` reads.
+
+    ``dashboard.downsampled`` maps each series to ``(expr, template)``:
+    ``expr`` is recorded as usual and ``template`` downsamples the
+    recorded series, e.g. ``avg_over_time({}[1h])``.
+    """
+    downsampled = getattr(dashboard, 'downsampled', None) or {}
+    if downsampled:
+        rules.group_intervals[group + ':downsampled'] = DOWNSAMPLE_INTERVAL
+    for name, (expr, template) in downsampled.items():
+        base = rules.record(promql.parse(expr), group)
+        rules.add(name, template.format(base), group + ':downsampled')
+
+
+def rewrite_expr(expr, rules, group):
+    """Replace costly parts of ``expr`` with recorded series."""
+    def replace(node):
+        if not is_costly(node):
+            return None
+        general, scope = generalize(promql.unwrap(node))
+        if general is None:
+            return None
+        return promql.VectorSelector(
+            metric=rules.record(general, group), matchers=scope)
+
+    return str(promql.rewrite(promql.parse(expr), replace))
+
+
+def rewrite_dashboard(dashboard, rules, group):
+    """Return a copy of ``dashboard`` reading recorded series.
+
+    Rules for the replaced expressions are added to ``rules`` under
+    ``group``.
+    """
+    def rewrite_target(target):
+        if not target.expr:
+            return target
+        expr = rewrite_expr(target.expr, rules, group)
+        return attr.evolve(target, expr=expr) if expr != target.expr else target
+
+    return map_targets(dashboard, rewrite_target)
+
+
+def main(args):
+    parser = argparse.ArgumentParser(prog='recording_rules')
+    parser.add_argument(
+        'dashboards', metavar='DASHBOARD', nargs='*',
+        help='Dashboard definitions (default: every *.dashboard.py)',
+    )
+    parser.add_argument(
+        '--output', '-o', help='Where to write the rules (default: stdout)',
+    )
+    parser.add_argument(
+        '--dashboards-dir',
+        help='Also write the rewritten dashboards as JSON into this directory',
+    )
+    parser.add_argument(
+        '--interval', help='Evaluation interval for the rule groups',
+    )
+    opts = parser.parse_args(args)
+
+    rules = RuleSet(interval=opts.interval)
+    for path in opts.dashboards or find_dashboards():
+        name = dashboard_name(path)
+        module = load_module(path)
+        for rule, expr in module_recording_rules(module).items():
+            rules.add(rule, expr, 'dashboards:' + name)
+        add_downsampled_rules(rules, module.dashboard, 'dashboards:' + name)
+        dashboard = rewrite_dashboard(module.dashboard, rules, 'dashboards:' + name)
+        if opts.dashboards_dir:
+            os.makedirs(opts.dashboards_dir, exist_ok=True)
+            with open(os.path.join(opts.dashboards_dir, name + '.json'), 'w') as out:
+                write_dashboard(dashboard, out)
+
+    if opts.output:
+        with open(opts.output, 'w') as out:
+            write_rules(rules, out)
+    else:
+        write_rules(rules, sys.stdout)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -2,15 +2,89 @@
 """Redis dashboard and alerts."""
 
 from grafanalib.core import (
-    Alert, AlertCondition, Dashboard, Graph, GridPos, Target, TimeRange,
-    YAxes, YAxis, MILLISECONDS_FORMAT, BYTES_FORMAT, SHORT_FORMAT,
-    GreaterThan, EVAL_LT, OP_AND, RTYPE_MAX, single_y_axis,
+    Alert, AlertCondition, BarGauge, Dashboard, Graph, GridPos, Target, TimeRange,
+    YAxes, YAxis, BYTES_FORMAT, OPS_FORMAT, SECONDS_FORMAT, SHORT_FORMAT,
+    GreaterThan, LowerThan, EVAL_LT, OP_AND, RTYPE_MAX, single_y_axis,
     Template, Templating
 )
 
+from alert_tests import AlertTest
+from capacity import forecast_table, growth_rate, seconds_until_full
+from dashboard_utils import apply_passes
+from fleet_view import fleet_panels
+from layout import Section, layout
+from rate_window import RateWindowPolicy, min_interval_variable
+from registry import lazy_dashboard, register
+from variables import query_variable
 
-def create_redis_alerts():
-    """Create Redis alerts."""
+
+# Alert thresholds; fleet manifests may override them per cluster.
+MEMORY_THRESHOLD = 90
+MAX_CLIENTS = 5000
+# Mean latency of a command, in seconds.
+LATENCY_THRESHOLD = 0.01
+
+# Alert when maxmemory is reached within this many seconds at the current
+# growth.
+MAXMEMORY_HORIZON = 4 * 3600
+
+# Forecasts recorded by create_redis_recording_rules; panels and alerts
+# read these instead of running the regressions.
+MEMORY_GROWTH = 'instance:redis_memory_used_bytes:deriv6h'
+MAXMEMORY_ETA = 'instance:redis_memory_used_bytes:seconds_until_maxmemory6h'
+
+# Commands shown in the per-command latency panels.
+TOP_COMMANDS = 10
+
+# Metrics the dashboard queries, see registry.py.
+METRICS = [
+    'redis_blocked_clients',
+    'redis_commands_duration_seconds_total',
+    'redis_commands_latencies_usec_bucket',
+    'redis_commands_processed_total',
+    'redis_commands_total',
+    'redis_connected_clients',
+    'redis_last_slow_execution_duration_seconds',
+    'redis_latency_spike_duration_seconds',
+    'redis_mem_fragmentation_ratio',
+    'redis_memory_max_bytes',
+    'redis_memory_used_bytes',
+    'redis_net_input_bytes_total',
+    'redis_net_output_bytes_total',
+    'redis_slowlog_last_id',
+    'redis_total_error_replies',
+]
+
+
+def command_latency(by='cmd', window='$__rate_interval'):
+    """Mean command latency in seconds: time spent over calls, per ``by`` labels."""
+    return ('sum by ({by}) (rate(redis_commands_duration_seconds_total[{w}]))'
+            ' / sum by ({by}) (rate(redis_commands_total[{w}]))').format(by=by, w=window)
+
+
+# Rate windows and min interval of the panels; see rate_window.py.
+RATE_WINDOWS = RateWindowPolicy()
+
+# Series per instance, used to size the selection; see fleet_view.py.
+INSTANCE_METRIC = 'redis_up'
+
+# Key metrics compared across instances in the Fleet row and shard index.
+FLEET_SUMMARY = [
+    ("Used Memory", 'redis_memory_used_bytes', BYTES_FORMAT),
+    ("Connected Clients", 'redis_connected_clients', SHORT_FORMAT),
+    ("Commands", 'rate(redis_commands_processed_total[$__rate_interval])', OPS_FORMAT),
+    ("Mean Command Latency", command_latency('job, instance'), SECONDS_FORMAT),
+]
+
+
+def create_redis_alerts(memory_threshold=MEMORY_THRESHOLD, max_clients=MAX_CLIENTS,
+                        latency_threshold=LATENCY_THRESHOLD):
+    """Create Redis alerts.
+
+    :param memory_threshold: used memory, in percent of maxmemory
+    :param max_clients: connected clients
+    :param latency_threshold: mean latency of a command, in seconds
+    """
     return [
         # Memory alerts
         Alert(
@@ -19,12 +93,12 @@ def create_redis_alerts():
             alertConditions=[
                 AlertCondition(
                     Target(
-                        expr='redis_memory_used_bytes{instance=~"$instance"} / redis_memory_max_bytes{instance=~"$instance"} * 100 > 90',
+                        expr='redis_memory_used_bytes / redis_memory_max_bytes * 100 > {:g}'.format(memory_threshold),
                         refId='A',
                         datasource="${datasource}",
                     ),
                     timeRange=TimeRange("5m", "now"),
-                    evaluator=GreaterThan(90),
+                    evaluator=GreaterThan(memory_threshold),
                     operator=OP_AND,
                     reducerType=RTYPE_MAX,
                 ),
@@ -39,7 +113,7 @@ def create_redis_alerts():
             alertConditions=[
                 AlertCondition(
                     Target(
-                        expr='redis_mem_fragmentation_ratio{instance=~"$instance"} > 2',
+                        expr='redis_mem_fragmentation_ratio > 2',
                         refId='A',
                         datasource="${datasource}",
                     ),
@@ -53,6 +127,28 @@ def create_redis_alerts():
             frequency='1m',
             handler=1,
         ),
+        Alert(
+            name="Redis Maxmemory Exhaustion Forecast",
+            message="Redis {{ $labels.instance }} will reach maxmemory within 4 hours "
+                    "at its current growth",
+            alertConditions=[
+                AlertCondition(
+                    Target(
+                        expr='{} > 0 < {}'.format(MAXMEMORY_ETA, MAXMEMORY_HORIZON),
+                        refId='A',
+                        datasource="${datasource}",
+                    ),
+                    timeRange=TimeRange("15m", "now"),
+                    evaluator=LowerThan(MAXMEMORY_HORIZON),
+                    operator=OP_AND,
+                    reducerType=RTYPE_MAX,
+                ),
+            ],
+            executionErrorState='alerting',
+            frequency='5m',
+            gracePeriod='15m',
+            handler=1,
+        ),
         # Client alerts
         Alert(
             name="Redis Too Many Clients",
@@ -60,12 +156,12 @@ def create_redis_alerts():
             alertConditions=[
                 AlertCondition(
                     Target(
-                        expr='redis_connected_clients{instance=~"$instance"} > 5000',
+                        expr='redis_connected_clients > {:g}'.format(max_clients),
                         refId='A',
                         datasource="${datasource}",
                     ),
                     timeRange=TimeRange("5m", "now"),
-                    evaluator=GreaterThan(5000),
+                    evaluator=GreaterThan(max_clients),
                     operator=OP_AND,
                     reducerType=RTYPE_MAX,
                 ),
@@ -77,16 +173,16 @@ def create_redis_alerts():
         # Latency alerts
         Alert(
             name="Redis High Command Latency",
-            message="Redis command latency is high",
+            message="Redis command {{ $labels.cmd }} is slow on {{ $labels.instance }}",
             alertConditions=[
                 AlertCondition(
                     Target(
-                        expr='rate(redis_commands_duration_seconds_total{instance=~"$instance"}[$rate_interval]) > 0.1',
+                        expr='{} > {:g}'.format(command_latency('instance, cmd'), latency_threshold),
                         refId='A',
                         datasource="${datasource}",
                     ),
                     timeRange=TimeRange("5m", "now"),
-                    evaluator=GreaterThan(0.1),
+                    evaluator=GreaterThan(latency_threshold),
                     operator=OP_AND,
                     reducerType=RTYPE_MAX,
                 ),
@@ -102,7 +198,7 @@ def create_redis_alerts():
             alertConditions=[
                 AlertCondition(
                     Target(
-                        expr='increase(redis_total_error_replies{instance=~"$instance"}[$rate_interval]) > 100',
+                        expr='increase(redis_total_error_replies[$__rate_interval]) > 100',
                         refId='A',
                         datasource="${datasource}",
                     ),
@@ -118,9 +214,208 @@ def create_redis_alerts():
         ),
     ]
 
-def create_redis_dashboard():
-    """Create a Redis monitoring dashboard."""
-    return Dashboard(
+
+def create_redis_alert_tests():
+    """Offline tests for the Redis alerts, see alert_tests.py."""
+    return [
+        AlertTest(
+            alert="Redis High Memory Usage",
+            series={
+                'redis_memory_used_bytes{instance="redis-1:9121"}': '950x10',
+                'redis_memory_max_bytes{instance="redis-1:9121"}': '1000x10',
+                'redis_memory_used_bytes{instance="redis-2:9121"}': '500x10',
+                'redis_memory_max_bytes{instance="redis-2:9121"}': '1000x10',
+            },
+            firing=[
+                ('4m', []),
+                ('5m', [{'instance': 'redis-1:9121'}]),
+            ],
+        ),
+        AlertTest(
+            alert="Redis Maxmemory Exhaustion Forecast",
+            interval='5m',
+            series={
+                # redis-1 grows 50MB per 5m towards 8GB; redis-2 has no limit.
+                'redis_memory_used_bytes{instance="redis-1:9121"}': '2e9+5e7x100',
+                'redis_memory_max_bytes{instance="redis-1:9121"}': '8e9x100',
+                'redis_memory_used_bytes{instance="redis-2:9121"}': '2e9+5e7x100',
+                'redis_memory_max_bytes{instance="redis-2:9121"}': '0x100',
+            },
+            firing=[
+                ('4h', []),
+                ('7h', [{'instance': 'redis-1:9121'}]),
+            ],
+        ),
+        AlertTest(
+            alert="Redis High Command Latency",
+            series={
+                # get: 10 calls/s at 1ms; keys: 1 call/s at 50ms.
+                'redis_commands_total{instance="redis-1:9121", cmd="get"}': '0+600x20',
+                'redis_commands_duration_seconds_total{instance="redis-1:9121", cmd="get"}': '0+0.6x20',
+                'redis_commands_total{instance="redis-1:9121", cmd="keys"}': '0+60x20',
+                'redis_commands_duration_seconds_total{instance="redis-1:9121", cmd="keys"}': '0+3x20',
+            },
+            firing=[
+                ('10m', [{'instance': 'redis-1:9121', 'cmd': 'keys'}]),
+            ],
+        ),
+        AlertTest(
+            alert="Redis High Error Rate",
+            series={
+                # 150 errors per 5m, then a counter reset on restart.
+                'redis_total_error_replies{instance="redis-1:9121"}': '0+30x15 0+30x15',
+            },
+            firing=[
+                ('3m', []),
+                ('15m', [{'instance': 'redis-1:9121'}]),
+                ('25m', [{'instance': 'redis-1:9121'}]),
+            ],
+        ),
+    ]
+
+
+def create_redis_recording_rules():
+    """The maxmemory forecast, recorded so the panels load fast; see capacity.py."""
+    return {
+        MEMORY_GROWTH: growth_rate('redis_memory_used_bytes'),
+        # Used memory against maxmemory; instances without a limit are left out.
+        MAXMEMORY_ETA: seconds_until_full('redis_memory_used_bytes',
+                                          '(redis_memory_max_bytes > 0)'),
+    }
+
+
+def create_command_latency_panels():
+    """Per-command latency, call volume and the latency monitor and slow log.
+
+    The p99, latency monitor and slow log panels stay empty unless the
+    exporter exports them (Redis 7 or later, ``latency-monitor-threshold``
+    set, ``--include-slowlog``).
+    """
+    top = 'topk({}, {{}})'.format(TOP_COMMANDS)
+    return [
+        Graph(
+            title="Latency by Command",
+            description="Mean latency of the {} slowest commands".format(TOP_COMMANDS),
+            dataSource="${datasource}",
+            targets=[
+                Target(
+                    expr=top.format(command_latency()),
+                    legendFormat='{{cmd}}',
+                    refId='A',
+                ),
+            ],
+            yAxes=single_y_axis(format=SECONDS_FORMAT),
+            gridPos=GridPos(h=8, w=12, x=0, y=33),
+        ),
+        Graph(
+            title="p99 Latency by Command",
+            description="From the per-command latency histograms of Redis 7 and later",
+            dataSource="${datasource}",
+            targets=[
+                Target(
+                    expr=top.format(
+                        'histogram_quantile(0.99, sum by (cmd, le) '
+                        '(rate(redis_commands_latencies_usec_bucket[$__rate_interval]))) / 1e6'),
+                    legendFormat='{{cmd}}',
+                    refId='A',
+                ),
+            ],
+            yAxes=single_y_axis(format=SECONDS_FORMAT),
+            gridPos=GridPos(h=8, w=12, x=12, y=33),
+        ),
+        BarGauge(
+            title="Slowest Commands",
+            description="Mean latency over the dashboard's time range",
+            dataSource="${datasource}",
+            targets=[
+                Target(
+                    expr=top.format(command_latency(window='$__range')),
+                    legendFormat='{{cmd}}',
+                    instant=True,
+                    refId='A',
+                ),
+            ],
+            format=SECONDS_FORMAT,
+            orientation='horizontal',
+            gridPos=GridPos(h=8, w=12, x=0, y=41),
+        ),
+        Graph(
+            title="Calls by Command",
+            dataSource="${datasource}",
+            targets=[
+                Target(
+                    expr=top.format(
+                        'sum by (cmd) (rate(redis_commands_total[$__rate_interval]))'),
+                    legendFormat='{{cmd}}',
+                    refId='A',
+                ),
+            ],
+            yAxes=single_y_axis(format=OPS_FORMAT),
+            gridPos=GridPos(h=8, w=12, x=12, y=41),
+        ),
+        Graph(
+            title="Time Spent by Command",
+            description="Seconds per second spent running each command: "
+                        "latency times call volume",
+            dataSource="${datasource}",
+            targets=[
+                Target(
+                    expr=top.format('sum by (cmd) '
+                                    '(rate(redis_commands_duration_seconds_total[$__rate_interval]))'),
+                    legendFormat='{{cmd}}',
+                    refId='A',
+                ),
+            ],
+            yAxes=single_y_axis(format=SHORT_FORMAT),
+            gridPos=GridPos(h=8, w=12, x=0, y=49),
+        ),
+        Graph(
+            title="Latency Spikes",
+            description="Latest spike per event from the Redis latency monitor",
+            dataSource="${datasource}",
+            targets=[
+                Target(
+                    expr='max by (event_name) (redis_latency_spike_duration_seconds)',
+                    legendFormat='{{event_name}}',
+                    refId='A',
+                ),
+            ],
+            yAxes=single_y_axis(format=SECONDS_FORMAT),
+            gridPos=GridPos(h=8, w=12, x=12, y=49),
+        ),
+        Graph(
+            title="Slow Log",
+            dataSource="${datasource}",
+            targets=[
+                Target(
+                    expr='sum by (instance) (increase(redis_slowlog_last_id[$__rate_interval]))',
+                    legendFormat='New entries {{instance}}',
+                    refId='A',
+                ),
+                Target(
+                    expr='redis_last_slow_execution_duration_seconds',
+                    legendFormat='Last slow execution {{instance}}',
+                    refId='B',
+                ),
+            ],
+            yAxes=YAxes(
+                YAxis(format=SHORT_FORMAT),
+                YAxis(format=SECONDS_FORMAT),
+            ),
+            seriesOverrides=[{'alias': '/^Last slow/', 'yaxis': 2}],
+            gridPos=GridPos(h=8, w=12, x=0, y=57),
+        ),
+    ]
+
+
+@register('redis', title='Redis Monitoring', tags=['redis', 'monitoring', 'database'],
+          metrics=METRICS)
+def create_redis_dashboard(params=None):
+    """Create a Redis monitoring dashboard.
+
+    :param params: cluster parameters, see cluster.py
+    """
+    dashboard = Dashboard(
         title="Redis Monitoring",
         description="Dashboard for monitoring Redis metrics",
         tags=["redis", "monitoring", "database"],
@@ -135,36 +430,27 @@ def create_redis_dashboard():
                     type="datasource",
                     regex="/.*/"
                 ),
-                Template(
-                    name="instance",
-                    dataSource="${datasource}",
-                    query='label_values(redis_up, instance)',
-                    label="Redis Instance",
+                query_variable("job", "redis_up", title="Job"),
+                query_variable(
+                    "instance", "redis_up", scope=["job"], title="Redis Instance",
                     includeAll=True,
                 ),
-                Template(
-                    name="rate_interval",
-                    dataSource=None,
-                    query='1m,5m,10m,30m,1h',
-                    label="Rate Interval",
-                    type='interval',
-                    default='5m',
-                ),
+                min_interval_variable(RATE_WINDOWS),
             ]
         ),
-        panels=[
+        panels=layout([Section(None, [
             # Memory Usage Panel
             Graph(
                 title="Memory Usage",
                 dataSource="${datasource}",
                 targets=[
                     Target(
-                        expr='redis_memory_used_bytes{instance=~"$instance"}',
+                        expr='redis_memory_used_bytes',
                         legendFormat='Used Memory',
                         refId='A',
                     ),
                     Target(
-                        expr='redis_memory_max_bytes{instance=~"$instance"}',
+                        expr='redis_memory_max_bytes',
                         legendFormat='Max Memory',
                         refId='B',
                     ),
@@ -177,7 +463,7 @@ def create_redis_dashboard():
                 dataSource="${datasource}",
                 targets=[
                     Target(
-                        expr='redis_mem_fragmentation_ratio{instance=~"$instance"}',
+                        expr='redis_mem_fragmentation_ratio',
                         legendFormat='Fragmentation Ratio',
                         refId='A',
                     ),
@@ -191,12 +477,12 @@ def create_redis_dashboard():
                 dataSource="${datasource}",
                 targets=[
                     Target(
-                        expr='redis_connected_clients{instance=~"$instance"}',
+                        expr='redis_connected_clients',
                         legendFormat='Connected Clients',
                         refId='A',
                     ),
                     Target(
-                        expr='redis_blocked_clients{instance=~"$instance"}',
+                        expr='redis_blocked_clients',
                         legendFormat='Blocked Clients',
                         refId='B',
                     ),
@@ -210,7 +496,7 @@ def create_redis_dashboard():
                 dataSource="${datasource}",
                 targets=[
                     Target(
-                        expr='rate(redis_commands_processed_total{instance=~"$instance"}[$rate_interval])',
+                        expr='rate(redis_commands_processed_total[$__rate_interval])',
                         legendFormat='Commands/sec',
                         refId='A',
                     ),
@@ -224,12 +510,12 @@ def create_redis_dashboard():
                 dataSource="${datasource}",
                 targets=[
                     Target(
-                        expr='rate(redis_net_input_bytes_total{instance=~"$instance"}[$rate_interval])',
+                        expr='rate(redis_net_input_bytes_total[$__rate_interval])',
                         legendFormat='Input Bytes/sec',
                         refId='A',
                     ),
                     Target(
-                        expr='rate(redis_net_output_bytes_total{instance=~"$instance"}[$rate_interval])',
+                        expr='rate(redis_net_output_bytes_total[$__rate_interval])',
                         legendFormat='Output Bytes/sec',
                         refId='B',
                     ),
@@ -239,16 +525,16 @@ def create_redis_dashboard():
             ),
             # Command Latency Panel
             Graph(
-                title="Command Latency",
+                title="Mean Command Latency",
                 dataSource="${datasource}",
                 targets=[
                     Target(
-                        expr='rate(redis_commands_duration_seconds_total{instance=~"$instance"}[$rate_interval])',
-                        legendFormat='Command Duration',
+                        expr=command_latency('instance'),
+                        legendFormat='{{instance}}',
                         refId='A',
                     ),
                 ],
-                yAxes=single_y_axis(format=MILLISECONDS_FORMAT),
+                yAxes=single_y_axis(format=SECONDS_FORMAT),
                 gridPos=GridPos(h=8, w=12, x=12, y=16),
             ),
             # Error Rate Panel
@@ -257,7 +543,7 @@ def create_redis_dashboard():
                 dataSource="${datasource}",
                 targets=[
                     Target(
-                        expr='rate(redis_total_error_replies{instance=~"$instance"}[$rate_interval])',
+                        expr='rate(redis_total_error_replies[$__rate_interval])',
                         legendFormat='Errors/sec',
                         refId='A',
                     ),
@@ -265,13 +551,20 @@ def create_redis_dashboard():
                 yAxes=single_y_axis(format=SHORT_FORMAT),
                 gridPos=GridPos(h=8, w=12, x=0, y=24),
             ),
-        ],
+            forecast_table(
+                "Maxmemory Forecast",
+                description="Memory growth over the last 6 hours and when it "
+                            "reaches maxmemory",
+                growth=MEMORY_GROWTH,
+                eta=MAXMEMORY_ETA,
+                gridPos=GridPos(h=8, w=12, x=12, y=24),
+            ),
+        ]), Section("Command Latency", create_command_latency_panels(), collapsed=True),
+            Section("Fleet", fleet_panels(FLEET_SUMMARY), collapsed=True)]),
     ).auto_panel_ids()
+    return apply_passes(dashboard, params, RATE_WINDOWS, INSTANCE_METRIC,
+                        recorded=create_redis_recording_rules())
 
-# The dashboard variable must be defined at module level for grafanalib
-dashboard = create_redis_dashboard()
-dashboard.alerts = create_redis_alerts()
 
-if __name__ == "__main__":
-    # No-op - grafanalib will use the dashboard variable directly
-    pass
+# Built on first access of ``dashboard``
+__getattr__ = lazy_dashboard(create_redis_dashboard)
@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+"""Keep dashboard auto-refresh within a Prometheus query budget.
+
+Each viewer with a dashboard open runs all of its loaded queries once per
+refresh, so the load on Prometheus is::
+
+    queries per refresh * refreshes per minute * viewers
+
+``plan_refresh`` computes the fastest refresh interval that keeps this
+under the budget of a ``RefreshPolicy``, slows the dashboard's default
+refresh down to it if needed and removes faster intervals from the
+refresh picker. Dashboards over an absolute time range (not ending at
+``now``) do not auto-refresh and are left alone.
+
+Grafana cannot enforce a minimum refresh per dashboard; the report lists
+the value to set as ``min_refresh_interval`` in grafana.ini.
+
+Usage::
+
+    python refresh.py --viewers 20 --budget 600
+"""
+
+import argparse
+import math
+import sys
+
+import attr
+from grafanalib.core import DEFAULT_TIME_PICKER
+
+import promql
+from dashboard_utils import (
+    copy_extras, find_dashboards, iter_loaded_panels, load_dashboard,
+)
+from dedup import query_count
+
+
+REFRESH_INTERVALS = ['10s', '30s', '1m', '5m', '15m', '30m', '1h', '2h', '1d']
+
+
+@attr.s
+class RefreshPolicy(object):
+    """Query budget shared by the viewers of a dashboard.
+
+    :param max_queries_per_minute: queries per minute Prometheus should
+        serve for one dashboard across all its viewers
+    :param viewers: number of viewers expected to keep it open
+    :param intervals: refresh intervals the picker may offer
+    """
+
+    max_queries_per_minute = attr.ib(default=600)
+    viewers = attr.ib(default=20)
+    intervals = attr.ib(default=attr.Factory(lambda: list(REFRESH_INTERVALS)))
+
+    def per_viewer(self):
+        return float(self.max_queries_per_minute) / max(self.viewers, 1)
+
+
+def _seconds(interval):
+    return promql.parse_duration(interval) if interval else None
+
+
+def time_range(dashboard):
+    """Seconds covered by the default time range, or ``None`` if absolute."""
+    start, end = dashboard.time.start, dashboard.time.end
+    if end != 'now' or not start.startswith('now-'):
+        return None
+    return promql.parse_duration(start[len('now-'):])
+
+
+def points_per_refresh(dashboard):
+    """Points per series one refresh returns, summed over the loaded targets."""
+    seconds = time_range(dashboard) or 0
+    total = 0
+    for panel in iter_loaded_panels(dashboard):
+        targets = [t for t in getattr(panel, 'targets', []) if t.expr and not t.hide]
+        points = getattr(panel, 'maxDataPoints', None) or 100
+        interval = getattr(panel, 'interval', None)
+        if interval and '$' not in interval:
+            points = min(points, int(seconds // _seconds(interval)) + 1)
+        total += sum(1 if t.instant else points for t in targets)
+    return total
+
+
+def queries_per_minute(dashboard, refresh=None):
+    """Queries one viewer runs per minute at ``refresh`` (default: the dashboard's)."""
+    refresh = dashboard.refresh if refresh is None else refresh
+    if not refresh or time_range(dashboard) is None:
+        return 0.0
+    return query_count(dashboard) * 60.0 / _seconds(refresh)
+
+
+def min_refresh(dashboard, policy):
+    """Fastest refresh interval, in seconds, that stays within ``policy``."""
+    return query_count(dashboard) * 60.0 / policy.per_viewer()
+
+
+def plan_refresh(dashboard, policy=None):
+    """Return a copy of ``dashboard`` whose refresh fits ``policy``."""
+    policy = policy or RefreshPolicy()
+    if time_range(dashboard) is None:
+        return dashboard
+    minimum = min_refresh(dashboard, policy)
+    allowed = [i for i in policy.intervals if _seconds(i) >= minimum]
+    if not allowed:
+        allowed = [promql.format_duration(math.ceil(minimum))]
+    refresh = dashboard.refresh
+    if refresh and _seconds(refresh) < minimum:
+        refresh = allowed[0]
+    picker = dashboard.timePicker or DEFAULT_TIME_PICKER
+    return copy_extras(dashboard, attr.evolve(
+        dashboard,
+        refresh=refresh,
+        timePicker=attr.evolve(picker, refreshIntervals=allowed),
+    ))
+
+
+def main(args):
+    parser = argparse.ArgumentParser(prog='refresh')
+    parser.add_argument(
+        'dashboards', metavar='DASHBOARD', nargs='*',
+        help='Dashboard definitions (default: every *.dashboard.py)',
+    )
+    parser.add_argument(
+        '--viewers', type=int, default=RefreshPolicy().viewers,
+        help='Viewers keeping each dashboard open (default: %(default)s)',
+    )
+    parser.add_argument(
+        '--budget', type=int, default=RefreshPolicy().max_queries_per_minute,
+        help='Queries per minute allowed per dashboard (default: %(default)s)',
+    )
+    opts = parser.parse_args(args)
+    policy = RefreshPolicy(max_queries_per_minute=opts.budget, viewers=opts.viewers)
+
+    over = False
+    for path in opts.dashboards or find_dashboards():
+        dashboard = load_dashboard(path)
+        per_viewer = queries_per_minute(dashboard)
+        total = per_viewer * policy.viewers
+        over = over or total > policy.max_queries_per_minute
+        sys.stdout.write(
+            '{}: {} queries every {}, {:.1f} queries/min per viewer, {:.0f} for {} viewers, '
+            '{} points per refresh\n'.format(
+                path, query_count(dashboard), dashboard.refresh or 'never', per_viewer,
+                total, policy.viewers, points_per_refresh(dashboard)))
+        if time_range(dashboard) is not None:
+            sys.stdout.write('    min_refresh_interval = {}\n'.format(
+                promql.format_duration(math.ceil(min_refresh(dashboard, policy)))))
+    return 1 if over else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
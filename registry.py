@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+"""Registry of the dashboard factories.
+
+Dashboard modules register their ``create_*_dashboard`` factory with
+metadata instead of building the dashboard when they are imported::
+
+    @register('redis', title='Redis Dashboard', tags=['redis'],
+              metrics=['redis_memory_used_bytes', ...])
+    def create_redis_dashboard(params=None):
+        ...
+
+    __getattr__ = lazy_dashboard(create_redis_dashboard)
+
+Importing a module then only defines functions, so tools can list the
+dashboards and build a selection of them without building the rest.
+``lazy_dashboard`` keeps the module-level ``dashboard`` variable that
+grafanalib's ``generate-dashboard`` and the tools here read; it is built
+on first access and cached.
+
+Usage::
+
+    python registry.py              # list the dashboards, building none
+    python registry.py --tag mysql
+    python registry.py --check      # compare declared and queried metrics
+"""
+
+import argparse
+import sys
+
+import attr
+
+from dashboard_utils import (
+    dashboard_name, find_dashboards, iter_module_targets, load_module, module_factory,
+)
+
+
+@attr.s
+class DashboardSpec(object):
+    """A registered dashboard factory and its metadata."""
+
+    name = attr.ib()
+    factory = attr.ib()
+    title = attr.ib(default=None)
+    tags = attr.ib(default=attr.Factory(list), converter=list)
+    # Metrics the dashboard queries; its exporters must provide them.
+    metrics = attr.ib(default=attr.Factory(list), converter=list)
+    path = attr.ib(default=None)
+
+    def build(self, params=None):
+        return self.factory(params)
+
+
+# Specs by name, filled in as dashboard modules are imported.
+REGISTRY = {}
+
+
+def register(name, title=None, tags=(), metrics=()):
+    """Decorator registering a ``create_*_dashboard(params=None)`` factory."""
+    def decorator(factory):
+        factory.spec = DashboardSpec(name, factory, title, tags, metrics)
+        REGISTRY[name] = factory.spec
+        return factory
+    return decorator
+
+
+def lazy_dashboard(factory):
+    """A module ``__getattr__`` building ``dashboard`` on first access."""
+    built = []
+
+    def __getattr__(name):
+        if name != 'dashboard':
+            raise AttributeError('module {!r} has no attribute {!r}'.format(
+                factory.__module__, name))
+        if not built:
+            built.append(factory())
+        return built[0]
+    return __getattr__
+
+
+def module_spec(path):
+    """Import the module at ``path``; return its ``DashboardSpec``.
+
+    Modules whose factory is not registered get a spec without metadata.
+    """
+    factory = module_factory(load_module(path))
+    spec = getattr(factory, 'spec', None)
+    if spec is None:
+        spec = DashboardSpec(dashboard_name(path), factory)
+    return attr.evolve(spec, path=path)
+
+
+def load_specs(paths, tags=()):
+    """Specs for the modules at ``paths`` having all of ``tags``."""
+    specs = [module_spec(p) for p in paths]
+    return [s for s in specs if set(tags) <= set(s.tags)]
+
+
+def queried_metrics(path):
+    """Metric names queried by the module at ``path``; builds the dashboard.
+
+    The module's recording rules and the series recorded for its
+    long-range mode (see ``long_range.py``) are left out, since Prometheus
+    records them, not an exporter; the metrics the rules read are kept.
+    """
+    # Imported here: listing the registry does not need the parser.
+    from promql import PromQLError, metric_names, parse
+    from recording_rules import module_recording_rules
+    module = load_module(path)
+    rules = module_recording_rules(module)
+    exprs = [t.expr for _, _, t in iter_module_targets(module)] + list(rules.values())
+    metrics = set()
+    for expr in exprs:
+        try:
+            metrics.update(metric_names(parse(expr)))
+        except PromQLError:
+            continue
+    recorded = set(rules) | set(getattr(module.dashboard, 'downsampled', None) or ())
+    return metrics - recorded
+
+
+def main(args):
+    parser = argparse.ArgumentParser(prog='registry')
+    parser.add_argument(
+        'paths', metavar='DASHBOARD', nargs='*',
+        help='Dashboard definitions (default: every *.dashboard.py)',
+    )
+    parser.add_argument(
+        '--tag', action='append', default=[],
+        help='Only list dashboards with this tag (repeatable)',
+    )
+    parser.add_argument(
+        '--check', action='store_true',
+        help='Build the dashboards and check their declared metrics',
+    )
+    opts = parser.parse_args(args)
+
+    specs = load_specs(opts.paths or find_dashboards('.'), opts.tag)
+    failed = 0
+    for spec in specs:
+        print('{:<16} {:<28} {}'.format(spec.name, spec.title or '-', ', '.join(spec.tags)))
+        if not opts.check:
+            continue
+        queried = queried_metrics(spec.path)
+        for metric in sorted(queried - set(spec.metrics)):
+            failed += 1
+            print('    undeclared metric {}'.format(metric))
+        for metric in sorted(set(spec.metrics) - queried):
+            failed += 1
+            print('    declared metric {} is not queried'.format(metric))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
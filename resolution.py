@@ -0,0 +1,71 @@
+"""Set panel query resolution from panel size and type.
+
+Grafana sizes the query step of a panel from the panel's pixel width
+unless ``maxDataPoints`` caps it, so a full-width graph on a 4K screen
+asks for thousands of points per series. ``apply_resolution`` gives every
+panel a fixed point budget instead:
+
+* panels reducing their series to a single value (stats, gauges) run
+  instant queries, i.e. show the value of their query at the end of the
+  time range;
+* panels get points in proportion to their grid width, between
+  ``min_points`` and ``max_points``; for instant queries the budget only
+  sets ``$__interval`` and with it ``$__rate_interval``;
+* the minimum interval is the scrape interval, as finer steps only
+  repeat samples.
+
+Panels that already set ``interval`` keep it.
+"""
+
+import attr
+from grafanalib.core import BarGauge, Gauge, GaugePanel, SingleStat, Stat
+
+from dashboard_utils import copy_extras
+
+
+DEFAULT_SCRAPE_INTERVAL = '15s'
+GRID_WIDTH = 24
+
+REDUCING_PANELS = (Stat, SingleStat, Gauge, GaugePanel, BarGauge)
+
+
+@attr.s
+class ResolutionPolicy(object):
+    """Point budget for the panels of a dashboard.
+
+    :param scrape_interval: Prometheus scrape interval, used as the
+        panels' minimum query interval
+    :param points_per_column: points per grid column (of 24)
+    :param min_points: smallest budget of a panel
+    :param max_points: largest budget of a panel
+    """
+
+    scrape_interval = attr.ib(default=DEFAULT_SCRAPE_INTERVAL)
+    points_per_column = attr.ib(default=20)
+    min_points = attr.ib(default=60)
+    max_points = attr.ib(default=480)
+
+    def max_data_points(self, panel):
+        width = panel.gridPos.w if panel.gridPos else GRID_WIDTH // 2
+        return max(self.min_points, min(self.max_points, width * self.points_per_column))
+
+    def apply(self, panel):
+        if not getattr(panel, 'targets', None):
+            return panel
+        targets = panel.targets
+        if isinstance(panel, REDUCING_PANELS):
+            # Hidden targets are evaluated by alerts, which need ranges.
+            targets = [t if t.hide or not t.expr else attr.evolve(t, instant=True)
+                       for t in targets]
+        return attr.evolve(
+            panel,
+            targets=targets,
+            maxDataPoints=self.max_data_points(panel),
+            interval=panel.interval or self.scrape_interval,
+        )
+
+
+def apply_resolution(dashboard, policy=None):
+    """Return a copy of ``dashboard`` with ``policy`` applied to each panel."""
+    policy = policy or ResolutionPolicy()
+    return copy_extras(dashboard, dashboard._map_panels(policy.apply))
@@ -0,0 +1,222 @@
+"""Split one cluster's dashboard into shards, plus an index dashboard.
+
+A fleet manifest entry with ``shard_by`` builds one dashboard per shard
+instead of one for the whole cluster (see ``fleet.py``):
+
+``shard_by: environment`` or ``shard_by: job``
+    one shard per value listed in ``shards``;
+``shard_by: hash``
+    the instances listed in ``instances`` are spread over ``buckets``
+    shards by a hash of their name.
+
+Lists are YAML lists, or ``|``-separated in CSV manifests. Each shard
+dashboard has its variable pinned to the shard's values, so its lookups
+and queries only cover the shard. Shards are derived from the manifest
+alone, so uids and file names are the same on every build.
+
+The index dashboard has a row per shard with the instance count and the
+p95 of the module's ``FLEET_SUMMARY`` metrics, each linking to the shard.
+"""
+
+import hashlib
+import re
+
+import attr
+from grafanalib.core import (
+    Dashboard, DashboardLink, GridPos, Table, Target, Template, Templating,
+)
+
+import promql
+from cluster import RESERVED, apply_params, dashboard_uid
+from dashboard_utils import copy_extras
+from promql_eval import substitute
+from variables import DATASOURCE
+
+
+SHARD_KEYS = frozenset(['shard_by', 'shards', 'buckets', 'instances'])
+LABEL_SHARDS = ('environment', 'job')
+
+
+class ShardError(Exception):
+    """A manifest entry whose sharding cannot be planned."""
+
+
+@attr.s
+class Shard(object):
+    """Part of a cluster: the ``label`` values a shard dashboard covers."""
+
+    name = attr.ib()
+    label = attr.ib()
+    values = attr.ib(converter=list)
+
+    def regex(self):
+        return '|'.join(re.escape(v) for v in self.values)
+
+
+def _list(value):
+    if isinstance(value, (list, tuple)):
+        return [str(v) for v in value]
+    return [v.strip() for v in str(value or '').split('|') if v.strip()]
+
+
+def hash_bucket(instance, buckets):
+    """Stable bucket of ``instance``; does not depend on the other instances."""
+    return int(hashlib.sha1(instance.encode('utf-8')).hexdigest(), 16) % buckets
+
+
+def plan_shards(params):
+    """The shards of the manifest entry ``params``, in a stable order."""
+    by = params.get('shard_by')
+    if by in LABEL_SHARDS:
+        values = _list(params.get('shards'))
+        if not values:
+            raise ShardError('shard_by {} needs shards'.format(by))
+        return [Shard(v, by, [v]) for v in values]
+    if by == 'hash':
+        buckets = int(params.get('buckets') or 0)
+        instances = sorted(set(_list(params.get('instances'))))
+        if buckets < 1 or not instances:
+            raise ShardError('shard_by hash needs buckets and instances')
+        width = len(str(buckets - 1))
+        members = [[] for _ in range(buckets)]
+        for instance in instances:
+            members[hash_bucket(instance, buckets)].append(instance)
+        return [Shard(str(i).zfill(width), 'instance', m)
+                for i, m in enumerate(members) if m]
+    raise ShardError('unknown shard_by {!r}'.format(by))
+
+
+def group_tag(params):
+    """Tag shared by the shards of one manifest entry and their index."""
+    return 'shards:{}-{}'.format(params.get('dashboard'), params.get('cluster'))
+
+
+def shard_params(params, shard):
+    """Factory parameters for ``shard``; the cluster name gets the shard's."""
+    out = dict((k, v) for k, v in params.items() if k not in SHARD_KEYS)
+    out['cluster'] = '{}-{}'.format(params['cluster'], shard.name)
+    out.pop('uid', None)
+    return out
+
+
+def pin_variable(dashboard, shard):
+    """Limit the shard's variable to its values and select them."""
+    templates = []
+    for template in dashboard.templating.list:
+        if template.name == shard.label:
+            if len(shard.values) > 1 and not template.includeAll:
+                raise ShardError('variable {} cannot select several values'.format(shard.label))
+            template = attr.evolve(
+                template, regex='/^({})$/'.format(shard.regex()),
+                default='$__all' if len(shard.values) > 1 else shard.values[0])
+        templates.append(template)
+    if not any(t.name == shard.label for t in templates):
+        raise ShardError('dashboard has no {} variable'.format(shard.label))
+    return copy_extras(dashboard, attr.evolve(dashboard, templating=Templating(list=templates)))
+
+
+def build_shard(factory, params, shard):
+    """The dashboard of ``shard``, linking to its siblings and the index."""
+    dashboard = pin_variable(factory(shard_params(params, shard)), shard)
+    links = list(dashboard.links) + [
+        DashboardLink(type='link', title='Shard index', icon='dashboard',
+                      uri='/d/{}'.format(index_uid(params))),
+        DashboardLink(type='dashboards', title='Shards', asDropdown=True,
+                      tags=[group_tag(params)]),
+    ]
+    return copy_extras(dashboard, attr.evolve(
+        dashboard, links=links, tags=list(dashboard.tags) + [group_tag(params)]))
+
+
+def index_uid(params):
+    """Uid of the index; independent of the shards, so links stay valid."""
+    return dashboard_uid('{} shards'.format(params['dashboard']), params['cluster'])
+
+
+def _matchers(shard, params):
+    matchers = [promql.Matcher(shard.label, '=~', shard.regex())]
+    if params.get('job') and shard.label != 'job':
+        matchers.append(promql.Matcher('job', '=', params['job']))
+    return matchers
+
+
+def _scoped(expr, matchers):
+    def visit(n):
+        if isinstance(n, promql.VectorSelector):
+            return attr.evolve(n, matchers=list(n.matchers) + matchers)
+        return n
+    return promql.transform(promql.parse(expr), visit)
+
+
+def per_shard(template, expr, shards, params):
+    """``template`` applied to ``expr`` in each shard, joined with ``or``.
+
+    Each result is labelled with the shard name and the uid of its
+    dashboard. ``shards`` holds ``(Shard, uid)`` pairs.
+    """
+    return ' or '.join(
+        'label_replace(label_replace({}, "shard", "{}", "", ""), "dashboard", "{}", "", "")'.format(
+            template.format(_scoped(expr, _matchers(shard, params))), shard.name, uid)
+        for shard, uid in shards)
+
+
+def build_index(title, params, shards, instance_metric, summary=(), variables=None):
+    """Index dashboard of a sharded manifest entry.
+
+    :param title: title of the sharded dashboard
+    :param shards: ``(Shard, uid)`` pairs
+    :param instance_metric: metric with one series per instance
+    :param summary: ``(title, expr, format)`` tuples, shown as the p95
+        across each shard's instances
+    :param variables: values for the variables ``summary`` uses, such as
+        ``__rate_interval``; the index has no variables of its own
+    """
+    targets = [Target(expr=per_shard('count({})', instance_metric, shards, params),
+                      format='table', instant=True, refId='A')]
+    renames = {'Value #A': 'Instances'}
+    overrides = [{
+        'matcher': {'id': 'byName', 'options': 'shard'},
+        'properties': [{'id': 'links', 'value': [{
+            'title': 'Open shard ${__data.fields.shard}',
+            'url': '/d/${__data.fields.dashboard}?${__url_time_range}',
+        }]}],
+    }]
+    for i, (name, expr, fmt) in enumerate(summary):
+        ref = chr(ord('B') + i)
+        column = '{} p95'.format(name)
+        expr = substitute(expr, variables or {})
+        targets.append(Target(expr=per_shard('quantile(0.95, {})', expr, shards, params),
+                              format='table', instant=True, refId=ref))
+        renames['Value #' + ref] = column
+        overrides.append({'matcher': {'id': 'byName', 'options': column},
+                          'properties': [{'id': 'unit', 'value': fmt}]})
+
+    dashboard = Dashboard(
+        title='{} shards'.format(title),
+        description='Summary of the shards of {}; open a shard from its row'.format(title),
+        tags=['shard-index', group_tag(params)],
+        timezone='browser',
+        templating=Templating(list=[
+            Template(name='datasource', label='Data Source', dataSource=None,
+                     query='prometheus', type='datasource', regex='/.*/'),
+        ]),
+        links=[DashboardLink(type='dashboards', title='Shards', asDropdown=True,
+                             tags=[group_tag(params)])],
+        panels=[Table(
+            title='Shards',
+            dataSource=DATASOURCE,
+            targets=targets,
+            transformations=[
+                {'id': 'merge', 'options': {}},
+                {'id': 'organize', 'options': {
+                    'excludeByName': {'Time': True},
+                    'renameByName': renames,
+                }},
+            ],
+            overrides=overrides,
+            gridPos=GridPos(h=min(4 + len(shards), 30), w=24, x=0, y=0),
+        )],
+    ).auto_panel_ids()
+    index_params = dict((k, v) for k, v in params.items() if k in RESERVED)
+    index_params['uid'] = index_uid(params)
+    return apply_params(dashboard, index_params)
@@ -5,30 +5,132 @@ from grafanalib.core import (
     PERCENT_FORMAT, BYTES_FORMAT, SHORT_FORMAT,
     Template, Templating, REFRESH_ON_TIME_RANGE_CHANGE,
     Alert, AlertCondition, Notification, 
-    GreaterThan, TimeRange, OP_AND
+    GreaterThan, LowerThan, TimeRange, OP_AND, SECONDS_FORMAT
 )
 
+from alert_tests import AlertTest
+from capacity import (
+    forecast_table, growth_rate, seconds_until_empty, seconds_until_full,
+)
+from dashboard_utils import apply_passes
+from fleet_view import fleet_panels
+from layout import Section, layout
+from rate_window import RateWindowPolicy, min_interval_variable
+from registry import lazy_dashboard, register
+from variables import query_variable
+
+# Whether each section's row starts collapsed. Panels in a collapsed row
+# only query once the row is expanded, so the expensive sections are
+# collapsed by default.
+COLLAPSED_SECTIONS = {
+    "System Resources": False,
+    "Network": True,
+    "IO": True,
+    "Go Runtime": True,
+    "Capacity": True,
+    "Fleet": True,
+}
+
+# Filesystems forecast for disk-full alerts; in-memory ones are skipped.
+FILESYSTEM_AVAIL = 'node_filesystem_avail_bytes{fstype!~"tmpfs|overlay"}'
+
+# Forecasts recorded by create_system_recording_rules; panels and alerts
+# read these instead of running the regressions.
+FILESYSTEM_GROWTH = 'instance:node_filesystem_avail_bytes:deriv6h'
+FILESYSTEM_ETA = 'instance:node_filesystem_avail_bytes:seconds_until_empty6h'
+MEMORY_GROWTH = 'instance:system_memory_usage_bytes:deriv6h'
+MEMORY_ETA = 'instance:system_memory_usage_bytes:seconds_until_full6h'
+
+# Alert when a resource runs out within this many seconds at its
+# current growth.
+DISK_FULL_HORIZON = 24 * 3600
+MEMORY_FULL_HORIZON = 4 * 3600
+
+# Rate windows and min interval of the panels; see rate_window.py.
+RATE_WINDOWS = RateWindowPolicy()
+
+# Series per instance, used to size the selection; see fleet_view.py.
+INSTANCE_METRIC = 'system_cpu_usage_percent'
+
+# Key metrics compared across instances in the Fleet row and shard index.
+FLEET_SUMMARY = [
+    ("CPU Usage", 'system_cpu_usage_percent / 1000000', PERCENT_FORMAT),
+    ("Memory Usage", 'system_memory_usage_bytes', BYTES_FORMAT),
+    ("Load Average", 'node_load1', SHORT_FORMAT),
+    ("Goroutines", 'go_goroutines', SHORT_FORMAT),
+]
+
+# Metrics the dashboard queries, see registry.py.
+METRICS = [
+    'go_gc_duration_seconds',
+    'go_gc_duration_seconds_sum',
+    'go_goroutines',
+    'go_memstats_heap_alloc_bytes',
+    'go_memstats_heap_idle_bytes',
+    'go_memstats_heap_inuse_bytes',
+    'go_threads',
+    'node_disk_read_time_seconds_total',
+    'node_disk_reads_completed_total',
+    'node_filesystem_avail_bytes',
+    'node_load1',
+    'process_resident_memory_bytes',
+    'process_virtual_memory_bytes',
+    'system_cpu_usage_percent',
+    'system_io_read_bytes',
+    'system_io_read_operations',
+    'system_io_write_bytes',
+    'system_io_write_operations',
+    'system_memory_total_bytes',
+    'system_memory_usage_bytes',
+    'system_network_rx_bytes_per_second',
+    'system_network_rx_packets_per_second',
+    'system_network_tx_bytes_per_second',
+    'system_network_tx_packets_per_second',
+]
+
 # Alert Conditions
 def create_system_alerts():
     # System alerts
     disk_space_alert = Alert(
-        name="Low Disk Space",
-        message="Disk space usage is above 85% for 5 minutes",
+        name="Disk Filling Up",
+        message="Filesystem {{ $labels.mountpoint }} on {{ $labels.instance }} "
+                "will be full within 24 hours at its current growth",
         noDataState="no_data",
         alertConditions=[
             AlertCondition(
                 Target(
-                    expr='100 - ((node_filesystem_avail_bytes * 100) / node_filesystem_size_bytes)',
+                    expr='{} > 0 < {}'.format(FILESYSTEM_ETA, DISK_FULL_HORIZON),
                     refId='A',
                     datasource="${datasource}",
                 ),
-                timeRange=TimeRange("5m", "now"),
-                evaluator=GreaterThan(85),
+                timeRange=TimeRange("15m", "now"),
+                evaluator=LowerThan(DISK_FULL_HORIZON),
                 operator=OP_AND,
             )
         ],
-        gracePeriod="5m",
-        frequency="1m",
+        gracePeriod="15m",
+        frequency="5m",
+    )
+
+    memory_exhaustion_alert = Alert(
+        name="Memory Exhaustion Forecast",
+        message="Memory on {{ $labels.instance }} will run out within 4 hours "
+                "at its current growth",
+        noDataState="no_data",
+        alertConditions=[
+            AlertCondition(
+                Target(
+                    expr='{} > 0 < {}'.format(MEMORY_ETA, MEMORY_FULL_HORIZON),
+                    refId='A',
+                    datasource="${datasource}",
+                ),
+                timeRange=TimeRange("15m", "now"),
+                evaluator=LowerThan(MEMORY_FULL_HORIZON),
+                operator=OP_AND,
+            )
+        ],
+        gracePeriod="15m",
+        frequency="5m",
     )
 
     load_avg_alert = Alert(
@@ -59,7 +161,7 @@ def create_system_alerts():
         alertConditions=[
             AlertCondition(
                 Target(
-                    expr='(rate(system_network_tx_bytes_per_second{interface="$interface"}[$rate_interval]) + rate(system_network_rx_bytes_per_second{interface="$interface"}[$rate_interval])) / 1000000000 * 8 > 0.8',  # Assumes 1Gbps link
+                    expr='(system_network_tx_bytes_per_second{interface="$interface"} + system_network_rx_bytes_per_second{interface="$interface"}) / 1000000000 * 8 > 0.8',  # Assumes 1Gbps link
                     refId='A',
                     datasource="${datasource}",
                 ),
@@ -80,7 +182,7 @@ def create_system_alerts():
         alertConditions=[
             AlertCondition(
                 Target(
-                    expr='rate(node_disk_read_time_seconds_total[$rate_interval]) / rate(node_disk_reads_completed_total[$rate_interval]) > 0.1',
+                    expr='rate(node_disk_read_time_seconds_total[$__rate_interval]) / rate(node_disk_reads_completed_total[$__rate_interval]) > 0.1',
                     refId='A',
                     datasource="${datasource}",
                 ),
@@ -159,7 +261,7 @@ def create_system_alerts():
         alertConditions=[
             AlertCondition(
                 Target(
-                    expr='rate(go_gc_duration_seconds_sum[$rate_interval])',
+                    expr='rate(go_gc_duration_seconds_sum[$__rate_interval])',
                     refId='A',
                     datasource="${datasource}",
                 ),
@@ -173,303 +275,398 @@ def create_system_alerts():
     )
 
     return (cpu_alert, memory_alert, goroutine_alert, gc_duration_alert,
-            disk_space_alert, load_avg_alert, network_saturation_alert, io_latency_alert)
-
-# Template Variables
-templating = Templating(
-    list=[
-        Template(
-            name="datasource",
-            label="Data Source",
-            dataSource=None,
-            query="prometheus",
-            type="datasource",
-            regex="/.*/"
-        ),
-        Template(
-            name="job",
-            label="Job",
-            dataSource="${datasource}",
-            query="label_values(system_cpu_usage_percent, job)",
-            refresh=REFRESH_ON_TIME_RANGE_CHANGE,
-        ),
-        Template(
-            name="instance",
-            label="Instance", 
-            dataSource="${datasource}",
-            query="label_values(system_cpu_usage_percent{job=~\"$job\"}, instance)",
-            refresh=REFRESH_ON_TIME_RANGE_CHANGE,
+            disk_space_alert, load_avg_alert, network_saturation_alert, io_latency_alert,
+            memory_exhaustion_alert)
+
+
+def create_system_recording_rules():
+    """The capacity forecasts, recorded so the panels load fast; see capacity.py."""
+    return {
+        FILESYSTEM_GROWTH: growth_rate(FILESYSTEM_AVAIL),
+        FILESYSTEM_ETA: seconds_until_empty(FILESYSTEM_AVAIL),
+        MEMORY_GROWTH: growth_rate('system_memory_usage_bytes'),
+        MEMORY_ETA: seconds_until_full('system_memory_usage_bytes', 'system_memory_total_bytes'),
+    }
+
+
+def create_system_alert_tests():
+    # 30s of read time per 100 reads on sda (300ms each), 5s on sdb (50ms).
+    return [
+        AlertTest(
+            alert="High I/O Latency",
+            series={
+                'node_disk_read_time_seconds_total{instance="host-1:9100", device="sda"}': '0+30x20',
+                'node_disk_reads_completed_total{instance="host-1:9100", device="sda"}': '0+100x20',
+                'node_disk_read_time_seconds_total{instance="host-1:9100", device="sdb"}': '0+5x20',
+                'node_disk_reads_completed_total{instance="host-1:9100", device="sdb"}': '0+100x20',
+            },
+            firing=[
+                ('5m', []),
+                ('6m', [{'instance': 'host-1:9100', 'device': 'sda'}]),
+            ],
         ),
-        Template(
-            name="interface",
-            label="Network Interface",
-            dataSource="${datasource}",
-            query='label_values(system_network_rx_bytes_per_second, interface)',
-            refresh=REFRESH_ON_TIME_RANGE_CHANGE,
+        AlertTest(
+            alert="Disk Filling Up",
+            interval='5m',
+            series={
+                # /data loses 1GB per 10m (full in ~16h), / 100MB (~7 days),
+                # /var is stable and the tmpfs is not forecast.
+                'node_filesystem_avail_bytes{instance="host-1:9100", mountpoint="/data", fstype="ext4"}': '100e9-5e8x120',
+                'node_filesystem_avail_bytes{instance="host-1:9100", mountpoint="/", fstype="ext4"}': '100e9-5e7x120',
+                'node_filesystem_avail_bytes{instance="host-1:9100", mountpoint="/var", fstype="xfs"}': '50e9x120',
+                'node_filesystem_avail_bytes{instance="host-1:9100", mountpoint="/run", fstype="tmpfs"}': '1e9-5e6x120',
+            },
+            firing=[
+                ('15m', []),
+                ('20m', [{'instance': 'host-1:9100', 'mountpoint': '/data', 'fstype': 'ext4'}]),
+                ('8h', [{'instance': 'host-1:9100', 'mountpoint': '/data', 'fstype': 'ext4'}]),
+            ],
         ),
-        Template(
-            name="rate_interval",
-            label="Rate Interval",
-            dataSource=None,
-            query="1m,5m,10m,30m,1h",
-            type="custom",
-            default="5m"
+        AlertTest(
+            alert="Memory Exhaustion Forecast",
+            interval='5m',
+            series={
+                # host-1 leaks 200MB per 10m into 16GB; host-2 is steady.
+                'system_memory_usage_bytes{instance="host-1:9100"}': '8e9+1e8x60',
+                'system_memory_total_bytes{instance="host-1:9100"}': '16e9x60',
+                'system_memory_usage_bytes{instance="host-2:9100"}': '8e9x60',
+                'system_memory_total_bytes{instance="host-2:9100"}': '16e9x60',
+            },
+            firing=[
+                ('1h', []),
+                ('4h', [{'instance': 'host-1:9100'}]),
+            ],
         ),
     ]
-)
 
-# Quick Stats Row
-cpu_stat = Stat(
-    title="CPU Usage",
-    dataSource="${datasource}",
-    targets=[
-        Target(
-            expr='avg_over_time(system_cpu_usage_percent{job=~"$job", instance=~"$instance"}[$rate_interval]) / 1000000',
-            refId='A',
-        ),
-    ],
-    gridPos=GridPos(h=3, w=6, x=0, y=0),
-    format=PERCENT_FORMAT,
-)
 
-memory_stat = Stat(
-    title="Memory Usage",
-    dataSource="${datasource}",
-    targets=[
-        Target(
-            expr='avg_over_time(system_memory_usage_bytes{job=~"$job", instance=~"$instance"}[$rate_interval])',
-            refId='A',
-        ),
-    ],
-    gridPos=GridPos(h=3, w=6, x=6, y=0),
-    format=BYTES_FORMAT,
-)
+@register('system_metrics', title='System Metrics Dashboard', tags=['system', 'golang'],
+          metrics=METRICS)
+def create_system_dashboard(params=None):
+    """Create the system metrics dashboard; ``params`` describes a cluster, see cluster.py."""
+    # Template Variables
+    templating = Templating(
+        list=[
+            Template(
+                name="datasource",
+                label="Data Source",
+                dataSource=None,
+                query="prometheus",
+                type="datasource",
+                regex="/.*/"
+            ),
+            query_variable("job", "system_cpu_usage_percent", title="Job"),
+            query_variable(
+                "instance", "system_cpu_usage_percent", scope=["job"], title="Instance",
+                refresh=REFRESH_ON_TIME_RANGE_CHANGE, includeAll=True, multi=True,
+            ),
+            query_variable(
+                "interface", "system_network_rx_bytes_per_second", scope=["job", "instance"],
+                title="Network Interface", regex="/^(?!lo$)/",
+            ),
+            min_interval_variable(RATE_WINDOWS),
+        ]
+    )
 
-goroutines_stat = Stat(
-    title="Goroutines",
-    dataSource="${datasource}",
-    targets=[
-        Target(
-            expr='avg_over_time(go_goroutines[$rate_interval])',
-            refId='A',
-        ),
-    ],
-    gridPos=GridPos(h=3, w=6, x=12, y=0),
-)
+    # Quick Stats Row
+    cpu_stat = Stat(
+        title="CPU Usage",
+        dataSource="${datasource}",
+        targets=[
+            Target(
+                expr='avg_over_time(system_cpu_usage_percent[$__rate_interval]) / 1000000',
+                refId='A',
+            ),
+        ],
+        gridPos=GridPos(h=3, w=6, x=0, y=0),
+        format=PERCENT_FORMAT,
+    )
 
-threads_stat = Stat(
-    title="OS Threads",
-    dataSource="${datasource}",
-    targets=[
-        Target(
-            expr='avg_over_time(go_threads[$rate_interval])',
-            refId='A',
-        ),
-    ],
-    gridPos=GridPos(h=3, w=6, x=18, y=0),
-)
+    memory_stat = Stat(
+        title="Memory Usage",
+        dataSource="${datasource}",
+        targets=[
+            Target(
+                expr='avg_over_time(system_memory_usage_bytes[$__rate_interval])',
+                refId='A',
+            ),
+        ],
+        gridPos=GridPos(h=3, w=6, x=6, y=0),
+        format=BYTES_FORMAT,
+    )
 
-# System Resources Section
-# Get alert definitions
-(cpu_alert, memory_alert, goroutine_alert, gc_duration_alert,
- disk_space_alert, load_avg_alert, network_saturation_alert, io_latency_alert) = create_system_alerts()
-
-cpu_panel = Graph(
-    title="CPU Usage Over Time",
-    dataSource="${datasource}",
-    targets=[
-        Target(
-            expr='system_cpu_usage_percent{job=~"$job", instance=~"$instance"} / 1000000',
-            legendFormat='CPU {{instance}}',
-            refId='A',
-        ),
-    ],
-    gridPos=GridPos(h=8, w=12, x=0, y=3),
-    yAxes=YAxes(
-        YAxis(format=PERCENT_FORMAT, min=0),
-        YAxis(format=SHORT_FORMAT)
-    ),
-    alert=cpu_alert,
-)
+    goroutines_stat = Stat(
+        title="Goroutines",
+        dataSource="${datasource}",
+        targets=[
+            Target(
+                expr='avg_over_time(go_goroutines[$__rate_interval])',
+                refId='A',
+            ),
+        ],
+        gridPos=GridPos(h=3, w=6, x=12, y=0),
+    )
 
-memory_panel = Graph(
-    title="Memory Usage Over Time",
-    dataSource="${datasource}",
-    targets=[
-        Target(
-            expr='system_memory_usage_bytes{job=~"$job", instance=~"$instance"}',
-            legendFormat='System Memory Usage {{instance}}',
-            refId='A',
-        ),
-        Target(
-            expr='rate(process_resident_memory_bytes{job=~"$job", instance=~"$instance"}[$rate_interval])',
-            legendFormat='Process Resident Memory {{instance}}',
-            refId='B',
-        ),
-        Target(
-            expr='rate(process_virtual_memory_bytes{job=~"$job", instance=~"$instance"}[$rate_interval])',
-            legendFormat='Process Virtual Memory {{instance}}',
-            refId='C',
-        ),
-    ],
-    gridPos=GridPos(h=8, w=12, x=12, y=3),
-    yAxes=YAxes(
-        YAxis(format=BYTES_FORMAT, min=0),
-        YAxis(format=SHORT_FORMAT)
-    ),
-    alert=memory_alert,
-)
+    threads_stat = Stat(
+        title="OS Threads",
+        dataSource="${datasource}",
+        targets=[
+            Target(
+                expr='avg_over_time(go_threads[$__rate_interval])',
+                refId='A',
+            ),
+        ],
+        gridPos=GridPos(h=3, w=6, x=18, y=0),
+    )
 
-# Network Section
-network_traffic = Graph(
-    title="Network Traffic (bytes/sec)", 
-    dataSource="${datasource}",
-    targets=[
-        Target(
-            expr='system_network_rx_bytes_per_second{job=~"$job", instance=~"$instance", interface="$interface"}',
-            legendFormat='Receive {{instance}}',
-            refId='A',
-        ),
-        Target(
-            expr='system_network_tx_bytes_per_second{job=~"$job", instance=~"$instance", interface="$interface"}',
-            legendFormat='Transmit {{instance}}',
-            refId='B',
-        ),
-    ],
-    gridPos=GridPos(h=8, w=12, x=0, y=11),
-    alert=network_saturation_alert,
-    yAxes=YAxes(
-        YAxis(format=BYTES_FORMAT, min=0),
-        YAxis(format=SHORT_FORMAT)
-    ),
-)
+    # System Resources Section
+    # Get alert definitions
+    (cpu_alert, memory_alert, goroutine_alert, gc_duration_alert,
+     disk_space_alert, load_avg_alert, network_saturation_alert, io_latency_alert,
+     memory_exhaustion_alert) = create_system_alerts()
+    # The goroutine, load average and memory exhaustion alerts have no
+    # panel; alert_rules.py exports them from create_system_alerts.
 
-network_packets = Graph(
-    title="Network Packets (packets/sec)",
-    dataSource="${datasource}",
-    targets=[
-        Target(
-            expr='system_network_rx_packets_per_second{job=~"$job", instance=~"$instance", interface="$interface"}',
-            legendFormat='Receive Packets {{instance}}',
-            refId='A',
-        ),
-        Target(
-            expr='system_network_tx_packets_per_second{job=~"$job", instance=~"$instance", interface="$interface"}',
-            legendFormat='Transmit Packets {{instance}}',
-            refId='B',
+    cpu_panel = Graph(
+        title="CPU Usage Over Time",
+        dataSource="${datasource}",
+        targets=[
+            Target(
+                expr='system_cpu_usage_percent / 1000000',
+                legendFormat='CPU {{instance}}',
+                refId='A',
+            ),
+        ],
+        gridPos=GridPos(h=8, w=12, x=0, y=3),
+        yAxes=YAxes(
+            YAxis(format=PERCENT_FORMAT, min=0),
+            YAxis(format=SHORT_FORMAT)
         ),
-    ],
-    gridPos=GridPos(h=8, w=12, x=12, y=11),
-)
+        alert=cpu_alert,
+    )
 
-# IO Section
-io_operations = Graph(
-    title="IO Operations",
-    dataSource="${datasource}",
-    targets=[
-        Target(
-            expr='rate(system_io_read_operations{job=~"$job", instance=~"$instance"}[$rate_interval])',
-            legendFormat='Read Ops/sec {{instance}}',
-            refId='A',
-        ),
-        Target(
-            expr='rate(system_io_write_operations{job=~"$job", instance=~"$instance"}[$rate_interval])',
-            legendFormat='Write Ops/sec {{instance}}',
-            refId='B',
+    memory_panel = Graph(
+        title="Memory Usage Over Time",
+        dataSource="${datasource}",
+        targets=[
+            Target(
+                expr='system_memory_usage_bytes',
+                legendFormat='System Memory Usage {{instance}}',
+                refId='A',
+            ),
+            Target(
+                expr='process_resident_memory_bytes',
+                legendFormat='Process Resident Memory {{instance}}',
+                refId='B',
+            ),
+            Target(
+                expr='process_virtual_memory_bytes',
+                legendFormat='Process Virtual Memory {{instance}}',
+                refId='C',
+            ),
+        ],
+        gridPos=GridPos(h=8, w=12, x=12, y=3),
+        yAxes=YAxes(
+            YAxis(format=BYTES_FORMAT, min=0),
+            YAxis(format=SHORT_FORMAT)
         ),
-    ],
-    gridPos=GridPos(h=8, w=12, x=0, y=19),
-    alert=io_latency_alert,
-)
+        alert=memory_alert,
+    )
 
-io_bytes = Graph(
-    title="IO Bytes",
-    dataSource="${datasource}",
-    targets=[
-        Target(
-            expr='rate(system_io_read_bytes{job=~"$job", instance=~"$instance"}[$rate_interval])',
-            legendFormat='Read Bytes/sec {{instance}}',
-            refId='A',
-        ),
-        Target(
-            expr='rate(system_io_write_bytes{job=~"$job", instance=~"$instance"}[$rate_interval])',
-            legendFormat='Write Bytes/sec {{instance}}',
-            refId='B',
+    # Network Section
+    network_traffic = Graph(
+        title="Network Traffic (bytes/sec)", 
+        dataSource="${datasource}",
+        targets=[
+            Target(
+                expr='system_network_rx_bytes_per_second{interface="$interface"}',
+                legendFormat='Receive {{instance}}',
+                refId='A',
+            ),
+            Target(
+                expr='system_network_tx_bytes_per_second{interface="$interface"}',
+                legendFormat='Transmit {{instance}}',
+                refId='B',
+            ),
+        ],
+        gridPos=GridPos(h=8, w=12, x=0, y=11),
+        alert=network_saturation_alert,
+        yAxes=YAxes(
+            YAxis(format=BYTES_FORMAT, min=0),
+            YAxis(format=SHORT_FORMAT)
         ),
-    ],
-    gridPos=GridPos(h=8, w=12, x=12, y=19),
-    yAxes=YAxes(
-        YAxis(format=BYTES_FORMAT, min=0),
-        YAxis(format=SHORT_FORMAT)
-    ),
-)
+    )
 
-# Go Runtime Section
-gc_metrics = Graph(
-    title="Garbage Collection",
-    dataSource="${datasource}",
-    targets=[
-        Target(
-            expr='rate(go_gc_duration_seconds_sum{job=~"$job", instance=~"$instance"}[$rate_interval])',
-            legendFormat='GC Duration {{instance}}',
-            refId='A',
-        ),
-        Target(
-            expr='go_gc_duration_seconds{job=~"$job", instance=~"$instance", quantile="0.75"}',
-            legendFormat='GC 75th %ile {{instance}}',
-            refId='B',
-        ),
-    ],
-    gridPos=GridPos(h=8, w=12, x=0, y=27),
-    alert=gc_duration_alert,
-)
+    network_packets = Graph(
+        title="Network Packets (packets/sec)",
+        dataSource="${datasource}",
+        targets=[
+            Target(
+                expr='system_network_rx_packets_per_second{interface="$interface"}',
+                legendFormat='Receive Packets {{instance}}',
+                refId='A',
+            ),
+            Target(
+                expr='system_network_tx_packets_per_second{interface="$interface"}',
+                legendFormat='Transmit Packets {{instance}}',
+                refId='B',
+            ),
+        ],
+        gridPos=GridPos(h=8, w=12, x=12, y=11),
+    )
+
+    # IO Section
+    io_operations = Graph(
+        title="IO Operations",
+        dataSource="${datasource}",
+        targets=[
+            Target(
+                expr='rate(system_io_read_operations[$__rate_interval])',
+                legendFormat='Read Ops/sec {{instance}}',
+                refId='A',
+            ),
+            Target(
+                expr='rate(system_io_write_operations[$__rate_interval])',
+                legendFormat='Write Ops/sec {{instance}}',
+                refId='B',
+            ),
+        ],
+        gridPos=GridPos(h=8, w=12, x=0, y=19),
+        alert=io_latency_alert,
+    )
 
-heap_metrics = Graph(
-    title="Go Heap Usage",
-    dataSource="${datasource}",
-    targets=[
-        Target(
-            expr='rate(go_memstats_heap_alloc_bytes{job=~"$job", instance=~"$instance"}[$rate_interval])',
-            legendFormat='Heap Allocated {{instance}}',
-            refId='A',
+    io_bytes = Graph(
+        title="IO Bytes",
+        dataSource="${datasource}",
+        targets=[
+            Target(
+                expr='rate(system_io_read_bytes[$__rate_interval])',
+                legendFormat='Read Bytes/sec {{instance}}',
+                refId='A',
+            ),
+            Target(
+                expr='rate(system_io_write_bytes[$__rate_interval])',
+                legendFormat='Write Bytes/sec {{instance}}',
+                refId='B',
+            ),
+        ],
+        gridPos=GridPos(h=8, w=12, x=12, y=19),
+        yAxes=YAxes(
+            YAxis(format=BYTES_FORMAT, min=0),
+            YAxis(format=SHORT_FORMAT)
         ),
-        Target(
-            expr='rate(go_memstats_heap_inuse_bytes{job=~"$job", instance=~"$instance"}[$rate_interval])',
-            legendFormat='Heap In Use {{instance}}',
-            refId='B',
+    )
+
+    # Go Runtime Section
+    gc_metrics = Graph(
+        title="Garbage Collection",
+        dataSource="${datasource}",
+        targets=[
+            Target(
+                expr='rate(go_gc_duration_seconds_sum[$__rate_interval])',
+                legendFormat='GC Duration {{instance}}',
+                refId='A',
+            ),
+            Target(
+                expr='go_gc_duration_seconds{quantile="0.75"}',
+                legendFormat='GC 75th %ile {{instance}}',
+                refId='B',
+            ),
+        ],
+        gridPos=GridPos(h=8, w=12, x=0, y=27),
+        alert=gc_duration_alert,
+    )
+
+    heap_metrics = Graph(
+        title="Go Heap Usage",
+        dataSource="${datasource}",
+        targets=[
+            Target(
+                expr='go_memstats_heap_alloc_bytes',
+                legendFormat='Heap Allocated {{instance}}',
+                refId='A',
+            ),
+            Target(
+                expr='go_memstats_heap_inuse_bytes',
+                legendFormat='Heap In Use {{instance}}',
+                refId='B',
+            ),
+            Target(
+                expr='go_memstats_heap_idle_bytes',
+                legendFormat='Heap Idle {{instance}}',
+                refId='C',
+            ),
+        ],
+        gridPos=GridPos(h=8, w=12, x=12, y=27),
+        yAxes=YAxes(
+            YAxis(format=BYTES_FORMAT, min=0),
+            YAxis(format=SHORT_FORMAT)
         ),
-        Target(
-            expr='rate(go_memstats_heap_idle_bytes{job=~"$job", instance=~"$instance"}[$rate_interval])',
-            legendFormat='Heap Idle {{instance}}',
-            refId='C',
+    )
+
+    # Capacity Section
+    filesystem_eta = Graph(
+        title="Filesystem Time to Full",
+        description="When each filesystem fills up if it keeps growing as over "
+                    "the last 6 hours",
+        dataSource="${datasource}",
+        targets=[
+            Target(
+                expr='{} > 0'.format(FILESYSTEM_ETA),
+                legendFormat='{{instance}} {{mountpoint}}',
+                refId='A',
+            ),
+        ],
+        gridPos=GridPos(h=8, w=24, x=0, y=36),
+        yAxes=YAxes(
+            YAxis(format=SECONDS_FORMAT, min=0),
+            YAxis(format=SHORT_FORMAT)
         ),
-    ],
-    gridPos=GridPos(h=8, w=12, x=12, y=27),
-    yAxes=YAxes(
-        YAxis(format=BYTES_FORMAT, min=0),
-        YAxis(format=SHORT_FORMAT)
-    ),
-)
+        alert=disk_space_alert,
+    )
+
+    filesystem_forecast = forecast_table(
+        "Filesystem Forecast",
+        growth='-' + FILESYSTEM_GROWTH,
+        eta=FILESYSTEM_ETA,
+        gridPos=GridPos(h=8, w=12, x=0, y=44),
+    )
+
+    memory_forecast = forecast_table(
+        "Memory Forecast",
+        growth=MEMORY_GROWTH,
+        eta=MEMORY_ETA,
+        gridPos=GridPos(h=8, w=12, x=12, y=44),
+    )
+
+    dashboard = Dashboard(
+        title="System Metrics Dashboard",
+        description="Comprehensive system metrics from Prometheus",
+        tags=['system', 'golang'],
+        timezone="browser",
+        templating=templating,
+        panels=layout([
+            Section(None, [cpu_stat, memory_stat, goroutines_stat, threads_stat]),
+            Section("System Resources", [cpu_panel, memory_panel],
+                    collapsed=COLLAPSED_SECTIONS["System Resources"]),
+            Section("Network", [network_traffic, network_packets],
+                    collapsed=COLLAPSED_SECTIONS["Network"]),
+            Section("IO", [io_operations, io_bytes],
+                    collapsed=COLLAPSED_SECTIONS["IO"]),
+            Section("Go Runtime", [gc_metrics, heap_metrics],
+                    collapsed=COLLAPSED_SECTIONS["Go Runtime"]),
+            Section("Capacity", [filesystem_eta, filesystem_forecast, memory_forecast],
+                    collapsed=COLLAPSED_SECTIONS["Capacity"]),
+            Section("Fleet", fleet_panels(FLEET_SUMMARY),
+                    collapsed=COLLAPSED_SECTIONS["Fleet"]),
+        ]),
+        time=Time("now-3h", "now"),
+        timePicker=DEFAULT_TIME_PICKER,
+        refresh="10s",
+    ).auto_panel_ids()
+    return apply_passes(dashboard, params, RATE_WINDOWS, INSTANCE_METRIC,
+                        recorded=create_system_recording_rules())
+
 
-dashboard = Dashboard(
-    title="System Metrics Dashboard",
-    description="Comprehensive system metrics from Prometheus",
-    tags=['system', 'golang'],
-    timezone="browser",
-    templating=templating,
-    panels=[
-        # Stats Row
-        cpu_stat, memory_stat, goroutines_stat, threads_stat,
-        # System Resources
-        cpu_panel, memory_panel,
-        # Network
-        network_traffic, network_packets,
-        # IO
-        io_operations, io_bytes,
-        # Go Runtime
-        gc_metrics, heap_metrics
-    ],
-    time=Time("now-3h", "now"),
-    timePicker=DEFAULT_TIME_PICKER,
-    refresh="10s",
-).auto_panel_ids()
+# Built on first access of ``dashboard``
+__getattr__ = lazy_dashboard(create_system_dashboard)
@@ -0,0 +1,64 @@
+"""Tests for ``dedup.py`` query sharing.
+
+Run with ``python -m unittest test_dedup`` (or ``python -m pytest``).
+"""
+
+import os
+import unittest
+
+from grafanalib.core import Dashboard, Graph, Target
+
+import dedup
+from dashboard_utils import iter_panels, load_dashboard
+
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def panel(dashboard, title):
+    return [p for p in iter_panels(dashboard) if p.title == title][0]
+
+
+def graph(title, *exprs):
+    return Graph(title=title, dataSource='prometheus', targets=[
+        Target(expr=expr, refId=ref_id) for ref_id, expr in zip('ABC', exprs)])
+
+
+class DedupeTest(unittest.TestCase):
+
+    def test_threads_connected_shared(self):
+        dashboard = load_dashboard(os.path.join(ROOT, 'mysql.dashboard.py'))
+        source = panel(dashboard, 'MySQL Connections')
+        threads = panel(dashboard, 'Thread Activity')
+        self.assertEqual(threads.dataSource, dedup.MIXED_DATASOURCE)
+        shared = [t.to_json_data() for t in threads.targets if not t.expr]
+        self.assertEqual(len(shared), 1)
+        self.assertEqual(shared[0]['datasource'], dedup.DASHBOARD_DATASOURCE)
+        self.assertEqual(shared[0]['panelId'], source.id)
+        self.assertEqual(len([t for t in threads.targets if t.expr]), 2)
+        self.assertNotIn('threads_connected',
+                         ' '.join(t.expr for t in threads.targets))
+
+    def test_whole_panel_shared(self):
+        dashboard = dedup.dedupe_queries(Dashboard(title='t', panels=[
+            graph('Source', 'up', 'rate(x[5m])'),
+            graph('Copy', 'rate(x[5m])'),
+        ]))
+        copy = panel(dashboard, 'Copy')
+        self.assertEqual(copy.dataSource, dedup.DASHBOARD_DATASOURCE)
+        self.assertEqual(copy.transformations[0]['options']['include'], 'B')
+        self.assertEqual(dedup.query_count(dashboard), 2)
+
+    def test_filtered_frame_not_reused_as_own_query(self):
+        # The source's unneeded "B" frame would be let through by the
+        # panel's own "B" query, so nothing is shared.
+        dashboard = dedup.dedupe_queries(Dashboard(title='t', panels=[
+            graph('Source', 'up', 'rate(x[5m])'),
+            graph('Other', 'up', 'rate(y[5m])'),
+        ]))
+        self.assertEqual(panel(dashboard, 'Other').dataSource, 'prometheus')
+        self.assertEqual(dedup.query_count(dashboard), 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+"""Tests for ``fleet.py`` manifests, including sharded entries.
+
+Run with ``python -m unittest test_fleet`` (or ``python -m pytest``).
+"""
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import fleet
+
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def template(dashboard, name):
+    return [t for t in dashboard['templating']['list'] if t['name'] == name][0]
+
+
+class GenerateTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def generate(self, *entries):
+        results = list(fleet.generate(entries, self.dir, root=ROOT))
+        for r in results:
+            self.assertTrue(r.ok, r.error)
+        return [os.path.basename(r.output) for r in results]
+
+    def load(self, name):
+        with open(os.path.join(self.dir, name)) as f:
+            return json.load(f)
+
+    def check_index(self, name, shards):
+        index = self.load(name)
+        self.assertIn('shard-index', index['tags'])
+        expr = index['panels'][0]['targets'][0]['expr']
+        for shard in shards:
+            self.assertIn('"shard", "{}"'.format(shard), expr)
+
+    def test_unsharded(self):
+        self.assertEqual(self.generate({'dashboard': 'redis', 'cluster': 'eu-1'}),
+                         ['redis-eu-1.json'])
+        self.assertEqual(self.load('redis-eu-1.json')['title'], 'Redis Monitoring (eu-1)')
+
+    def test_shard_by_environment(self):
+        outputs = self.generate({'dashboard': 'mysql', 'cluster': 'eu-1',
+                                 'shard_by': 'environment', 'shards': ['prod', 'staging']})
+        self.assertEqual(outputs, ['mysql-eu-1-prod.json', 'mysql-eu-1-staging.json',
+                                   'mysql-eu-1-index.json'])
+        environment = template(self.load('mysql-eu-1-staging.json'), 'environment')
+        self.assertEqual(environment['regex'], '/^(staging)$/')
+        self.check_index('mysql-eu-1-index.json', ['prod', 'staging'])
+
+    def test_shard_by_job(self):
+        # CSV manifests separate list items with "|".
+        outputs = self.generate({'dashboard': 'system_metrics', 'cluster': 'us-1',
+                                 'shard_by': 'job', 'shards': 'api|worker'})
+        self.assertEqual(outputs, ['system_metrics-us-1-api.json',
+                                   'system_metrics-us-1-worker.json',
+                                   'system_metrics-us-1-index.json'])
+        job = template(self.load('system_metrics-us-1-worker.json'), 'job')
+        self.assertEqual(job['regex'], '/^(worker)$/')
+        self.check_index('system_metrics-us-1-index.json', ['api', 'worker'])
+
+    def test_shard_by_hash(self):
+        instances = ['redis-{}:9121'.format(i) for i in range(8)]
+        outputs = self.generate({'dashboard': 'redis', 'cluster': 'eu-1', 'shard_by': 'hash',
+                                 'buckets': 4, 'instances': instances})
+        self.assertEqual(outputs[-1], 'redis-eu-1-index.json')
+        covered = []
+        for name in outputs[:-1]:
+            regex = template(self.load(name), 'instance')['regex']
+            covered.extend(regex[len('/^('):-len(')$/')].replace('\\', '').split('|'))
+        self.assertEqual(sorted(covered), instances)
+        self.check_index('redis-eu-1-index.json',
+                         [name[len('redis-eu-1-'):-len('.json')] for name in outputs[:-1]])
+
+    def test_shard_errors(self):
+        entries = [
+            {'dashboard': 'system_metrics', 'cluster': 'eu-1',
+             'shard_by': 'environment', 'shards': ['prod']},
+            {'dashboard': 'mysql', 'cluster': 'eu-1', 'shard_by': 'region', 'shards': ['a']},
+            {'dashboard': 'redis', 'cluster': 'eu-1', 'shard_by': 'hash', 'buckets': 2},
+        ]
+        results = list(fleet.generate(entries, self.dir, root=ROOT))
+        self.assertEqual([r.ok for r in results], [False, False, False])
+        self.assertIn('dashboard has no environment variable', results[0].error)
+        self.assertIn("unknown shard_by 'region'", results[1].error)
+        self.assertIn('needs buckets and instances', results[2].error)
+
+
+if __name__ == '__main__':
+    unittest.main()
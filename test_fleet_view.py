@@ -0,0 +1,60 @@
+"""Tests for the ``fleet_view.py`` series limit.
+
+Run with ``python -m unittest test_fleet_view`` (or ``python -m pytest``).
+"""
+
+import unittest
+
+import fleet_view
+from promql_eval import Evaluator, substitute
+from tsdb import MemoryTSDB
+
+
+INSTANCES = 8
+LIMIT = 3
+STEP = 60
+END = 3600
+VARIABLES = {
+    fleet_view.LIMIT_VARIABLE: LIMIT,
+    '__range': '1h',
+    '__interval': '1m',
+}
+
+
+def rotating_db():
+    """Instances whose ranking changes at every step."""
+    db = MemoryTSDB()
+    for i in range(INSTANCES):
+        series = db.series({'__name__': 'mysql_global_status_threads_connected',
+                            'instance': 'db-{}:9104'.format(i)})
+        for step in range(END // STEP + 1):
+            series.append(step * STEP, float((i + step) % INSTANCES) + i * 0.01)
+    return db
+
+
+class LimitExprTest(unittest.TestCase):
+
+    def query_range(self, expr):
+        return Evaluator(rotating_db()).query_range(
+            substitute(expr, VARIABLES), 0, END, STEP)
+
+    def test_ranking_changes_between_steps(self):
+        per_step = 'topk(${}, mysql_global_status_threads_connected)'.format(
+            fleet_view.LIMIT_VARIABLE)
+        self.assertEqual(len(self.query_range(per_step)), INSTANCES)
+
+    def test_series_bounded_over_range(self):
+        for bottom in (False, True):
+            expr = fleet_view.limit_expr('mysql_global_status_threads_connected', bottom)
+            result = self.query_range(expr)
+            self.assertLessEqual(len(result), LIMIT)
+            for points in result.values():
+                self.assertEqual(len(points), END // STEP + 1)
+
+    def test_aggregated_unchanged(self):
+        expr = 'sum(mysql_global_status_threads_connected)'
+        self.assertEqual(fleet_view.limit_expr(expr), expr)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+"""Tests for ``upload.py`` against the mock Grafana server.
+
+Run with ``python -m unittest test_upload`` (or ``python -m pytest``).
+"""
+
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import mock_grafana
+import upload
+
+
+# Share of requests the mock answers with 503.
+FAIL_RATE = 0.2
+
+
+def write_dashboard(directory, name, title):
+    path = os.path.join(directory, name + '.json')
+    with open(path, 'w') as f:
+        json.dump({'title': title, 'panels': [], 'schemaVersion': 12}, f)
+    return path
+
+
+class UploadTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = mock_grafana.serve(fail_rate=FAIL_RATE)
+        self.url = 'http://127.0.0.1:{}'.format(self.server.server_address[1])
+        self.dir = tempfile.mkdtemp()
+        self.paths = [write_dashboard(self.dir, 'mysql-eu-1', 'MySQL'),
+                      write_dashboard(self.dir, 'redis-eu-1', 'Redis')]
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.dir)
+
+    def client(self, **kwargs):
+        kwargs.setdefault('retries', 12)
+        kwargs.setdefault('backoff', 0.001)
+        client = upload.GrafanaClient(self.url, jobs=2, **kwargs)
+        self.addCleanup(client.close)
+        return client
+
+    def upload(self, **kwargs):
+        results = upload.upload(self.client(), self.paths, jobs=2, **kwargs)
+        for r in results:
+            self.assertIsNone(r.error)
+        return results
+
+    def test_create_then_unchanged(self):
+        results = self.upload(default_folder='Databases')
+        self.assertEqual([r.status for r in results], ['created', 'created'])
+        self.assertEqual([r.uid for r in results], ['mysql-eu-1', 'redis-eu-1'])
+        self.assertEqual(sorted(self.server.state.dashboards), ['mysql-eu-1', 'redis-eu-1'])
+
+        results = self.upload(default_folder='Databases')
+        self.assertEqual([r.status for r in results], ['unchanged', 'unchanged'])
+        self.assertEqual([r.version for r in results], [1, 1])
+
+    def test_folder_change_updates(self):
+        self.upload(default_folder='Databases')
+        results = self.upload(folder_map={'redis-*': 'Caches'}, default_folder='Databases')
+        self.assertEqual([r.status for r in results], ['unchanged', 'updated'])
+        self.assertEqual(results[1].version, 2)
+        self.assertEqual(results[1].changes[0].path, ['folder'])
+        _, folder_uid, _ = self.server.state.dashboards['redis-eu-1']
+        self.assertEqual(self.server.state.folders[folder_uid], 'Caches')
+
+    def test_published_dir_and_diff(self):
+        published = os.path.join(self.dir, 'published')
+        self.upload(published_dir=published)
+        self.assertEqual(sorted(os.listdir(published)), ['mysql-eu-1.json', 'redis-eu-1.json'])
+        with open(os.path.join(published, 'mysql-eu-1.json')) as f:
+            self.assertEqual(json.load(f)['meta']['version'], 1)
+
+        write_dashboard(self.dir, 'mysql-eu-1', 'MySQL Overview')
+        results = self.upload(published_dir=published)
+        self.assertEqual([r.status for r in results], ['updated', 'unchanged'])
+        with open(os.path.join(published, 'mysql-eu-1.json')) as f:
+            saved = json.load(f)
+        self.assertEqual(saved['dashboard']['title'], 'MySQL Overview')
+        self.assertEqual(saved['meta']['version'], 2)
+
+        out = io.StringIO()
+        upload.summarize(results, out, show_diff=True)
+        self.assertIn('MySQL Overview', out.getvalue())
+        self.assertIn('1 updated, 1 unchanged, 0 failed', out.getvalue())
+
+    def test_retry_after(self):
+        self.server.fail_rate = 1.0
+        self.server.retry_after = 3
+        client = self.client(retries=2)
+        with mock.patch.object(upload.time, 'sleep') as sleep:
+            with self.assertRaises(upload.GrafanaError) as e:
+                client.folders()
+        self.assertEqual(e.exception.status, 503)
+        self.assertEqual([c[0][0] for c in sleep.call_args_list], [3.0, 3.0])
+        self.assertEqual(self.server.state.requests, 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
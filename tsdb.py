@@ -0,0 +1,98 @@
+"""In-memory time series storage for offline query evaluation.
+
+This is a stand-in for Prometheus used by the benchmark and the alert
+tests: series are held in memory, selected by label matchers and read
+sample by sample so the evaluator can count the samples a query touches.
+"""
+
+import bisect
+import re
+from array import array
+
+import attr
+
+
+def label_key(labels):
+    """A hashable, order-independent form of a label dict."""
+    return tuple(sorted(labels.items()))
+
+
+@attr.s
+class Series(object):
+    labels = attr.ib()
+    timestamps = attr.ib(default=attr.Factory(lambda: array('d')))
+    values = attr.ib(default=attr.Factory(lambda: array('d')))
+
+    @property
+    def metric(self):
+        return self.labels.get('__name__')
+
+    def append(self, timestamp, value):
+        self.timestamps.append(timestamp)
+        self.values.append(value)
+
+    def window(self, start, end):
+        """Index range of samples with ``start < t <= end``."""
+        lo = bisect.bisect_right(self.timestamps, start)
+        hi = bisect.bisect_right(self.timestamps, end)
+        return lo, hi
+
+
+def _compile(matcher):
+    if matcher.op in ('=~', '!~'):
+        regex = re.compile('^(?:{})$'.format(matcher.value))
+        if matcher.op == '=~':
+            return lambda v: regex.match(v) is not None
+        return lambda v: regex.match(v) is None
+    if matcher.op == '=':
+        return lambda v: v == matcher.value
+    return lambda v: v != matcher.value
+
+
+class MemoryTSDB(object):
+    """Series indexed by metric name."""
+
+    def __init__(self):
+        self._series = {}
+        self._by_metric = {}
+
+    def __len__(self):
+        return len(self._series)
+
+    def series(self, labels):
+        """Return the series for ``labels``, creating it if needed."""
+        key = label_key(labels)
+        series = self._series.get(key)
+        if series is None:
+            series = Series(dict(labels))
+            self._series[key] = series
+            self._by_metric.setdefault(labels.get('__name__'), []).append(series)
+        return series
+
+    def add(self, labels, timestamp, value):
+        self.series(labels).append(timestamp, value)
+
+    def metrics(self):
+        return sorted(m for m in self._by_metric if m)
+
+    def select(self, metric, matchers):
+        """Return the series of ``metric`` matching every matcher.
+
+        ``matchers`` are ``promql.Matcher`` objects; a matcher on
+        ``__name__`` may replace ``metric``.
+        """
+        checks = []
+        for m in matchers:
+            if m.label == '__name__' and m.op == '=' and metric is None:
+                metric = m.value
+            else:
+                checks.append((m.label, _compile(m)))
+        if metric is not None:
+            candidates = self._by_metric.get(metric, [])
+        else:
+            candidates = list(self._series.values())
+        return [s for s in candidates
+                if all(check(s.labels.get(label, '')) for label, check in checks)]
+
+    def samples(self):
+        return sum(len(s.values) for s in self._series.values())
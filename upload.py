@@ -0,0 +1,374 @@
+#!/usr/bin/env python
+"""Upload generated dashboard JSON to Grafana.
+
+Dashboards are posted to ``/api/dashboards/db`` by a thread pool sharing a
+pool of keep-alive HTTP connections, so each worker reuses its connection
+instead of opening one per dashboard. Requests failing with a connection
+error, ``429`` or ``5xx`` are retried with exponential backoff.
+
+Dashboards without a uid get one derived from the file name, so uploading
+again replaces them instead of creating copies. Folders are looked up by
+title, and created if missing, before the upload starts; ``--folder-map``
+assigns folders by file name pattern::
+
+    # folders.yml
+    "mysql-*": MySQL
+    "redis-*": Redis
+
+Dashboards that have not changed since they were last published are not
+uploaded again, so their version history stays clean. The published
+version is fetched from Grafana, or read from ``--published-dir`` where
+the uploader keeps a copy of everything it pushed; the comparison
+ignores panel ids and other fields Grafana assigns (see
+``dashboard_diff.py``). ``--diff`` prints what changed, ``--force``
+uploads everything.
+
+Usage::
+
+    GRAFANA_TOKEN=... python upload.py --url https://grafana.example.com out/fleet/*.json
+    python mock_grafana.py --port 3001 &  # local server for trying it out
+"""
+
+import argparse
+import collections
+import concurrent.futures
+import fnmatch
+import http.client
+import json
+import os
+import queue
+import random
+import re
+import sys
+import threading
+import time
+import urllib.parse
+
+import attr
+import yaml
+
+from dashboard_diff import Change, diff, write_changes
+
+
+DEFAULT_JOBS = 8
+DEFAULT_RETRIES = 4
+# Status codes worth retrying; others are reported as failures.
+RETRY_STATUS = frozenset([429, 500, 502, 503, 504])
+
+
+class GrafanaError(Exception):
+    """A Grafana API request failed."""
+
+    def __init__(self, message, status=None):
+        super(GrafanaError, self).__init__(message)
+        self.status = status
+
+
+class ConnectionPool(object):
+    """Keep-alive connections to one host, shared by worker threads."""
+
+    def __init__(self, url, size, timeout=30):
+        parts = urllib.parse.urlsplit(url)
+        self.scheme = parts.scheme or 'http'
+        self.host = parts.hostname
+        self.port = parts.port
+        self.prefix = parts.path.rstrip('/')
+        self.timeout = timeout
+        self.idle = queue.LifoQueue()
+        self.opened = 0
+        self._lock = threading.Lock()
+        for _ in range(size):
+            self.idle.put(None)
+
+    def _connect(self):
+        with self._lock:
+            self.opened += 1
+        cls = (http.client.HTTPSConnection if self.scheme == 'https'
+               else http.client.HTTPConnection)
+        return cls(self.host, self.port, timeout=self.timeout)
+
+    def request(self, method, path, body=None, headers=None):
+        """Send a request; return ``(status, headers, body)``."""
+        conn = self.idle.get() or self._connect()
+        try:
+            conn.request(method, self.prefix + path, body=body, headers=headers or {})
+            response = conn.getresponse()
+            data = response.read()
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            self.idle.put(None)
+            raise
+        if response.getheader('Connection', '').lower() == 'close':
+            conn.close()
+            conn = None
+        self.idle.put(conn)
+        return response.status, response, data
+
+    def close(self):
+        while not self.idle.empty():
+            conn = self.idle.get()
+            if conn is not None:
+                conn.close()
+
+
+class GrafanaClient(object):
+    """The parts of the Grafana HTTP API the uploader needs."""
+
+    def __init__(self, url, token=None, jobs=DEFAULT_JOBS, retries=DEFAULT_RETRIES,
+                 backoff=0.5):
+        self.pool = ConnectionPool(url, jobs)
+        self.headers = {'Content-Type': 'application/json', 'Accept': 'application/json'}
+        if token:
+            self.headers['Authorization'] = 'Bearer ' + token
+        self.retries = retries
+        self.backoff = backoff
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def call(self, method, path, payload=None):
+        """Send a request with retries; return the decoded JSON response."""
+        body = json.dumps(payload).encode('utf-8') if payload is not None else None
+        for attempt in range(self.retries + 1):
+            delay = self.backoff * 2 ** attempt * random.uniform(0.5, 1.5)
+            with self._lock:
+                self.requests += 1
+            try:
+                status, response, data = self.pool.request(method, path, body, self.headers)
+            except (OSError, http.client.HTTPException) as e:
+                if attempt == self.retries:
+                    raise GrafanaError('{} {}: {}'.format(method, path, e))
+                time.sleep(delay)
+                continue
+            if status in RETRY_STATUS and attempt < self.retries:
+                retry_after = response.getheader('Retry-After')
+                if retry_after and retry_after.isdigit():
+                    delay = float(retry_after)
+                time.sleep(delay)
+                continue
+            if status >= 400:
+                raise GrafanaError('{} {}: HTTP {} {}'.format(
+                    method, path, status, data.decode('utf-8', 'replace')[:200]), status)
+            return json.loads(data.decode('utf-8')) if data else None
+
+    def folders(self):
+        """``{title: uid}`` of the existing folders."""
+        return dict((f['title'], f['uid']) for f in self.call('GET', '/api/folders?limit=1000'))
+
+    def create_folder(self, title):
+        return self.call('POST', '/api/folders', {'title': title})['uid']
+
+    def get_dashboard(self, uid):
+        """``{'dashboard': ..., 'meta': ...}`` for ``uid``, or ``None``."""
+        try:
+            return self.call('GET', '/api/dashboards/uid/{}'.format(urllib.parse.quote(uid)))
+        except GrafanaError as e:
+            if e.status == 404:
+                return None
+            raise
+
+    def save_dashboard(self, dashboard, folder_uid=None, message=None):
+        payload = {'dashboard': dashboard, 'overwrite': True}
+        if folder_uid:
+            payload['folderUid'] = folder_uid
+        if message:
+            payload['message'] = message
+        return self.call('POST', '/api/dashboards/db', payload)
+
+    def close(self):
+        self.pool.close()
+
+
+@attr.s
+class UploadResult(object):
+    path = attr.ib()
+    uid = attr.ib(default=None)
+    folder = attr.ib(default=None)
+    status = attr.ib(default=None)  # created, updated, unchanged or failed
+    version = attr.ib(default=None)
+    seconds = attr.ib(default=0.0)
+    error = attr.ib(default=None)
+    changes = attr.ib(default=attr.Factory(list))
+
+
+def file_uid(path):
+    """A uid for a dashboard file without one: its sanitized base name."""
+    name = os.path.basename(path)
+    if name.endswith('.json'):
+        name = name[:-len('.json')]
+    return re.sub(r'[^a-zA-Z0-9_-]+', '-', name)[:40]
+
+
+def folder_for(path, folder_map, default=None):
+    """The folder title for ``path`` from the first matching pattern."""
+    name = os.path.basename(path)
+    for pattern, folder in folder_map.items():
+        if fnmatch.fnmatch(name, pattern):
+            return folder
+    return default
+
+
+def load_dashboard_file(path):
+    with open(path) as f:
+        data = json.load(f)
+    # Grafana assigns ids; a stale id from another instance would clash.
+    data['id'] = None
+    if not data.get('uid'):
+        data['uid'] = file_uid(path)
+    return data
+
+
+def published_path(published_dir, uid):
+    return os.path.join(published_dir, '{}.json'.format(uid))
+
+
+def load_published(client, uid, published_dir=None):
+    """The last published version of ``uid`` in the API's format, or ``None``."""
+    if published_dir is None:
+        return client.get_dashboard(uid)
+    try:
+        with open(published_path(published_dir, uid)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def save_published(published_dir, data, folder_uid, version):
+    path = published_path(published_dir, data['uid'])
+    with open(path + '.tmp', 'w') as f:
+        json.dump({'dashboard': data,
+                   'meta': {'folderUid': folder_uid or '', 'version': version}}, f)
+    os.replace(path + '.tmp', path)
+
+
+def published_changes(published, data, folder_uid):
+    """``Change`` list between ``published`` and dashboard ``data``."""
+    changes = diff(published['dashboard'], data)
+    old_folder = published.get('meta', {}).get('folderUid') or None
+    if old_folder != (folder_uid or None):
+        changes.insert(0, Change(['folder'], old_folder, folder_uid))
+    return changes
+
+
+def upload_one(client, path, folder, folder_uid, message=None, force=False,
+               published_dir=None):
+    start = time.perf_counter()
+    result = UploadResult(path, folder=folder)
+    try:
+        data = load_dashboard_file(path)
+        result.uid = data['uid']
+        published = None if force else load_published(client, result.uid, published_dir)
+        if published is not None:
+            result.version = published.get('meta', {}).get('version')
+            result.changes = published_changes(published, data, folder_uid)
+            if not result.changes:
+                result.status = 'unchanged'
+                result.seconds = time.perf_counter() - start
+                return result
+        response = client.save_dashboard(data, folder_uid, message)
+        result.version = response.get('version')
+        result.status = 'created' if result.version == 1 else 'updated'
+        if published_dir is not None:
+            save_published(published_dir, data, folder_uid, result.version)
+    except (GrafanaError, OSError, ValueError) as e:
+        result.status = 'failed'
+        result.error = str(e)
+    result.seconds = time.perf_counter() - start
+    return result
+
+
+def resolve_folders(client, titles):
+    """``{title: uid}`` for ``titles``, creating the missing folders."""
+    titles = set(t for t in titles if t)
+    if not titles:
+        return {}
+    existing = client.folders()
+    return dict((t, existing.get(t) or client.create_folder(t)) for t in titles)
+
+
+def upload(client, paths, folder_map=None, default_folder=None, jobs=DEFAULT_JOBS,
+           message=None, force=False, published_dir=None):
+    """Upload ``paths`` concurrently; return an ``UploadResult`` per path.
+
+    Unless ``force`` is set, dashboards equal to their last published
+    version are skipped.
+    """
+    folders = dict((p, folder_for(p, folder_map or {}, default_folder)) for p in paths)
+    folder_uids = resolve_folders(client, folders.values())
+    if published_dir is not None:
+        os.makedirs(published_dir, exist_ok=True)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as pool:
+        futures = [pool.submit(upload_one, client, p, folders[p],
+                               folder_uids.get(folders[p]), message, force,
+                               published_dir) for p in paths]
+        return [f.result() for f in futures]
+
+
+def summarize(results, stream, show_diff=False):
+    counts = collections.Counter(r.status for r in results)
+    for r in results:
+        if r.status == 'failed':
+            stream.write('FAILED   {}: {}\n'.format(r.path, r.error))
+            continue
+        stream.write('{:<9} {} -> {}{} (version {})\n'.format(
+            r.status, r.path, '{}/'.format(r.folder) if r.folder else '',
+            r.uid, r.version))
+        if show_diff:
+            write_changes(r.changes, stream)
+    stream.write(', '.join('{} {}'.format(counts[s], s) for s in
+                           ('created', 'updated', 'unchanged', 'failed')) + '\n')
+
+
+def main(args):
+    parser = argparse.ArgumentParser(prog='upload')
+    parser.add_argument('files', metavar='JSON', nargs='+', help='Dashboard JSON files')
+    parser.add_argument(
+        '--url', default=os.environ.get('GRAFANA_URL', 'http://localhost:3000'),
+        help='Grafana URL (default: $GRAFANA_URL or %(default)s)',
+    )
+    parser.add_argument(
+        '--token', default=os.environ.get('GRAFANA_TOKEN'),
+        help='API token (default: $GRAFANA_TOKEN)',
+    )
+    parser.add_argument('--folder', help='Folder for dashboards not in --folder-map')
+    parser.add_argument('--folder-map', help='YAML mapping of file name patterns to folders')
+    parser.add_argument(
+        '--jobs', '-j', type=int, default=DEFAULT_JOBS,
+        help='Concurrent uploads (default: %(default)s)',
+    )
+    parser.add_argument(
+        '--retries', type=int, default=DEFAULT_RETRIES,
+        help='Retries per request (default: %(default)s)',
+    )
+    parser.add_argument('--message', help='Version history message')
+    parser.add_argument(
+        '--published-dir',
+        help='Compare with and keep copies of published dashboards here '
+             'instead of fetching them from Grafana',
+    )
+    parser.add_argument('--force', action='store_true', help='Upload unchanged dashboards too')
+    parser.add_argument('--diff', action='store_true', help='Print the changes per dashboard')
+    opts = parser.parse_args(args)
+
+    folder_map = {}
+    if opts.folder_map:
+        with open(opts.folder_map) as f:
+            folder_map = yaml.safe_load(f) or {}
+
+    client = GrafanaClient(opts.url, opts.token, opts.jobs, opts.retries)
+    start = time.perf_counter()
+    try:
+        results = upload(client, opts.files, folder_map, opts.folder, opts.jobs,
+                         opts.message, opts.force, opts.published_dir)
+    except GrafanaError as e:
+        sys.stderr.write('ERROR: {}\n'.format(e))
+        return 1
+    finally:
+        client.close()
+    summarize(results, sys.stdout, opts.diff)
+    sys.stderr.write('{} requests over {} connections in {:.2f}s\n'.format(
+        client.requests, client.pool.opened, time.perf_counter() - start))
+    return 1 if any(r.status == 'failed' for r in results) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
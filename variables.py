@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+"""Template variable definitions and the cost of resolving them.
+
+``query_variable`` builds a ``label_values`` variable whose selector is
+scoped by the variables above it, so picking a job narrows the series
+the instance lookup reads::
+
+    query_variable('instance', 'mysql_up', scope=['job', 'environment'])
+
+queries ``label_values(mysql_up{job=~"$job", environment=~"$environment"}, instance)``.
+Variables refresh when the dashboard loads; pass
+``refresh=REFRESH_ON_TIME_RANGE_CHANGE`` for values that should follow the
+selected time range, such as instances of a churning fleet.
+
+Run as a script to report the series each variable lookup touches on a
+synthetic fleet (see ``bench.py``), with every variable set to "All" and
+with a single value selected::
+
+    python variables.py -n 200
+"""
+
+import argparse
+import sys
+
+from grafanalib.core import (
+    REFRESH_ON_DASHBOARD_LOAD, SORT_ALPHA_IGNORE_CASE_ASC, Template,
+)
+
+import promql
+from dashboard_utils import dashboard_name, find_dashboards, load_module
+
+
+DATASOURCE = '${datasource}'
+
+# Grafana lists query_result() values as ``{} <value> <timestamp>``.
+RESULT_REGEX = r'/^\{\} (\d+) /'
+
+
+def scoped_selector(metric, scope):
+    """``metric`` matching each variable in ``scope`` with ``=~``."""
+    return str(promql.VectorSelector(metric=metric, matchers=[
+        promql.Matcher(label, '=~', '$' + label) for label in scope
+    ]))
+
+
+def query_variable(name, metric, label=None, scope=(), title=None, regex=None,
+                   sort=SORT_ALPHA_IGNORE_CASE_ASC, refresh=REFRESH_ON_DASHBOARD_LOAD,
+                   **kwargs):
+    """A ``label_values`` query variable.
+
+    :param name: variable name
+    :param metric: metric to read label values from; prefer one with a
+        single series per target, such as ``up``
+    :param label: label to list (default: ``name``)
+    :param scope: names of variables whose selection narrows the lookup;
+        each must be defined before this one
+    :param title: display label
+    :param regex: Grafana regex filtering the values, e.g. ``/^(?!lo$)/``
+    """
+    return Template(
+        name=name,
+        label=title,
+        dataSource=DATASOURCE,
+        query='label_values({}, {})'.format(scoped_selector(metric, scope), label or name),
+        type='query',
+        regex=regex,
+        sort=sort,
+        refresh=refresh,
+        **kwargs
+    )
+
+
+def result_variable(name, expr, refresh=REFRESH_ON_DASHBOARD_LOAD):
+    """A hidden variable holding the value of ``expr``, computed by Prometheus.
+
+    ``expr`` must return a single series without labels, whose value is
+    kept as a whole number.
+    """
+    return Template(
+        name=name,
+        dataSource=DATASOURCE,
+        query='query_result({})'.format(expr),
+        type='query',
+        regex=RESULT_REGEX,
+        hide=2,
+        refresh=refresh,
+    )
+
+
+def main(args):
+    # Imported here: the benchmark pulls in the evaluator and TSDB, which
+    # dashboard modules using query_variable do not need.
+    from bench import (
+        DEFAULT_SCRAPE_INTERVAL, NOW, dashboard_metrics, generate,
+        range_variables, relative_time, resolve_variables,
+    )
+    from tsdb import MemoryTSDB
+
+    parser = argparse.ArgumentParser(prog='variables')
+    parser.add_argument(
+        'dashboards', metavar='DASHBOARD', nargs='*',
+        help='Dashboard definitions (default: every *.dashboard.py)',
+    )
+    parser.add_argument(
+        '--instances', '-n', type=int, default=50,
+        help='Synthetic instances per exporter (default: %(default)s)',
+    )
+    opts = parser.parse_args(args)
+
+    scrape = promql.parse_duration(DEFAULT_SCRAPE_INTERVAL)
+    for path in opts.dashboards or find_dashboards():
+        module = load_module(path)
+        dashboard = module.dashboard
+        # Lookups only read the series index, a single sample is enough.
+        db = generate(MemoryTSDB(), dashboard_metrics(module), opts.instances,
+                      relative_time('now-' + DEFAULT_SCRAPE_INTERVAL), NOW, scrape)
+        builtins = range_variables(relative_time(dashboard.time.start), NOW)
+        _, every = resolve_variables(dashboard, db, builtins=builtins)
+        _, single = resolve_variables(dashboard, db, select_all=False, builtins=builtins)
+        sys.stdout.write('{}:\n'.format(dashboard_name(path)))
+        for template in dashboard.templating.list:
+            if template.name not in every:
+                continue
+            sys.stdout.write('    {:<16} {:>7} series (all), {:>7} series (one selected)  {}\n'.format(
+                template.name, every[template.name], single[template.name], template.query))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))